@@ -0,0 +1,95 @@
+"""
+Acquire throughput of simultaneous workers against a local mongod: `MongoDatabase.claim_trace`
+(an expired lease taken by one update, a queued trace moved by find_one_and_delete + insert in a transaction)
+versus the former acquire (sorted find + delete + insert inside a multi-document transaction).
+Both are retried on every write conflict. Uses a scratch database which is dropped afterwards.
+
+Mongod must run as a replica set for the legacy transactions, e.g. `mongod --replSet rs0` + `rs.initiate()`.
+
+Usage: python -m benchmarks.acquire_throughput --trace-sessions-dir . --events Thread:Event
+       --mongo-url mongodb://localhost:27017 [--workers 50] [--traces 2000]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import pymongo.errors
+
+from exportana.database.broker import KEY_CREATION_DATE, MongoDatabase
+from exportana.models.trace_with_context import TraceInfoWithContext, TraceInProcessing
+
+DATABASE = "exportana_acquire_benchmark"
+
+
+async def fill_queue(db: MongoDatabase, traces: int):
+    start = datetime.now()
+    for i in range(traces):
+        await db.set_queued_trace(TraceInfoWithContext(
+            trace_name=f"20200101_000000_trace_{i}",
+            creation_date=start + timedelta(seconds=i)
+        ))
+
+
+async def legacy_acquire(db: MongoDatabase, worker_url: str, stats: dict):
+    while True:
+        try:
+            async with await db.start_session() as session, session.start_transaction():
+                cursor = db._queued_traces.find({}, session=session).sort(KEY_CREATION_DATE, 1).limit(1)
+                docs = await cursor.to_list(None)
+                if not docs:
+                    return None
+                trace = TraceInfoWithContext.parse_obj(docs[0])
+                await db.remove_queued_trace(trace, session)
+                await db.set_processing_trace(TraceInProcessing(**trace.dict(), worker_url=worker_url))
+                return trace
+        except pymongo.errors.PyMongoError:
+            stats["retries"] += 1
+
+
+async def claim_acquire(db: MongoDatabase, worker_url: str, stats: dict):
+    while True:
+        try:
+            return await db.claim_trace(worker_url, 0, datetime.now() + timedelta(hours=1))
+        except pymongo.errors.PyMongoError:
+            stats["retries"] += 1
+
+
+async def run(db: MongoDatabase, acquire, workers: int, traces: int) -> dict:
+    await db._queued_traces.delete_many({})
+    await db._traces_in_processing.delete_many({})
+    await fill_queue(db, traces)
+
+    stats = {"retries": 0, "acquired": 0}
+
+    async def worker(n: int):
+        while await acquire(db, f"worker_{n}", stats):
+            stats["acquired"] += 1
+
+    ts = perf_counter()
+    await asyncio.gather(*[worker(n) for n in range(workers)])
+    stats["seconds"] = perf_counter() - ts
+    stats["duplicates"] = stats["acquired"] - len(await db._traces_in_processing.distinct("_id"))
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--traces", type=int, default=2000)
+    args, _ = parser.parse_known_args()
+
+    db = MongoDatabase()
+    await db.init(DATABASE)
+    try:
+        for name, acquire in (("legacy transaction", legacy_acquire), ("atomic claim", claim_acquire)):
+            stats = await run(db, acquire, args.workers, args.traces)
+            print(f"{name:>18}: {stats['acquired'] / stats['seconds']:8.0f} acquires/s, "
+                  f"retries: {stats['retries']}, duplicates: {stats['duplicates']}")
+    finally:
+        await db._client.drop_database(DATABASE)
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+Short trace exports and `trace_remove` calls with a new AsyncElasticsearch client per call (the former way)
+versus the process wide client of `ElasticClients`.
+
+Without `--elastic` the calls go to a local Elasticsearch-compatible stand-in answering `_bulk` and
+`_delete_by_query` instantly, so the difference is the connection setup only; against a real cluster
+(and TLS) it is larger.
+
+Usage: python -m benchmarks.elastic_client_reuse --trace-sessions-dir . --events Thread:Event
+       [--elastic http://localhost:9200] [--traces 200] [--docs 200] [--concurrency 4]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+from time import perf_counter
+from typing import Callable, List
+
+from aiohttp import web
+from elasticsearch._async.client import AsyncElasticsearch
+
+from exportana.exporter.elastic_clients import ElasticClients
+from exportana.utils.cleanup import delete_traces_from_index
+
+INDEX = "exportana-client-benchmark"
+
+
+async def handle_bulk(request: web.Request) -> web.Response:
+    lines = [line for line in (await request.text()).splitlines() if line]
+    items = [{"index": {"status": 201}} for _ in lines[::2]]
+    return web.json_response({"took": 0, "errors": False, "items": items})
+
+
+async def handle_delete_by_query(request: web.Request) -> web.Response:
+    await request.read()
+    return web.json_response({"took": 0, "deleted": 0, "failures": []})
+
+
+async def start_stand_in() -> web.AppRunner:
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/_bulk", handle_bulk)
+    app.router.add_post("/{index}/_delete_by_query", handle_delete_by_query)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+
+def make_body(trace: int, docs: int) -> str:
+    lines = list()
+    for i in range(docs):
+        lines.append(json.dumps({"index": {"_index": INDEX, "_id": f"{trace}-{i}"}}))
+        lines.append(json.dumps({"Time": i, "frame": 16.6, "trace": trace}))
+    return "\n".join(lines) + "\n"
+
+
+async def export_trace(es: AsyncElasticsearch, trace: int, docs: int):
+    await es.bulk(body=make_body(trace, docs))
+
+
+async def remove_trace(es: AsyncElasticsearch, trace: int, docs: int):
+    await delete_traces_from_index(es, INDEX, str(trace), "benchmark", "0")
+
+
+async def run(hosts: List[str], call: Callable, shared: bool, traces: int, docs: int, concurrency: int) -> List[float]:
+    clients = ElasticClients()
+    latencies = list()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(trace: int):
+        async with semaphore:
+            start = perf_counter()
+            if shared:
+                await call(clients.get(hosts), trace, docs)
+            else:
+                es = AsyncElasticsearch(hosts=hosts, retry_on_timeout=True)
+                try:
+                    await call(es, trace, docs)
+                finally:
+                    await es.close()
+            latencies.append(perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(traces)))
+    await clients.close()
+    return latencies
+
+
+def report(name: str, latencies: List[float], elapsed: float):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"  {name:>16}: {len(latencies) / elapsed:8.1f} calls/s, "
+          f"mean {statistics.mean(latencies) * 1000:7.2f} ms, p95 {p95 * 1000:7.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--elastic", help="elasticsearch url, a local stand-in is used without it")
+    parser.add_argument("--traces", type=int, default=200)
+    parser.add_argument("--docs", type=int, default=200, help="documents per short trace")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args, _ = parser.parse_known_args()
+
+    runner = None
+    if args.elastic:
+        hosts = [args.elastic]
+    else:
+        runner = await start_stand_in()
+        port = runner.addresses[0][1]
+        hosts = [f"http://127.0.0.1:{port}"]
+    print(f"hosts: {', '.join(hosts)}, traces: {args.traces}, docs per trace: {args.docs}")
+
+    try:
+        for name, call in (("export", export_trace), ("trace_remove", remove_trace)):
+            print(f"{name}:")
+            for label, shared in (("client per call", False), ("shared client", True)):
+                start = perf_counter()
+                latencies = await run(hosts, call, shared, args.traces, args.docs, args.concurrency)
+                report(label, latencies, perf_counter() - start)
+    finally:
+        if runner:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+Event lookups of the compiled `EventMatcher` versus the former linear scan of the `--events` rules.
+Rules are a mix of exact names, `Key+` prefixes, `+Key` suffixes, `Pre*Suf` wildcards and `Thread+` thread rules,
+lookups are timer names of the known threads, about half of them matching some rule.
+The linear scan is timed on a sample of the lookups and extrapolated.
+First the matches are checked against `Event.is_compatible` on a smaller set of rules overlapping each other:
+a lookup matches iff some rule is compatible with it, and the matched rule is one of those. Exits with 1 otherwise.
+
+Usage: python -m benchmarks.event_matcher --trace-sessions-dir . --events Thread:Event
+       [--rules 10000] [--lookups 1000000] [--linear-lookups 200] [--check-rules 300] [--check-lookups 20000]
+"""
+import argparse
+import random
+import sys
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+from exportana.exporter.events import Event, Events
+
+THREADS = ("GameThread", "RenderThread 1", "RenderThread 2", "RHIThread", "GPU", "TaskGraphThreadNP 3")
+
+
+def make_rules(count: int, rnd: random.Random) -> List[str]:
+    rules = list()
+    for i in range(count):
+        kind = rnd.random()
+        thread = rnd.choice(("GameThread", "RHIThread", "GPU", "RenderThread+", "TaskGraphThread+"))
+        if kind < 0.6:
+            key = f"Timer_{i}"
+        elif kind < 0.75:
+            key = f"Prefix{i}_+"
+        elif kind < 0.85:
+            key = f"+_Suffix{i}"
+        else:
+            key = f"Wild{i}_*_Card{i}"
+        rules.append(f"{thread}:{key}/Alias {i}")
+    return rules
+
+
+def make_lookups(count: int, rules: int, rnd: random.Random) -> List[Tuple[str, str]]:
+    lookups = list()
+    for _ in range(count):
+        i = rnd.randrange(rules)
+        key = rnd.choice((f"Timer_{i}", f"Prefix{i}_Tick", f"Begin_Suffix{i}", f"Wild{i}_Big_Card{i}", f"Unknown_{i}"))
+        lookups.append((rnd.choice(THREADS), key))
+    return lookups
+
+
+def make_overlapping_rules(count: int, rnd: random.Random) -> List[str]:
+    """Short names of few letters, so the prefixes, suffixes and wildcards of the rules overlap a lot"""
+    def name() -> str:
+        return "".join(rnd.choice("abc") for _ in range(rnd.randint(0, 3)))
+
+    rules = list()
+    for i in range(count):
+        thread = rnd.choice(("GameThread", "RHIThread", "RenderThread+", "Render+", "+Thread 2"))
+        key = rnd.choice((name() or "a", f"{name()}+", f"+{name()}", f"{name()}*{name()}"))
+        rules.append(f"{thread}:{key}/Alias {i}")
+    return rules
+
+
+def check_matches(events: Events, lookups: List[Tuple[str, str]]) -> int:
+    """Number of the lookups the compiled matcher disagrees on with `Event.is_compatible`"""
+    mismatches = 0
+    for thread, key in lookups:
+        compatible = events.find_all_events(thread, key)
+        event = events.matcher.match(thread, key)
+        if (event is None) != (not compatible) or (event is not None and event not in compatible):
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"  mismatch: {thread}:{key} matched {event}, compatible {compatible}")
+    return mismatches
+
+
+def linear_find(events: List[Event], thread: str, key: str) -> Optional[Event]:
+    for event in events:
+        if event.is_compatible(thread, key):
+            return event
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=1000000)
+    parser.add_argument("--linear-lookups", type=int, default=200)
+    parser.add_argument("--check-rules", type=int, default=300)
+    parser.add_argument("--check-lookups", type=int, default=20000)
+    args, _ = parser.parse_known_args()
+
+    rnd = random.Random(1)
+    check_events = Events(make_overlapping_rules(args.check_rules, rnd))
+    check_lookups = [
+        (rnd.choice(THREADS + ("Render", "Thread 2")), "".join(rnd.choice("abc") for _ in range(rnd.randint(1, 6))))
+        for _ in range(args.check_lookups)
+    ]
+    mismatches = check_matches(check_events, check_lookups)
+    print(f"check: {args.check_rules} rules, {args.check_lookups} lookups, {mismatches} mismatches")
+    if mismatches:
+        sys.exit(1)
+
+    events = Events(make_rules(args.rules, rnd))
+    lookups = make_lookups(args.lookups, args.rules, rnd)
+    print(f"rules: {args.rules}, lookups: {args.lookups}")
+
+    start = perf_counter()
+    matcher = events.matcher
+    print(f"  compile: {(perf_counter() - start) * 1000:8.1f} ms")
+
+    start = perf_counter()
+    matched = sum(1 for thread, key in lookups if matcher.match(thread, key) is not None)
+    elapsed = perf_counter() - start
+    print(f"  compiled: {elapsed:8.2f} s, {args.lookups / elapsed:12.0f} lookups/s, {matched} matched")
+
+    ordered = events._ordered
+    sample = lookups[:args.linear_lookups]
+    start = perf_counter()
+    for thread, key in sample:
+        linear_find(ordered, thread, key)
+    elapsed = (perf_counter() - start) / len(sample) * args.lookups
+    print(f"  linear:   {elapsed:8.2f} s, {args.lookups / elapsed:12.0f} lookups/s (extrapolated from {len(sample)})")
+
+
+if __name__ == "__main__":
+    main()
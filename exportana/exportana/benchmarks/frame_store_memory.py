@@ -0,0 +1,112 @@
+"""
+Compares memory per received frame of the columnar `FrameStore` and of the former
+representation (flattened dict + untouched raw dict per frame), and the peak while exporting them:
+the former export built every document up front, the store feeds the bulk indexer lazily.
+
+Usage: python -m benchmarks.frame_store_memory --trace-sessions-dir . --events Thread:Event [--frames 20000]
+"""
+import argparse
+import copy
+import random
+import tracemalloc
+from itertools import islice
+
+from exportana.exporter.bulk import BulkSettings
+from exportana.exporter.frame_store import FrameStore
+from exportana.routes.metrics_receiver import EXCLUDED_KEYS
+from exportana.transactions.trace_export_transaction import metrics_processing
+from exportana.utils.utils import flatten_dict
+
+THREADS = ["GameThread", "RenderThread 1", "GPU"]
+TIMERS_PER_THREAD = 40
+
+
+def make_frame(i: int) -> dict:
+    frame = {"FrameStart": i * 16.6, "FrameEnd": i * 16.6 + 16.0}
+    for thread in THREADS:
+        frame[thread] = {
+            f"Timer{t}": {"_Duration": random.random() * 5, "_Children": {"Inner": {"_Duration": random.random()}}}
+            for t in range(TIMERS_PER_THREAD)
+        }
+    frame["Map"] = "/Game/Maps/Benchmark"
+    return frame
+
+
+def measure(frames_count: int, fill) -> int:
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    storage = fill(frames_count)
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del storage
+    return end - start
+
+
+def measure_export_peak(frames_count: int, fill, export) -> int:
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    storage = fill(frames_count)
+    export(storage)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del storage
+    return peak - start
+
+
+def consume_in_chunks(docs):
+    """Holds one bulk chunk at a time, as the bulk indexer does."""
+    docs = iter(docs)
+    while list(islice(docs, BulkSettings.chunk_size)):
+        pass
+
+
+def export_legacy(frames):
+    prepared = dict()
+    for flat, raw in frames:
+        doc = dict(flat)
+        doc["settings"] = copy.deepcopy(raw)
+        prepared[raw["FrameStart"]] = doc
+    consume_in_chunks(prepared.items())
+
+
+def export_frame_store(store: FrameStore):
+    docs = (metrics_processing(store, i, (None, None)) for i in range(len(store)))
+    consume_in_chunks(docs)
+
+
+def fill_legacy(frames_count: int):
+    frames = list()
+    for i in range(frames_count):
+        raw = make_frame(i)
+        frames.append((flatten_dict(raw, EXCLUDED_KEYS), raw))
+    return frames
+
+
+def fill_frame_store(frames_count: int):
+    store = FrameStore(EXCLUDED_KEYS)
+    for i in range(frames_count):
+        store.append(make_frame(i))
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=20000)
+    args, _ = parser.parse_known_args()
+
+    legacy = measure(args.frames, fill_legacy)
+    columnar = measure(args.frames, fill_frame_store)
+    print(f"frames: {args.frames}, metrics per frame: {len(THREADS) * TIMERS_PER_THREAD * 2}")
+    print(f"legacy (dict pairs): {legacy / args.frames:10.0f} bytes/frame")
+    print(f"columnar FrameStore: {columnar / args.frames:10.0f} bytes/frame")
+    print(f"ratio: {legacy / columnar:.1f}x")
+
+    legacy = measure_export_peak(args.frames, fill_legacy, export_legacy)
+    columnar = measure_export_peak(args.frames, fill_frame_store, export_frame_store)
+    print(f"export peak, legacy (prepared dict):  {legacy / args.frames:10.0f} bytes/frame")
+    print(f"export peak, FrameStore (lazy docs): {columnar / args.frames:10.0f} bytes/frame")
+    print(f"ratio: {legacy / columnar:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Replays a queue history against the queue policies and reports mean and p95 queue wait of each.
+
+The history is the NDJSON dump of the ready traces (GET /manager/trace/ready/dump): a trace arrives at its
+`creation_date` and takes as long as its last processing did. Without `--history` a synthetic day is generated:
+frequent small PR-check traces, master traces and a few big soak-test traces.
+
+Usage: python -m benchmarks.queue_policies --trace-sessions-dir . --events Thread:Event
+       [--history ready.ndjson] [--workers 4] [--aging-minutes 120]
+"""
+import argparse
+import heapq
+import json
+import random
+import statistics
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from exportana.configs import QueuePolicy
+from exportana.exporter.scheduling import QueueOrder, branch_priority
+from exportana.models.trace_with_context import TraceInfoWithContext
+
+MB = 1024 * 1024
+
+
+@dataclass
+class Job:
+    trace: TraceInfoWithContext
+    duration: timedelta
+    branch: Optional[str]
+    wait: Optional[timedelta] = None
+
+
+def make_job(name: str, arrival: datetime, duration_sec: float, size: Optional[int], branch: Optional[str]) -> Job:
+    trace = TraceInfoWithContext(
+        trace_name=name,
+        creation_date=arrival,
+        trace_size=size,
+        priority=branch_priority(branch)
+    )
+    return Job(trace=trace, duration=timedelta(seconds=duration_sec), branch=branch)
+
+
+def load_history(path: str) -> List[Job]:
+    jobs = list()
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            doc = json.loads(line)
+            report = (doc.get("processing_reports") or [{}])[-1]
+            trace_meta = report.get("trace_meta") or {}
+            started, processed = trace_meta.get("started_timestamp"), trace_meta.get("processed_timestamp")
+            if not doc.get("creation_date") or not started or not processed:
+                continue
+            jobs.append(make_job(
+                doc["_id"],
+                datetime.fromisoformat(doc["creation_date"]),
+                processed - started,
+                doc.get("trace_size"),
+                trace_meta.get("branch")
+            ))
+    return jobs
+
+
+def generate_history(seed: int = 1) -> List[Job]:
+    rnd = random.Random(seed)
+    start = datetime(2022, 1, 1)
+    jobs = list()
+    kinds = (
+        # branch, arrivals per hour, size range MB, processing MB per second
+        ("feature/pr-check", 40, (50, 300), 1),
+        ("master", 2, (300, 1500), 1),
+        ("feature/soak-test", 0.5, (5000, 10000), 1),
+    )
+    for branch, per_hour, (size_min, size_max), mb_per_sec in kinds:
+        t = start
+        while t < start + timedelta(days=1):
+            t += timedelta(hours=rnd.expovariate(per_hour))
+            size = rnd.randint(size_min, size_max) * MB
+            jobs.append(make_job(f"{branch}-{len(jobs)}", t, size / MB / mb_per_sec, size, branch))
+    return jobs
+
+
+def simulate(jobs: List[Job], workers: int, order: QueueOrder):
+    arrivals = sorted(jobs, key=lambda j: j.trace.creation_date)
+    free_at: List[datetime] = [arrivals[0].trace.creation_date] * workers
+    heapq.heapify(free_at)
+    queue: List[Job] = list()
+    i = 0
+    while i < len(arrivals) or queue:
+        now = heapq.heappop(free_at)
+        if not queue and arrivals[i].trace.creation_date > now:
+            now = arrivals[i].trace.creation_date
+        while i < len(arrivals) and arrivals[i].trace.creation_date <= now:
+            queue.append(arrivals[i])
+            i += 1
+        key = order.sort_key(now)
+        job = min(queue, key=lambda j: key(j.trace))
+        queue.remove(job)
+        job.wait = now - job.trace.creation_date
+        heapq.heappush(free_at, now + job.duration)
+
+
+def p95(values: List[float]) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+def report(name: str, jobs: List[Job], median_duration: timedelta):
+    groups: Dict[str, List[Job]] = {
+        "all": jobs,
+        "master/release": [j for j in jobs if j.trace.priority],
+        "other branches": [j for j in jobs if not j.trace.priority],
+        "short jobs": [j for j in jobs if j.duration <= median_duration],
+        "long jobs": [j for j in jobs if j.duration > median_duration],
+    }
+    print(f"{name}:")
+    for group, group_jobs in groups.items():
+        if not group_jobs:
+            continue
+        waits = [j.wait.total_seconds() / 60 for j in group_jobs]
+        print(f"  {group:>15}: {len(waits):6} traces, "
+              f"mean wait {statistics.mean(waits):8.1f} min, p95 wait {p95(waits):8.1f} min")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", help="NDJSON dump of the ready traces")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--aging-minutes", type=float, default=120)
+    args, _ = parser.parse_known_args()
+
+    jobs = load_history(args.history) if args.history else generate_history()
+    if not jobs:
+        print("No traces to replay")
+        return
+    median_duration = sorted(j.duration for j in jobs)[len(jobs) // 2]
+    print(f"traces: {len(jobs)}, workers: {args.workers}, aging: {args.aging_minutes} min")
+
+    for policy in QueuePolicy:
+        order = QueueOrder(policy, timedelta(minutes=args.aging_minutes))
+        simulate(jobs, args.workers, order)
+        report(policy.value, jobs, median_duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,31 @@ import asyncio
 import logging
 from asyncio import Task
 from dataclasses import dataclass
+from typing import List
 
 import uvicorn
 from fastapi import FastAPI, Request
 from prometheus_client import start_http_server
 from watchdog.observers.api import BaseObserver
 
-from .configs import Configs, WorkMode
+from .configs import Configs, WorkMode, concurrent_traces
 from .database.broker import MongoDatabase
+from .exporter.bulk import shutdown_serialize_executor
 from .exporter.constants import DEFAULT_PORT
-from .exporter.manager import enqueue_unprocessed_traces
-from .models.worker import WorkerInfo, WorkerStatus
-from .routes import common, manager, worker
-from .routes import metrics_receiver
+from .exporter.elastic_clients import elastic_clients
+from .exporter.events import Events
+from .exporter.index_cache import index_cache
+from .exporter.integrations import integrations
+from .exporter.manager import enqueue_unprocessed_traces, recount_traces_stats_loop
+from .exporter.worker import heartbeat_loop
+from .exporter.workers_monitor import workers_monitor
+from .models.worker import WorkerHeartbeat, WorkerInfo, WorkerStatus
+from .routes import common, manager, metrics_receiver, worker
 from .transactions.transactions_work_loop import transactions_work_loop
-from .utils.monitoring import set_ready_traces_count, set_poisoned_traces_count, set_traces_queue_count
+from .utils import tracing
+from .utils.hostname_resolver import hostname_resolver
+from .utils.monitoring import set_traces_stats
+from .utils.resources import ResourceSampler
 
 log = logging.getLogger(__name__)
 
@@ -40,6 +50,7 @@ def manager_factory():
     @dataclass
     class ManagerData:
         database: MongoDatabase = None
+        recount_task: Task = None
 
     data = ManagerData(database=MongoDatabase())
 
@@ -51,33 +62,38 @@ def manager_factory():
 
     @app.on_event("startup")
     async def startup():
-        data.database.init()
+        await data.database.init()
 
         await init_prometheus_target_service()
+        elastic_clients.maxsize = Configs.elastic_maxsize
 
         if Configs.fix:
             await enqueue_unprocessed_traces(data.database)
 
+        data.recount_task = asyncio.create_task(
+            recount_traces_stats_loop(data.database, Configs.stats_recount_minutes)
+        )
+        workers_monitor.start(
+            data.database,
+            Configs.worker_status_interval_sec,
+            Configs.worker_status_timeout_sec,
+            Configs.worker_heartbeat_ttl_sec
+        )
+
     @app.on_event("shutdown")
     async def shutdown():
         log.info(f"Going offline...")
 
+        data.recount_task.cancel()
+        await workers_monitor.close()
+        await elastic_clients.close()
         data.database.close()
 
     async def init_prometheus_target_service():
         # start metrics aggregator server for prometheus
         start_http_server(addr="0.0.0.0", port=Configs.exportana_metrics_port)
 
-        db: MongoDatabase = data.database
-        async with await db.start_session() as session, session.start_transaction():
-            traces_count = await db.get_queued_trace_count(session)
-            set_traces_queue_count(traces_count)
-
-            traces_count = await db.get_ready_trace_count(session)
-            set_ready_traces_count(traces_count)
-
-            traces_count = await db.get_poisoned_trace_count(session)
-            set_poisoned_traces_count(traces_count)
+        set_traces_stats(await data.database.recount_traces_stats())
 
     return app
 
@@ -96,8 +112,32 @@ def worker_factory():
     worker_name = f"{Configs.worker_name}:{Configs.port or DEFAULT_PORT}"
 
     class Data:
-        task: Task = None
-        worker: WorkerInfo = None
+        tasks: List[Task] = None
+        workers: List[WorkerInfo] = None
+        heartbeat_task: Task = None
+        resources: ResourceSampler = None
+
+        @property
+        def worker(self) -> WorkerInfo:
+            """Status of the whole worker, aggregated over its slots"""
+            working = [w for w in self.workers if w.status == WorkerStatus.working]
+            return WorkerInfo(
+                url=worker_name,
+                status=WorkerStatus.working if working else WorkerStatus.idle,
+                trace_name=working[0].trace_name if working else None,
+                trace_names=[w.trace_name for w in working if w.trace_name]
+            )
+
+        def heartbeat(self) -> WorkerHeartbeat:
+            worker = self.worker
+            return WorkerHeartbeat(
+                **worker.dict(),
+                slots=len(self.workers),
+                busy_slots=len([w for w in self.workers if w.status == WorkerStatus.working]),
+                cpu_percent=self.resources.cpu_percent(),
+                rss_bytes=self.resources.rss_bytes(),
+                free_disk_bytes=self.resources.free_disk_bytes()
+            )
 
     data = Data()
 
@@ -109,16 +149,42 @@ def worker_factory():
 
     @app.on_event("startup")
     async def startup():
-        data.worker = WorkerInfo(url=worker_name, status=WorkerStatus.idle)
-        data.task = asyncio.create_task(transactions_work_loop(data.worker))
+        tracing.configure(Configs.spans_dir)
+        index_cache.ttl_sec = Configs.index_cache_ttl_sec
+        integrations.start(Configs.integrations_timeout_sec)
+        elastic_clients.maxsize = Configs.elastic_maxsize
+        hostname_resolver.configure(
+            Configs.dns_cache_ttl_sec,
+            Configs.dns_negative_ttl_sec,
+            Configs.dns_timeout_sec,
+            Configs.hosts_file
+        )
+        metrics_receiver.set_event_filter(Events(Configs.events).matcher if Configs.filter_events else None)
+        if Configs.max_concurrent_traces > 1 and not Configs.insights_posting_sessions:
+            log.warning(
+                f"--max-concurrent-traces {Configs.max_concurrent_traces} needs an Unreal Insights build "
+                f"posting to the receiver sessions, set --insights-posting-sessions. Processing one trace at a time"
+            )
+        data.workers = [
+            WorkerInfo(url=worker_name, slot=slot, status=WorkerStatus.idle)
+            for slot in range(concurrent_traces(Configs))
+        ]
+        data.tasks = [asyncio.create_task(transactions_work_loop(worker)) for worker in data.workers]
+        data.resources = ResourceSampler(Configs.trace_sessions_dir)
+        data.heartbeat_task = asyncio.create_task(heartbeat_loop(data.heartbeat, Configs.heartbeat_interval_sec))
 
     @app.on_event("shutdown")
     async def shutdown():
         SLEEP_TIME_SEC = 5
         log.info(f"Going offline...")
-        data.task.cancel()
-        while not data.task.done():
+        data.heartbeat_task.cancel()
+        for task in data.tasks:
+            task.cancel()
+        while not all(task.done() for task in data.tasks):
             log.info(f"Closing of the app in progress...")
             await asyncio.sleep(SLEEP_TIME_SEC)
+        await integrations.close()
+        await elastic_clients.close()
+        shutdown_serialize_executor()
 
     return app
@@ -3,7 +3,8 @@ import logging.config
 import os
 
 from .app import start_app
-from .configs import Configs, create_logging_configs, WorkMode
+from .configs import Configs, WorkMode, create_logging_configs
+from .exporter.constants import DEFAULT_ELASTICSEARCH_INDEX_PREFIX
 from .utils.cleanup import CleanupTracesInfo, schedule_cleanup_traces
 
 
@@ -25,7 +26,14 @@ def main():
                 cleanup_master_days=float(Configs.cleanup_master_days),
                 cleanup_release_days=float(Configs.cleanup_release_days),
                 cleanup_branches_days=float(Configs.cleanup_branches_days),
-                cleanup_interval_hours=float(Configs.cleanup_interval_hours)
+                cleanup_interval_hours=float(Configs.cleanup_interval_hours),
+                cleanup_concurrency=Configs.cleanup_concurrency,
+                disk_eviction=Configs.cleanup_disk_eviction,
+                alert_disk_space=Configs.alert_disk_space,
+                elastic=Configs.elastic,
+                index_prefix=Configs.elasticsearch_index_prefix or DEFAULT_ELASTICSEARCH_INDEX_PREFIX,
+                index_retention_days=float(Configs.index_retention_days),
+                dry_run=Configs.dry_run
             )
         )
     # endregion
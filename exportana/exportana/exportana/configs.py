@@ -7,16 +7,18 @@ from typing import Optional
 from configargparse import ArgParser, YAMLConfigFileParser
 
 from .exporter.constants import (
+    DEF_INDEX_FIELDS_LIMIT,
+    DEFAULT_ACQUIRE_WAIT_SEC,
     DEFAULT_ALERT_DISK_SPACE,
     DEFAULT_ALERT_FROM,
+    DEFAULT_ELASTICSEARCH_INDEX_PREFIX,
     DEFAULT_ES_DSN,
     DEFAULT_INSIGHTS_URL,
+    DEFAULT_MANAGER_URL,
     DEFAULT_PERFANA_DSN,
     DEFAULT_SMTP,
-    DEFAULT_MANAGER_URL,
-    DEFAULT_ELASTICSEARCH_INDEX_PREFIX,
+    DEFAULT_STREAMING_QUEUE_SIZE,
     INF,
-    DEF_INDEX_FIELDS_LIMIT
 )
 
 __ALL__ = ["Configs"]
@@ -144,11 +146,47 @@ def int_or_none(value) -> Optional[int]:
         return value
 
 
+def concurrent_traces(args) -> int:
+    """
+    Number of traces the worker processes at the same time. More than one needs an Unreal Insights build
+    posting to the receiver sessions (-VSPRemoteReportPostingSession), until it is declared there is one.
+    """
+    if not args.insights_posting_sessions:
+        return 1
+    return max(args.max_concurrent_traces, 1)
+
+
 class WorkMode(str, Enum):
     Manager = "manager"
     Worker = "worker"
 
 
+class ExportLayout(str, Enum):
+    # every frame document carries the trace metadata and the raw frame
+    Flat = "flat"
+    # trace metadata and settings are documents of their own, frame documents refer to them by `test_id`
+    Normalized = "normalized"
+
+
+class QueuePolicy(str, Enum):
+    Fifo = "fifo"
+    # master/release traces first
+    Branch = "branch"
+    # smallest traces first
+    ShortestJobFirst = "sjf"
+
+
+class IndexRollover(str, Enum):
+    # one plain index per index name
+    Disabled = "none"
+    # the index name is a write alias over indices rolled over by age
+    Daily = "daily"
+    Weekly = "weekly"
+    Monthly = "monthly"
+    # rolled over by `--index-rollover-max-size` only
+    Size = "size"
+
+
 def _create_parser():
     p = ArgParser(default_config_files=["exportana.conf"], config_file_parser_class=YAMLConfigFileParser)
     # region Base settings
@@ -162,6 +200,18 @@ def _create_parser():
     )
     p.add_argument("--perfana", default=DEFAULT_PERFANA_DSN, help="perfana url", env_var="EXPORT_PERFANA")
     p.add_argument("--bitbucket", help="bitbucket url", env_var="EXPORT_BITBUCKET")
+    p.add_argument(
+        "--integrations-timeout-sec",
+        type=float,
+        help="Timeout of the perfana and bitbucket requests",
+        default=30
+    )
+    p.add_argument(
+        "--elastic-maxsize",
+        type=int,
+        help="Connections per elasticsearch host kept by the process wide client",
+        default=10
+    )
     p.add_argument("--elasticsearch-index-prefix", default=DEFAULT_ELASTICSEARCH_INDEX_PREFIX,
                    help="elasticsearch index prefix for the exportana")
     p.add_argument("-t", "--trace", help="name of the trace", env_var="EXPORT_TRACE")
@@ -171,6 +221,24 @@ def _create_parser():
     p.add_argument("--title", help="Overrides title field in perfana", env_var="EXPORT_TITLE")
     p.add_argument("--build", help="Overrides build field in perfana", env_var="EXPORT_BUILD")
     p.add_argument("--workstation", help="Overrides workstation field in perfana", env_var="EXPORT_WORKSTATION")
+    p.add_argument(
+        "--hosts-file",
+        help="Static '<ip> <hostname>' mapping of the workstations, takes precedence over reverse DNS",
+        env_var="EXPORT_HOSTS_FILE"
+    )
+    p.add_argument("--dns-timeout-sec", type=float, help="Reverse DNS lookup timeout of a workstation", default=1)
+    p.add_argument(
+        "--dns-cache-ttl-sec",
+        type=float,
+        help="How long a back resolved workstation name is cached",
+        default=3600
+    )
+    p.add_argument(
+        "--dns-negative-ttl-sec",
+        type=float,
+        help="How long a workstation that could not be back resolved is not looked up again",
+        default=300
+    )
     p.add_argument("--watch", help="watch directory", action="store_true", env_var="EXPORT_WATCH")
     p.add_argument("--gui", help="launch unreal insights with gui", action="store_true")
     p.add_argument("--list", help="list traces", action="store_true")
@@ -181,6 +249,13 @@ def _create_parser():
         help="Events to process. Available formats: 'ThreadName1:MetricName1/MetricAlias1', 'ThreadName2:MetricName2', 'ThreadName3:MetricName+/MetricAlias1'",
         action="append"
     )
+    p.add_argument(
+        "--filter-events",
+        help="Drop the timers of the received frames which match none of the --events. Nested timers are matched "
+             "along the _Children tree, a timer is kept whole if it matches or with its matching descendants only",
+        action="store_true",
+        env_var="EXPORT_FILTER_EVENTS"
+    )
     p.add_argument("--bookmark-metadata", help="additional bookmark METADATA to capture", action="append")
     p.add_argument("--normalize", help="normalize traces by bookmark events", action="append")
     p.add_argument("--trace-info", help="bookmark name with trace info")
@@ -196,6 +271,14 @@ def _create_parser():
     p.add_argument("--dry-run", help="test action", action="store_true")
     p.add_argument("--same-index", help="update same index for traces", action="store_false")
     p.add_argument("-d", "--dump-mapping", help="dump mapping before exporting", action="store_true")
+    p.add_argument(
+        "--export-layout",
+        default=ExportLayout.Flat,
+        choices=list(map(lambda m: m.value, ExportLayout)),
+        help="Layout of the documents exported to elasticsearch",
+        type=ExportLayout,
+        env_var="EXPORT_LAYOUT"
+    )
     p.add_argument(
         "-l", "--log-level",
         default=_log_levels[1],
@@ -213,6 +296,34 @@ def _create_parser():
     p.add_argument("--logstash-port", type=int, help="logstash port")
 
     p.add_argument("--elastic_mapping_limit", type=int, help="elastic mapping limit", default=DEF_INDEX_FIELDS_LIMIT)
+    p.add_argument("--index-shards", type=int, help="Number of shards of the new elasticsearch indices", default=1)
+    p.add_argument(
+        "--index-rollover",
+        default=IndexRollover.Disabled,
+        choices=list(map(lambda m: m.value, IndexRollover)),
+        help="Write to aliases over elasticsearch indices rolled over by age and/or size. "
+             "A plain index kept from before (with the default --same-index) is left as is, "
+             "its traces go to the <index>-rollover alias",
+        type=IndexRollover,
+        env_var="EXPORTANA_INDEX_ROLLOVER"
+    )
+    p.add_argument(
+        "--index-rollover-max-size",
+        help="Primary shards size to roll an index over at (eg. 50gb), with --index-rollover",
+        default=None
+    )
+    p.add_argument(
+        "--index-retention-days",
+        help="Rolled over indices with data older than this are deleted by the manager",
+        action="store",
+        default=INF
+    )
+    p.add_argument(
+        "--index-cache-ttl-sec",
+        type=float,
+        help="How long a worker trusts what it knows about an elasticsearch index mapping and settings",
+        default=300
+    )
     # endregion
 
     # region Cleanup settings
@@ -247,6 +358,17 @@ def _create_parser():
         default=INF
     )
     p.add_argument("--cleanup-ignore", help="Ignore traces during cleanup", action="append")
+    p.add_argument(
+        "--cleanup-concurrency",
+        help="Number of trace files removed in parallel during cleanup",
+        type=int,
+        default=4
+    )
+    p.add_argument(
+        "--cleanup-disk-eviction",
+        help="Remove processed traces as soon as free disk space drops below --alert-disk-space",
+        action="store_true"
+    )
     # endregion
 
     # region Manager/Worker configs
@@ -296,6 +418,131 @@ def _create_parser():
         help="Set thread pool size for csv files processing",
         default=multiprocessing.cpu_count()
     )
+    p.add_argument("--bulk-chunk-size", type=int, help="Max documents per elasticsearch bulk request", default=500)
+    p.add_argument(
+        "--bulk-max-chunk-bytes",
+        type=int,
+        help="Max bytes per elasticsearch bulk request",
+        default=100 * 1024 * 1024
+    )
+    p.add_argument("--bulk-concurrency", type=int, help="Elasticsearch bulk requests in flight", default=2)
+    p.add_argument(
+        "--bulk-max-retries",
+        type=int,
+        help="Resends of documents rejected by elasticsearch with HTTP 429",
+        default=5
+    )
+    p.add_argument(
+        "--spans-dir",
+        help="Directory to write the spans of each processed trace to, as OTLP JSON. No spans are recorded without it",
+        default=None
+    )
+    p.add_argument(
+        "--profile-dir",
+        help="Directory to write cProfile dumps of the slow traces to. No profiling without it. "
+             "A dump covers the whole event loop while the trace ran, the other traces and requests included",
+        default=None
+    )
+    p.add_argument(
+        "--profile-slower-than-sec",
+        type=float,
+        help="Profiles of the traces processed faster than this are dropped",
+        default=600
+    )
+    p.add_argument(
+        "--max-concurrent-traces",
+        type=int,
+        help="Number of traces processed by the worker at the same time, with --insights-posting-sessions",
+        default=1,
+        env_var="EXPORTANA_MAX_CONCURRENT_TRACES"
+    )
+    p.add_argument(
+        "--insights-posting-sessions",
+        help="Unreal Insights understands -VSPRemoteReportPostingSession and posts the metrics of each trace "
+             "to its own receiver session, required to process traces concurrently",
+        action="store_true",
+        env_var="EXPORTANA_INSIGHTS_POSTING_SESSIONS"
+    )
+    p.add_argument(
+        "--trace-lease-hours",
+        type=float,
+        help="A trace whose worker neither reports it nor sends heartbeats within this time is handed to another worker",
+        default=12
+    )
+    p.add_argument(
+        "--queue-policy",
+        default=QueuePolicy.Fifo,
+        choices=list(map(lambda m: m.value, QueuePolicy)),
+        help="Order in which queued traces are handed to the workers",
+        type=QueuePolicy,
+        env_var="EXPORTANA_QUEUE_POLICY"
+    )
+    p.add_argument(
+        "--queue-aging-minutes",
+        type=float,
+        help="With `branch` and `sjf` queue policies a trace waiting longer goes first",
+        default=120
+    )
+    p.add_argument(
+        "--stats-recount-minutes",
+        type=float,
+        help="Interval of the full recount of queued/ready/poisoned traces, maintained incrementally in between",
+        default=10
+    )
+    p.add_argument(
+        "--heartbeat-interval-sec",
+        type=float,
+        help="How often the worker pushes its status and resource usage to the manager",
+        default=5
+    )
+    p.add_argument(
+        "--worker-heartbeat-ttl-sec",
+        type=float,
+        help="A worker without heartbeats for this time is considered offline",
+        default=60
+    )
+    p.add_argument(
+        "--worker-max-cpu-percent",
+        type=float,
+        help="The manager hands no new traces to a worker whose process and its children (UnrealInsights) "
+             "use more CPU (100 is one core)",
+        default=None
+    )
+    p.add_argument(
+        "--worker-min-free-disk",
+        help="The manager hands no new traces to a worker with less free disk space (eg. 5GB), not checked if unset",
+        default=None
+    )
+    p.add_argument(
+        "--worker-status-interval-sec",
+        type=float,
+        help="How often the manager polls the statuses of the workers",
+        default=10
+    )
+    p.add_argument(
+        "--worker-status-timeout-sec",
+        type=float,
+        help="A worker not answering its status within this time is reported offline",
+        default=2
+    )
+    p.add_argument(
+        "--acquire-wait-sec",
+        type=float,
+        help="How long the manager holds the worker's request for a trace until something is queued",
+        default=DEFAULT_ACQUIRE_WAIT_SEC
+    )
+    p.add_argument(
+        "--streaming-export",
+        help="Push frames to elasticsearch while Unreal Insights is still posting them",
+        action="store_true",
+        env_var="EXPORTANA_STREAMING_EXPORT"
+    )
+    p.add_argument(
+        "--streaming-queue-size",
+        type=int,
+        help="Max number of received frame batches waiting for the streaming export",
+        default=DEFAULT_STREAMING_QUEUE_SIZE
+    )
     # endregion
     return p
 
@@ -307,3 +554,6 @@ if not len(sys.argv) > 1:
     exit(1)
 
 Configs, _ = _parser.parse_known_args()
+
+if Configs.filter_events and not Configs.events:
+    _parser.error("--filter-events needs --events, otherwise every timer of the received frames is dropped")
@@ -1,22 +1,54 @@
+import base64
+import json
 import logging
-from datetime import datetime
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from enum import Enum
-from typing import Optional, List, Type, Union
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Type, Union
 
-from motor.core import AgnosticDatabase, AgnosticCollection, AgnosticClient
+from motor.core import AgnosticClient, AgnosticCollection, AgnosticDatabase
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReturnDocument
 from pymongo.client_session import ClientSession
+from pymongo.errors import BulkWriteError
 
-from ..configs import Configs
-from ..models.base import DBModel, AnyDBModel, get_id
+from ..configs import Configs, QueuePolicy
+from ..exporter.scheduling import QUEUE_INDEXES, QueueOrder
+from ..models.base import AnyDBModel, DBModel, get_id
 from ..models.trace_with_context import TraceInfoWithContext, TraceInProcessing
-from ..models.traces import ProcessedTraceInfo, TraceInfo
+from ..models.traces import (
+    BranchClass,
+    ProcessedTraceInfo,
+    ProcessedTracesPage,
+    ProcessedTraceSummary,
+    TraceInfo,
+    TracesStats,
+)
+from ..models.worker import WorkerHeartbeat
 
 __ALL__ = ["MongoDatabase"]
 
 log = logging.getLogger(__name__)
 
 DATABASE = "exportana"
+KEY_CREATION_DATE = "creation_date"
+KEY_LEASE_EXPIRY = "lease_expiry"
+KEY_WORKER_URL = "worker_url"
+KEY_WORKER_SLOT = "worker_slot"
+KEY_LAST_SEEN = "last_seen"
+DUPLICATE_KEY_ERROR = 11000
+TRACES_STATS_ID = "traces_stats"
+KEY_LAST_PROCESSED_DATE = "last_processed_date"
+KEY_PROCESSING_REPORTS = "processing_reports"
+KEY_BRANCH_CLASS = "branch_class"
+PROCESSED_TRACES_SORT = [(KEY_LAST_PROCESSED_DATE, ASCENDING), ("_id", ASCENDING)]
+# summary fields of a processed trace: everything but the history of reports, except the last one
+PROCESSED_TRACE_SUMMARY_PROJECTION = {
+    KEY_CREATION_DATE: 1,
+    KEY_LAST_PROCESSED_DATE: 1,
+    KEY_PROCESSING_REPORTS: {"$slice": -1}
+}
 
 
 class DBName(str, Enum):
@@ -24,6 +56,8 @@ class DBName(str, Enum):
     traces_in_processing = "traces_in_processing"
     ready_traces = "ready_traces"
     poisoned_traces = "poisoned_traces"
+    stats = "stats"
+    workers = "workers"
 
 
 class MongoDatabase:
@@ -34,19 +68,84 @@ class MongoDatabase:
     _traces_in_processing: AgnosticCollection = None
     _ready_traces: AgnosticCollection = None
     _poisoned_traces: AgnosticCollection = None
+    _stats: AgnosticCollection = None
+    _workers: AgnosticCollection = None
 
     # endregion
+    # stats increments of the running transactions by session, applied once they commit
+    _pending_stats: Dict[ClientSession, Counter] = None
 
     # region Base methods
 
-    def init(self):
+    async def init(self, database: str = DATABASE):
         self._client: AgnosticClient = AsyncIOMotorClient(host=Configs.mongo_url)
-        self._database: AgnosticDatabase = self._client[DATABASE]
+        self._database: AgnosticDatabase = self._client[database]
 
         self._queued_traces: AgnosticCollection = self._database[DBName.queued_traces]
         self._traces_in_processing: AgnosticCollection = self._database[DBName.traces_in_processing]
         self._ready_traces: AgnosticCollection = self._database[DBName.ready_traces]
         self._poisoned_traces: AgnosticCollection = self._database[DBName.poisoned_traces]
+        self._stats: AgnosticCollection = self._database[DBName.stats]
+        self._workers: AgnosticCollection = self._database[DBName.workers]
+        self._pending_stats = dict()
+
+        await self._create_indexes()
+
+    async def _create_indexes(self):
+        await self._queued_traces.create_index([(KEY_CREATION_DATE, ASCENDING)])
+        for keys in QUEUE_INDEXES:
+            await self._queued_traces.create_index(keys)
+        await self._traces_in_processing.create_index([(KEY_LEASE_EXPIRY, ASCENDING), (KEY_CREATION_DATE, ASCENDING)])
+        # trace_name is the _id of traces_in_processing, indexed already
+        await self._traces_in_processing.create_index([(KEY_WORKER_URL, ASCENDING), (KEY_WORKER_SLOT, ASCENDING)])
+        for collection in (self._ready_traces, self._poisoned_traces):
+            await collection.create_index(PROCESSED_TRACES_SORT)
+            await collection.create_index([(KEY_BRANCH_CLASS, ASCENDING), (KEY_LAST_PROCESSED_DATE, ASCENDING)])
+            await self._backfill_last_processed_date(collection)
+            await self._backfill_branch_class(collection)
+        await self._create_ttl_index(self._workers, KEY_LAST_SEEN, int(Configs.worker_heartbeat_ttl_sec))
+
+    @staticmethod
+    async def _create_ttl_index(collection: AgnosticCollection, field_name: str, expire_after_sec: int):
+        index_name = f"{field_name}_ttl"
+        indexes = await collection.index_information()
+        if index_name in indexes and indexes[index_name].get("expireAfterSeconds") != expire_after_sec:
+            # the ttl of an existing index can't be changed by create_index
+            await collection.drop_index(index_name)
+        await collection.create_index([(field_name, ASCENDING)], name=index_name, expireAfterSeconds=expire_after_sec)
+
+    @staticmethod
+    async def _backfill_last_processed_date(collection: AgnosticCollection):
+        """Docs written before `last_processed_date` was introduced get it from their last report"""
+        result = await collection.update_many(
+            {KEY_LAST_PROCESSED_DATE: {"$exists": False}},
+            [{"$set": {KEY_LAST_PROCESSED_DATE: {"$arrayElemAt": [f"${KEY_PROCESSING_REPORTS}.processed_date", -1]}}}]
+        )
+        if result.modified_count:
+            log.info(f"{collection.name}: last_processed_date set for {result.modified_count} doc(s)")
+
+    @staticmethod
+    async def _backfill_branch_class(collection: AgnosticCollection):
+        """Docs written before `branch_class` was introduced get it from the branch of their last report"""
+        last_branch = {"$let": {
+            "vars": {"report": {"$arrayElemAt": [f"${KEY_PROCESSING_REPORTS}", -1]}},
+            "in": "$$report.trace_meta.branch"
+        }}
+        result = await collection.update_many(
+            {KEY_BRANCH_CLASS: {"$exists": False}},
+            [{"$set": {KEY_BRANCH_CLASS: {"$let": {
+                "vars": {"branch": {"$ifNull": [last_branch, ""]}},
+                "in": {"$switch": {
+                    "branches": [
+                        {"case": {"$eq": ["$$branch", BranchClass.master.value]}, "then": BranchClass.master.value},
+                        {"case": {"$eq": ["$$branch", ""]}, "then": BranchClass.release.value},
+                    ],
+                    "default": BranchClass.branch.value
+                }}
+            }}}}]
+        )
+        if result.modified_count:
+            log.info(f"{collection.name}: branch_class set for {result.modified_count} doc(s)")
 
     def close(self):
         self._client.close()
@@ -54,8 +153,33 @@ class MongoDatabase:
     async def start_session(self) -> ClientSession:
         return await self._client.start_session()
 
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[ClientSession]:
+        """
+        A session with a transaction started. The traces stats are one doc, updating it inside every transaction
+        would make them all conflict, so the stats increments made within are applied once the transaction commits.
+        """
+        async with await self.start_session() as session:
+            pending = self._pending_stats[session] = Counter()
+            try:
+                async with session.start_transaction():
+                    yield session
+            finally:
+                del self._pending_stats[session]
+            # committed
+            values = {k: v for k, v in pending.items() if v}
+            if values:
+                await self._inc_stats(**values)
+
     # endregion
 
+    @staticmethod
+    def _worker_filter(worker_url: str, worker_slot: int) -> dict:
+        if worker_slot:
+            return {KEY_WORKER_URL: worker_url, KEY_WORKER_SLOT: worker_slot}
+        # docs written before worker slots have no worker_slot field
+        return {KEY_WORKER_URL: worker_url, KEY_WORKER_SLOT: {"$in": [0, None]}}
+
     # region Find any doc
     @staticmethod
     async def _find_doc(collection: AgnosticCollection,
@@ -88,19 +212,13 @@ class MongoDatabase:
     async def find_queued_trace(self, trace: Union[str, DBModel], session: ClientSession = None) -> Optional[TraceInfoWithContext]:
         return await self._find_doc(self._queued_traces, get_id(trace), TraceInfoWithContext, session)
 
-    async def find_processing_trace(self, worker_url: Union[str, DBModel], session: ClientSession = None) -> Optional[TraceInProcessing]:
-        traces_in_processing: List[TraceInProcessing] = await self._get_all_docs(self._traces_in_processing, TraceInProcessing, session)
-        for trace in traces_in_processing:
-            if trace.worker_url == worker_url:
-                return trace
-        return None
+    async def find_processing_trace(self, worker_url: Union[str, DBModel], worker_slot: int = 0,
+                                    session: ClientSession = None) -> Optional[TraceInProcessing]:
+        return await self._find_doc(self._traces_in_processing, self._worker_filter(worker_url, worker_slot),
+                                    TraceInProcessing, session)
 
     async def find_processing_trace_by_name(self, trace_name: Union[str, DBModel], session: ClientSession = None) -> Optional[TraceInProcessing]:
-        traces_in_processing: List[TraceInProcessing] = await self._get_all_docs(self._traces_in_processing, TraceInProcessing, session)
-        for trace in traces_in_processing:
-            if trace.trace_name == trace_name:
-                return trace
-        return None
+        return await self._find_doc(self._traces_in_processing, get_id(trace_name), TraceInProcessing, session)
 
     async def find_ready_trace(self, trace: Union[str, DBModel], session: ClientSession = None) -> Optional[ProcessedTraceInfo]:
         return await self._find_doc(self._ready_traces, get_id(trace), ProcessedTraceInfo, session)
@@ -109,10 +227,46 @@ class MongoDatabase:
                                   session: ClientSession = None) -> Optional[ProcessedTraceInfo]:
         return await self._find_doc(self._poisoned_traces, get_id(trace), ProcessedTraceInfo, session)
 
-    async def extract_trace_from_queue(self, session: ClientSession = None) -> Optional[TraceInfoWithContext]:
-        trace = await self._find_doc_sorted_by(self._queued_traces, {}, "creation_date", TraceInfoWithContext, session)
-        if trace:
-            await self.remove_queued_trace(trace, session)
+    async def extract_trace_from_queue(self,
+                                       session: ClientSession = None,
+                                       order: QueueOrder = None) -> Optional[TraceInfoWithContext]:
+        order = order or QueueOrder(QueuePolicy.Fifo)
+        for doc_filter, sort in order.mongo_queries(datetime.now()):
+            result = await self._queued_traces.find_one_and_delete(doc_filter, sort=sort, session=session)
+            if result is not None:
+                await self._inc_stats(queued=-1, session=session)
+                return TraceInfoWithContext.parse_obj(result)
+        return None
+
+    async def claim_trace(self,
+                          worker_url: str,
+                          worker_slot: int,
+                          lease_expiry: datetime,
+                          order: QueueOrder = None) -> Optional[TraceInProcessing]:
+        """
+        Atomically claims a trace for the worker: either the oldest one whose lease has expired
+        (its worker is gone) or the next queued one in the `order`. Concurrent claimers never get the same trace:
+        the loser of a write conflict gets an `OperationFailure` and is retried by `retry_on_mongo_exception`.
+        """
+        lease = {"worker_url": worker_url, "worker_slot": worker_slot, KEY_LEASE_EXPIRY: lease_expiry}
+        result = await self._traces_in_processing.find_one_and_update(
+            {KEY_LEASE_EXPIRY: {"$lt": datetime.now()}},
+            {"$set": lease},
+            sort=[(KEY_CREATION_DATE, ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        if result:
+            trace = TraceInProcessing.parse_obj(result)
+            log.warning(f"claim_trace: lease of {trace.trace_name} expired, reclaimed by {worker_url}#{worker_slot}")
+            return trace
+
+        # the queued doc is moved within a transaction, so a failure in between can't lose the trace
+        async with self.transaction() as session:
+            queued_trace = await self.extract_trace_from_queue(session, order)
+            if queued_trace is None:
+                return None
+            trace = TraceInProcessing(**queued_trace.dict(), **lease)
+            await self.set_processing_trace(trace, session)
         return trace
 
     # endregion
@@ -121,9 +275,13 @@ class MongoDatabase:
     @staticmethod
     async def _get_all_docs(collection: AgnosticCollection,
                             parse_to_class: Type[DBModel] = None,
-                            session: ClientSession = None) -> List[AnyDBModel]:
+                            session: ClientSession = None,
+                            sort: List[Tuple[str, int]] = None) -> List[AnyDBModel]:
         result: List[AnyDBModel] = []
-        async for doc in collection.find(session=session):
+        cursor = collection.find(session=session)
+        if sort:
+            cursor = cursor.sort(sort)
+        async for doc in cursor:
             try:
                 result.append(parse_to_class.parse_obj(doc) if parse_to_class else doc)
             except BaseException as e:
@@ -134,46 +292,204 @@ class MongoDatabase:
         return await self._get_all_docs(self._queued_traces, TraceInfoWithContext, session)
 
     async def get_ready_traces(self, session: ClientSession = None) -> List[ProcessedTraceInfo]:
-        return await self._get_all_docs(self._ready_traces, ProcessedTraceInfo, session)
+        return await self._get_all_docs(self._ready_traces, ProcessedTraceInfo, session, PROCESSED_TRACES_SORT)
 
     async def get_poisoned_traces(self, session: ClientSession = None) -> List[ProcessedTraceInfo]:
-        return await self._get_all_docs(self._poisoned_traces, ProcessedTraceInfo, session)
+        return await self._get_all_docs(self._poisoned_traces, ProcessedTraceInfo, session, PROCESSED_TRACES_SORT)
+
+    # endregion
+
+    # region Processed traces pages
+    @staticmethod
+    def _encode_page_token(summary: ProcessedTraceSummary) -> str:
+        date = summary.last_processed_date.isoformat() if summary.last_processed_date else None
+        return base64.urlsafe_b64encode(json.dumps([date, summary.trace_name]).encode()).decode()
+
+    @staticmethod
+    def _decode_page_token(token: str) -> Tuple[Optional[datetime], str]:
+        """Raises ValueError on a malformed token"""
+        try:
+            date, trace_name = json.loads(base64.urlsafe_b64decode(token.encode()))
+            return datetime.fromisoformat(date) if date else None, str(trace_name)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Malformed page token: {token}") from e
+
+    @classmethod
+    def _page_filter(cls, after: Optional[str]) -> dict:
+        if not after:
+            return {}
+        date, trace_name = cls._decode_page_token(after)
+        if date is None:
+            # docs without the date go first
+            return {"$or": [
+                {KEY_LAST_PROCESSED_DATE: None, "_id": {"$gt": trace_name}},
+                {KEY_LAST_PROCESSED_DATE: {"$ne": None}}
+            ]}
+        return {"$or": [
+            {KEY_LAST_PROCESSED_DATE: date, "_id": {"$gt": trace_name}},
+            {KEY_LAST_PROCESSED_DATE: {"$gt": date}}
+        ]}
+
+    @classmethod
+    async def _get_processed_traces_page(cls,
+                                         collection: AgnosticCollection,
+                                         limit: int,
+                                         after: Optional[str]) -> ProcessedTracesPage:
+        cursor = collection.find(cls._page_filter(after), PROCESSED_TRACE_SUMMARY_PROJECTION)
+        page = ProcessedTracesPage()
+        async for doc in cursor.sort(PROCESSED_TRACES_SORT).limit(limit):
+            reports = doc.pop(KEY_PROCESSING_REPORTS, None)
+            doc["last_report"] = reports[-1] if reports else None
+            page.traces.append(ProcessedTraceSummary.parse_obj(doc))
+        if len(page.traces) == limit:
+            page.after = cls._encode_page_token(page.traces[-1])
+        return page
+
+    async def get_ready_traces_page(self, limit: int, after: Optional[str] = None) -> ProcessedTracesPage:
+        return await self._get_processed_traces_page(self._ready_traces, limit, after)
+
+    async def get_poisoned_traces_page(self, limit: int, after: Optional[str] = None) -> ProcessedTracesPage:
+        return await self._get_processed_traces_page(self._poisoned_traces, limit, after)
+
+    @staticmethod
+    async def _iterate_processed_traces(collection: AgnosticCollection) -> AsyncIterator[ProcessedTraceInfo]:
+        async for doc in collection.find().sort(PROCESSED_TRACES_SORT):
+            try:
+                yield ProcessedTraceInfo.parse_obj(doc)
+            except BaseException as e:
+                log.warning(f"_iterate_processed_traces: {type(e).__name__} {e}")
+
+    def iterate_ready_traces(self) -> AsyncIterator[ProcessedTraceInfo]:
+        return self._iterate_processed_traces(self._ready_traces)
+
+    def iterate_poisoned_traces(self) -> AsyncIterator[ProcessedTraceInfo]:
+        return self._iterate_processed_traces(self._poisoned_traces)
+
+    # endregion
+
+    # region Trace names
+    @staticmethod
+    async def _get_doc_ids(collection: AgnosticCollection) -> Set[str]:
+        return {doc["_id"] async for doc in collection.find({}, {"_id": 1})}
+
+    async def get_known_trace_names(self) -> Set[str]:
+        """Names of the traces queued, in processing, ready or poisoned"""
+        result: Set[str] = set()
+        for collection in (self._queued_traces, self._traces_in_processing, self._ready_traces, self._poisoned_traces):
+            result |= await self._get_doc_ids(collection)
+        return result
+
+    async def get_busy_trace_names(self) -> Set[str]:
+        """Names of the traces queued or in processing"""
+        return await self._get_doc_ids(self._queued_traces) | await self._get_doc_ids(self._traces_in_processing)
+
+    async def get_expired_trace_names(self, expire_dates: Dict[BranchClass, datetime]) -> Set[str]:
+        """
+        Names of the ready and poisoned traces last processed before the expire date of their branch class,
+        a class without an expire date never expires. A trace both ready and poisoned expires once its newest entry
+        does: an entry not expired in either collection keeps it.
+        """
+        if not expire_dates:
+            return set()
+        expired_match = [
+            {KEY_BRANCH_CLASS: branch_class.value, KEY_LAST_PROCESSED_DATE: {"$lt": expire_date}}
+            for branch_class, expire_date in expire_dates.items()
+        ]
+        result: Set[str] = set()
+        for collection in (self._ready_traces, self._poisoned_traces):
+            result |= {doc["_id"] async for doc in collection.find({"$or": expired_match}, {"_id": 1})}
+        if not result:
+            return result
+        for collection in (self._ready_traces, self._poisoned_traces):
+            kept = collection.find({"_id": {"$in": list(result)}, "$nor": expired_match}, {"_id": 1})
+            result -= {doc["_id"] async for doc in kept}
+        return result
+
+    async def get_processed_trace_classes(self, trace_names: Set[str]) -> Dict[str, Tuple[BranchClass, datetime]]:
+        """
+        Branch class and last processed date of those of `trace_names` that are ready or poisoned,
+        the newest entry of a trace both ready and poisoned
+        """
+        result: Dict[str, Tuple[BranchClass, datetime]] = dict()
+        if not trace_names:
+            return result
+        projection = {KEY_BRANCH_CLASS: 1, KEY_LAST_PROCESSED_DATE: 1}
+        for collection in (self._ready_traces, self._poisoned_traces):
+            async for doc in collection.find({"_id": {"$in": list(trace_names)}}, projection):
+                if doc.get(KEY_BRANCH_CLASS) and doc.get(KEY_LAST_PROCESSED_DATE):
+                    known = result.get(doc["_id"])
+                    if known is None or known[1] < doc[KEY_LAST_PROCESSED_DATE]:
+                        result[doc["_id"]] = BranchClass(doc[KEY_BRANCH_CLASS]), doc[KEY_LAST_PROCESSED_DATE]
+        return result
 
     # endregion
 
     # region Set doc, added if missing
     @staticmethod
-    async def _set_doc(collection: AgnosticCollection, data: DBModel, session: ClientSession = None):
-        await collection.replace_one(filter=data.get_id(), replacement=data.get_data(), upsert=True, session=session)
+    async def _set_doc(collection: AgnosticCollection, data: DBModel, session: ClientSession = None) -> bool:
+        """Returns True if the doc was added"""
+        result = await collection.replace_one(
+            filter=data.get_id(),
+            replacement=data.get_data(),
+            upsert=True,
+            session=session
+        )
+        return result.upserted_id is not None
 
     async def set_queued_trace(self, trace: TraceInfoWithContext, session: ClientSession = None):
-        await self._set_doc(self._queued_traces, trace, session)
+        if await self._set_doc(self._queued_traces, trace, session):
+            await self._inc_stats(queued=1, session=session)
+
+    async def insert_queued_traces(self, traces: List[TraceInfoWithContext]) -> int:
+        """Adds the traces in one bulk write, the ones queued already are skipped. Returns the count of added"""
+        if not traces:
+            return 0
+        docs = [{**trace.get_id(), **trace.get_data()} for trace in traces]
+        try:
+            result = await self._queued_traces.insert_many(docs, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+            # queued by someone else in between
+            inserted = e.details.get("nInserted", 0)
+        await self._inc_stats(queued=inserted)
+        return inserted
 
     async def set_processing_trace(self, trace: TraceInProcessing, session: ClientSession = None):
         await self._set_doc(self._traces_in_processing, trace, session)
 
     async def set_ready_trace(self, trace: ProcessedTraceInfo, session: ClientSession = None):
-        await self._set_doc(self._ready_traces, trace, session)
+        if await self._set_doc(self._ready_traces, trace, session):
+            await self._inc_stats(ready=1, session=session)
 
     async def set_poisoned_trace(self, trace: ProcessedTraceInfo, session: ClientSession = None):
-        await self._set_doc(self._poisoned_traces, trace, session)
+        if await self._set_doc(self._poisoned_traces, trace, session):
+            await self._inc_stats(poisoned=1, session=session)
 
     # endregion
 
     # region Remove doc
     @staticmethod
-    async def _remove_doc(collection: AgnosticCollection, data: DBModel, session: ClientSession = None):
-        await collection.delete_one(filter=data.get_id(), session=session)
+    async def _remove_doc(collection: AgnosticCollection, data: DBModel, session: ClientSession = None) -> bool:
+        """Returns True if the doc was removed"""
+        result = await collection.delete_one(filter=data.get_id(), session=session)
+        return result.deleted_count > 0
 
     async def remove_queued_trace(self, trace: TraceInfoWithContext, session: ClientSession = None):
-        await self._remove_doc(self._queued_traces, trace, session)
+        if await self._remove_doc(self._queued_traces, trace, session):
+            await self._inc_stats(queued=-1, session=session)
+
+    async def renew_processing_leases(self, worker_url: str, lease_expiry: datetime) -> int:
+        """Extends the leases of all the traces the worker is processing, returns the count of renewed"""
+        result = await self._traces_in_processing.update_many(
+            {KEY_WORKER_URL: worker_url},
+            {"$set": {KEY_LEASE_EXPIRY: lease_expiry}}
+        )
+        return result.modified_count
 
-    async def remove_processing_trace(self, worker_url: str, session: ClientSession = None):
-        traces_in_processing: List[TraceInProcessing] = await self._get_all_docs(self._traces_in_processing, TraceInProcessing, session)
-        for trace in traces_in_processing:
-            if trace.worker_url == worker_url:
-                await self._remove_doc(self._traces_in_processing, trace, session)
-                break
+    async def remove_processing_trace(self, worker_url: str, worker_slot: int = 0, session: ClientSession = None):
+        await self._traces_in_processing.delete_one(self._worker_filter(worker_url, worker_slot), session=session)
 
     @staticmethod
     async def _get_docs_count(collection: AgnosticCollection, session: ClientSession = None) -> int:
@@ -189,5 +505,50 @@ class MongoDatabase:
         return await self._get_docs_count(self._ready_traces, session)
 
     async def remove_ready_trace(self, trace: TraceInfo, session: ClientSession = None):
-        await self._remove_doc(self._ready_traces, trace, session)
+        if await self._remove_doc(self._ready_traces, trace, session):
+            await self._inc_stats(ready=-1, session=session)
+    # endregion
+
+    # region Workers registry
+    async def set_worker_heartbeat(self, heartbeat: WorkerHeartbeat):
+        await self._set_doc(self._workers, heartbeat)
+
+    async def remove_worker_heartbeat(self, worker_url: str):
+        await self._workers.delete_one(get_id(worker_url))
+
+    async def find_worker_heartbeat(self, worker_url: str) -> Optional[WorkerHeartbeat]:
+        return await self._find_doc(self._workers, get_id(worker_url), WorkerHeartbeat)
+
+    async def get_worker_heartbeats(self, alive_sec: float) -> List[WorkerHeartbeat]:
+        """Heartbeats of the last `alive_sec`, the ttl index removes stale ones only once a minute"""
+        result: List[WorkerHeartbeat] = []
+        async for doc in self._workers.find({KEY_LAST_SEEN: {"$gte": datetime.now() - timedelta(seconds=alive_sec)}}):
+            try:
+                result.append(WorkerHeartbeat.parse_obj(doc))
+            except BaseException as e:
+                log.warning(f"get_worker_heartbeats: {type(e).__name__} {e}")
+        return result
+    # endregion
+
+    # region Traces stats
+    async def _inc_stats(self, session: ClientSession = None, **values: int):
+        pending = self._pending_stats.get(session) if session is not None else None
+        if pending is not None:
+            pending.update(values)
+            return
+        await self._stats.update_one({"_id": TRACES_STATS_ID}, {"$inc": values}, upsert=True, session=session)
+
+    async def get_traces_stats(self, session: ClientSession = None) -> TracesStats:
+        result = await self._stats.find_one({"_id": TRACES_STATS_ID}, session=session)
+        return TracesStats.parse_obj(result) if result else TracesStats()
+
+    async def recount_traces_stats(self) -> TracesStats:
+        """Counts the collections and overwrites the incrementally maintained stats, fixing any drift"""
+        stats = TracesStats(
+            queued=await self.get_queued_trace_count(),
+            ready=await self.get_ready_trace_count(),
+            poisoned=await self.get_poisoned_trace_count()
+        )
+        await self._stats.replace_one({"_id": TRACES_STATS_ID}, stats.dict(), upsert=True)
+        return stats
     # endregion
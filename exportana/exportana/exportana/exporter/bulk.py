@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any, AsyncIterable, Dict, Iterable, List, Optional, Tuple, Union
+
+from elasticsearch import exceptions
+from elasticsearch._async.client import AsyncElasticsearch
+from elasticsearch.helpers.errors import BulkIndexError
+
+__ALL__ = ["BulkSettings", "BulkStats", "BulkIndexer", "get_serialize_executor", "shutdown_serialize_executor"]
+
+log = logging.getLogger(__name__)
+
+HTTP_TOO_MANY_REQUESTS = 429
+KEY_ITEMS = "items"
+KEY_ERRORS = "errors"
+KEY_STATUS = "status"
+KEY_ID = "_id"
+
+Docs = Union[Iterable[dict], AsyncIterable[dict]]
+# bulk action line + source line, both serialized
+SerializedDoc = Tuple[bytes, bytes]
+
+_serialize_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_serialize_executor(max_workers: int) -> ThreadPoolExecutor:
+    """
+    The pool serializing the documents, shared by the pushes of the process for its lifetime,
+    so no push waits for a pool of its own to join its threads
+    """
+    global _serialize_executor
+    if _serialize_executor is None:
+        _serialize_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bulk")
+    return _serialize_executor
+
+
+def shutdown_serialize_executor():
+    global _serialize_executor
+    if _serialize_executor is not None:
+        _serialize_executor.shutdown(wait=False)
+        _serialize_executor = None
+
+
+@dataclass
+class BulkSettings:
+    chunk_size: int = 500
+    max_chunk_bytes: int = 100 * 1024 * 1024
+    concurrency: int = 2
+    max_retries: int = 5
+    initial_backoff: float = 2.0
+    max_backoff: float = 600.0
+
+
+@dataclass
+class BulkStats:
+    docs: int = 0
+    bytes: int = 0
+    requests: int = 0
+    retries: int = 0
+    serialize_sec: float = 0.0
+    send_sec: float = 0.0
+    ack_sec: float = 0.0
+
+    def __str__(self):
+        return f"docs: {self.docs}, bytes: {self.bytes}, requests: {self.requests}, retries: {self.retries}, " \
+               f"serialize took: {self.serialize_sec:2.2f}s, " \
+               f"send took: {self.send_sec:2.2f}s, " \
+               f"ack took: {self.ack_sec:2.2f}s"
+
+
+def _serialize(index_name: str, docs: List[dict]) -> Tuple[List[SerializedDoc], float]:
+    """The `_id` of a doc, if any, goes to its action line, as with the elasticsearch bulk helpers"""
+    ts = perf_counter()
+    action = json.dumps({"index": {"_index": index_name}}).encode("utf-8") + b"\n"
+    result = list()
+    for doc in docs:
+        doc_id = doc.pop(KEY_ID, None)
+        doc_action = action if doc_id is None else \
+            json.dumps({"index": {"_index": index_name, KEY_ID: doc_id}}).encode("utf-8") + b"\n"
+        result.append((doc_action, json.dumps(doc).encode("utf-8") + b"\n"))
+    return result, perf_counter() - ts
+
+
+class BulkIndexer:
+    """
+    Bulk indexing pipeline: documents are grouped by count, serialized in the `executor`,
+    split by bytes and sent by up to `concurrency` bulk requests in flight.
+    Documents rejected with HTTP 429 are resent with exponential backoff.
+    """
+
+    def __init__(self, es: AsyncElasticsearch, executor: Executor, settings: BulkSettings):
+        self._es = es
+        self._executor = executor
+        self._settings = settings
+        self.stats = BulkStats()
+
+    async def index(self, index_name: str, docs: Docs):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(max(self._settings.concurrency, 1))
+        tasks: List[asyncio.Future] = list()
+
+        async def send(chunk: List[SerializedDoc]):
+            try:
+                await self._send_with_retries(chunk)
+            finally:
+                semaphore.release()
+
+        async def serialize_and_send(batch: List[dict]):
+            serialized, duration = await loop.run_in_executor(self._executor, _serialize, index_name, batch)
+            self.stats.serialize_sec += duration
+            for chunk in self._split_by_bytes(serialized):
+                await semaphore.acquire()
+                self._raise_on_failed(tasks)
+                tasks.append(asyncio.ensure_future(send(chunk)))
+
+        try:
+            batch: List[dict] = list()
+            async for doc in self._iterate(docs):
+                batch.append(doc)
+                if len(batch) >= self._settings.chunk_size:
+                    await serialize_and_send(batch)
+                    batch = list()
+            if batch:
+                await serialize_and_send(batch)
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    @staticmethod
+    async def _iterate(docs: Docs):
+        if isinstance(docs, AsyncIterable):
+            async for doc in docs:
+                yield doc
+        else:
+            for doc in docs:
+                yield doc
+
+    @staticmethod
+    def _raise_on_failed(tasks: List[asyncio.Future]):
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception():
+                raise task.exception()
+
+    def _split_by_bytes(self, serialized: List[SerializedDoc]) -> Iterable[List[SerializedDoc]]:
+        chunk: List[SerializedDoc] = list()
+        chunk_bytes = 0
+        for action, source in serialized:
+            size = len(action) + len(source)
+            if chunk and chunk_bytes + size > self._settings.max_chunk_bytes:
+                yield chunk
+                chunk, chunk_bytes = list(), 0
+            chunk.append((action, source))
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    async def _send_with_retries(self, chunk: List[SerializedDoc]):
+        attempt = 0
+        while True:
+            body = b"".join(line for doc in chunk for line in doc)
+            ts = perf_counter()
+            try:
+                response: Dict[str, Any] = await self._es.bulk(body=body)
+            except exceptions.TransportError as e:
+                if e.status_code != HTTP_TOO_MANY_REQUESTS or attempt >= self._settings.max_retries:
+                    raise
+                response = None
+            finally:
+                self.stats.send_sec += perf_counter() - ts
+                self.stats.requests += 1
+
+            ts = perf_counter()
+            if response is None:
+                rejected = chunk
+            else:
+                rejected, errors = self._check_response(chunk, response)
+                if errors:
+                    raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+                self.stats.docs += len(chunk) - len(rejected)
+                self.stats.bytes += len(body)
+            self.stats.ack_sec += perf_counter() - ts
+
+            if not rejected:
+                return
+            if attempt >= self._settings.max_retries:
+                raise BulkIndexError(f"{len(rejected)} document(s) rejected by elasticsearch, retries exhausted.", [])
+
+            delay = min(self._settings.max_backoff, self._settings.initial_backoff * 2 ** attempt)
+            log.warning(f"Bulk: {len(rejected)} document(s) rejected with HTTP 429, retrying in {delay:2.2f}s")
+            attempt += 1
+            self.stats.retries += 1
+            chunk = rejected
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _check_response(
+        chunk: List[SerializedDoc],
+        response: Dict[str, Any]
+    ) -> Tuple[List[SerializedDoc], List[dict]]:
+        rejected: List[SerializedDoc] = list()
+        errors: List[dict] = list()
+        if not response.get(KEY_ERRORS):
+            return rejected, errors
+
+        for doc, item in zip(chunk, response[KEY_ITEMS]):
+            _, result = item.popitem()
+            status = result.get(KEY_STATUS, 200)
+            if status == HTTP_TOO_MANY_REQUESTS:
+                rejected.append(doc)
+            elif not 200 <= status < 300:
+                errors.append({"index": result})
+        return rejected, errors
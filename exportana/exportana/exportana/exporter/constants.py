@@ -19,6 +19,11 @@ INF = "inf"
 PATH_DELIMITER = "/"
 
 RECONNECT_TIMEOUT_SEC = 10
+DEFAULT_STREAMING_QUEUE_SIZE = 64
+DEFAULT_ACQUIRE_WAIT_SEC = 30
+MAX_ACQUIRE_WAIT_SEC = 60
+# the time the manager took to claim the trace handed out, the long-poll wait excluded
+ACQUIRE_SEC_HEADER = "X-Exportana-Acquire-Sec"
 
 DEFAULT_ELASTICSEARCH_INDEX_PREFIX = "prf"
 
@@ -36,12 +41,21 @@ RAW_DATA_KEY = "perfana_metrics"
 
 DOC_TYPE_BUDGET = "budget"
 DOC_TYPE_METRIC = "metric"
+DOC_TYPE_TRACE_META = "trace_meta"
+DOC_TYPE_SETTINGS = "settings"
+DOC_TYPE_FRAME_SETTINGS = "frame_settings"
+# the frame settings document of a frame in the normalized layout
+FRAME_SETTINGS_ID_KEY = "settings_id"
 SETTINGS_KEY = "settings"
+TRACE_SETTINGS_KEY = "trace_settings"
+# random id of the export that wrote a document
+EXPORT_ID_KEY = "export_id"
 
 # region index settings
 KEY_SETTINGS = "settings"
 KEY_INDEX = "index"
 KEY_MAPPING = "mapping"
+KEY_MAPPINGS = "mappings"
 KEY_TOTAL_FIELDS = "total_fields"
 KEY_LIMIT = "limit"
 
@@ -51,4 +65,7 @@ KEY_TRACE_ID = "TraceId"
 KEY_TRACE_NAME = "TraceName"
 KEY_TRACE_SIZE = "TraceSize"
 KEY_TIME_STAMP = "TimeStamp"
+# optional
+KEY_TRACE_PRIORITY = "Priority"
+KEY_TRACE_BRANCH = "Branch"
 # endregion
@@ -0,0 +1,40 @@
+import logging
+from typing import Dict, List, Tuple, Union
+
+from elasticsearch._async.client import AsyncElasticsearch
+
+__ALL__ = ["ElasticClients", "elastic_clients"]
+
+log = logging.getLogger(__name__)
+
+
+class ElasticClients:
+    """
+    AsyncElasticsearch clients shared by the process, one per list of hosts, so the connection pools
+    outlive the traces and requests using them. Clients are bound to the event loop they are made in:
+    they are made lazily by the app and closed by its shutdown, code running its own loop makes its own client.
+    """
+
+    def __init__(self, maxsize: int = 10):
+        # connections per host
+        self.maxsize = maxsize
+        self._clients: Dict[Tuple[str, ...], AsyncElasticsearch] = dict()
+
+    def get(self, hosts: Union[str, List[str]]) -> AsyncElasticsearch:
+        key = (hosts,) if isinstance(hosts, str) else tuple(hosts)
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = AsyncElasticsearch(hosts=list(key), retry_on_timeout=True, maxsize=self.maxsize)
+            log.info(f"ElasticClients. Client for {', '.join(key)}, up to {self.maxsize} connection(s) per host")
+        return client
+
+    async def close(self):
+        clients, self._clients = self._clients, dict()
+        for client in clients.values():
+            try:
+                await client.close()
+            except Exception as e:
+                log.warning(f"ElasticClients. Can't close the client: {type(e).__name__} {e}")
+
+
+elastic_clients = ElasticClients()
@@ -1,8 +1,13 @@
 from enum import Enum
-from typing import List, Optional, Tuple, Set
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+from ..utils.compatibility import removeprefix, removesuffix
 from .constants import PATH_DELIMITER
-from ..utils.compatibility import removesuffix, removeprefix
+
+# `_Duration`, `_Children` etc. are fields of a timer or a thread, not timers
+FIELD_PREFIX = "_"
+# the nested timers of a timer
+CHILDREN_KEY = "_Children"
 
 
 class NamingType(str, Enum):
@@ -84,14 +89,182 @@ class Event:
             return key.startswith(self.key[0]) and key.endswith(self.key[1])
 
 
+class _Trie:
+    """Prefix lookups of the words: the payload of the longest word `text` starts with, or the payloads of all"""
+
+    _END = ""
+
+    def __init__(self):
+        self._root: Dict[str, Any] = dict()
+
+    def __bool__(self):
+        return bool(self._root)
+
+    def setdefault(self, word: str, payload: Any) -> Any:
+        node = self._root
+        for char in word:
+            node = node.setdefault(char, dict())
+        return node.setdefault(self._END, payload)
+
+    def longest(self, text: Iterable[str]) -> Optional[Any]:
+        node = self._root
+        found = node.get(self._END)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(self._END, found)
+        return found
+
+    def all(self, text: Iterable[str]) -> Iterator[Any]:
+        node = self._root
+        for char in text:
+            if self._END in node:
+                yield node[self._END]
+            node = node.get(char)
+            if node is None:
+                return
+        if self._END in node:
+            yield node[self._END]
+
+
+class _NameMatcher:
+    """
+    Matches names against `(prefix, suffix)` rules: exact names by hash, prefixes by a trie,
+    suffixes by a trie of the reversed suffixes. The rules with both are found by their prefix in a trie too,
+    then the suffix of each candidate is checked.
+    The first rule of a name wins, like `Events.find_event` over the insertion order.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Any] = dict()
+        self._prefixes = _Trie()
+        self._suffixes = _Trie()
+        # prefix -> [(order, suffix, payload)]
+        self._rest = _Trie()
+        self._rest_count = 0
+
+    def add_exact(self, name: str, payload: Any):
+        self._exact.setdefault(name, payload)
+
+    def add(self, prefix: str, suffix: str, payload: Any):
+        if not suffix:
+            self._prefixes.setdefault(prefix, payload)
+        elif not prefix:
+            self._suffixes.setdefault(suffix[::-1], payload)
+        else:
+            rules = self._rest.setdefault(prefix, list())
+            rules.append((self._rest_count, suffix, payload))
+            self._rest_count += 1
+
+    def match(self, name: str) -> Optional[Any]:
+        payload = self._exact.get(name)
+        if payload is not None:
+            return payload
+        if self._prefixes:
+            payload = self._prefixes.longest(name)
+            if payload is not None:
+                return payload
+        if self._suffixes:
+            payload = self._suffixes.longest(reversed(name))
+            if payload is not None:
+                return payload
+        if self._rest:
+            found = None
+            for rules in self._rest.all(name):
+                for rule in rules:
+                    if (found is None or rule[0] < found[0]) and name.endswith(rule[1]):
+                        found = rule
+            if found is not None:
+                return found[2]
+        return None
+
+
+class EventMatcher:
+    """
+    `Events` compiled once for lookups per timer per frame. Events are grouped by their thread rule: exact thread
+    names are looked up by hash, the few `Thread+` rules are checked one by one, then the key is matched
+    by the `_NameMatcher` of the thread rule.
+    The most specific rule wins: an exact name, then the longest prefix, the longest suffix, the first of the rest.
+    """
+
+    def __init__(self, events: Iterable[Event]):
+        self._exact_threads: Dict[str, _NameMatcher] = dict()
+        self._thread_rules: Dict[Tuple[str, str], _NameMatcher] = dict()
+        for event in events:
+            if event.thread_type is NamingType.append:
+                keys = self._thread_rules.setdefault(event.thread, _NameMatcher())
+            else:
+                keys = self._exact_threads.setdefault(event.thread[0], _NameMatcher())
+            if event.key_type is NamingType.simple:
+                keys.add_exact(event.key[0], event)
+            else:
+                keys.add(event.key[0], event.key[1], event)
+        self._thread_rules_list = list(self._thread_rules.items())
+
+    def match(self, thread: str, key: str) -> Optional[Event]:
+        keys = self._exact_threads.get(thread)
+        if keys is not None:
+            event = keys.match(key)
+            if event is not None:
+                return event
+        for (prefix, suffix), keys in self._thread_rules_list:
+            if thread.startswith(prefix) and thread.endswith(suffix):
+                event = keys.match(key)
+                if event is not None:
+                    return event
+        return None
+
+    def filter_frame(self, frame: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        The frame with only the timers of the events: in the `{thread: {timer: ...}}` entries the timers are matched
+        at any depth of their `_Children` tree. A matching timer is kept whole, a timer with matching descendants
+        is kept with those only, the other timers are dropped, so are the threads left without timers.
+        `_`-prefixed fields (`_Duration` etc.) and values other than threads are kept as they are.
+        """
+        result: Dict[str, Any] = dict()
+        for thread, timers in frame.items():
+            if not isinstance(timers, dict):
+                result[thread] = timers
+                continue
+            kept = self._filter_timers(thread, timers)
+            if kept is not None:
+                result[thread] = kept
+        return result
+
+    def _filter_timers(self, thread: str, timers: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """`timers` with the matching timers and the ancestors of matching timers, None if there are none"""
+        kept: Dict[str, Any] = dict()
+        has_timers = False
+        for key, value in timers.items():
+            if key == CHILDREN_KEY and isinstance(value, dict):
+                children = self._filter_timers(thread, value)
+                if children is not None:
+                    kept[key] = children
+                    has_timers = True
+            elif key.startswith(FIELD_PREFIX):
+                kept[key] = value
+            elif self.match(thread, key) is not None:
+                kept[key] = value
+                has_timers = True
+            elif isinstance(value, dict):
+                timer = self._filter_timers(thread, value)
+                if timer is not None:
+                    kept[key] = timer
+                    has_timers = True
+        return kept if has_timers else None
+
+
 class Events:
     """
     This is an alias to `Dict[str, Dict[str, str]]` but with handy `add_event` and `fill` functions
     """
 
-    _events: Set[Event] = set()
-
     def __init__(self, events: List[str]) -> None:
+        self._events: Set[Event] = set()
+        # the insertion order, which the compiled matcher keeps
+        self._ordered: List[Event] = list()
+        self._matcher: Optional[EventMatcher] = None
         self.fill(events)
 
     def __repr__(self):
@@ -106,17 +279,23 @@ class Events:
             )
         thread, name = name.split(":", 1)
 
-        self._events.add(Event(thread=thread, key=name, alias=alias))
+        event = Event(thread=thread, key=name, alias=alias)
+        self._events.add(event)
+        self._ordered.append(event)
+        self._matcher = None
 
     def fill(self, event_strings: List[str]):
         for event in event_strings:
             self.add_event(event)
 
+    @property
+    def matcher(self) -> EventMatcher:
+        if self._matcher is None:
+            self._matcher = EventMatcher(self._ordered)
+        return self._matcher
+
     def find_event(self, thread: str, key: str) -> Optional[Event]:
-        for event in self._events:
-            if event.is_compatible(thread, key):
-                return event
-        return None
+        return self.matcher.match(thread, key)
 
     def find_all_events(self, thread: str, key: str) -> List[Event]:
         result: List[Event] = list()
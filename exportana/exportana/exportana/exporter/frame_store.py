@@ -0,0 +1,209 @@
+import copy
+import hashlib
+import json
+import math
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .constants import FRAME_END_KEY, FRAME_START_KEY
+
+__ALL__ = ["FrameStore", "FrameView"]
+
+FLOAT_TYPECODE = "d"
+INDEX_TYPECODE = "q"
+NAN = float("nan")
+KEY_DELIMITER = "_"
+
+Path = Tuple[str, ...]
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _walk(data: Dict[str, Any], excluded_keys: List[str]) -> Iterator[Tuple[str, Path, Any]]:
+    """Same naming rules as `utils.flatten_dict`, but also yields the nested path of every leaf."""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            for sub_key, sub_path, sub_value in _walk(value, excluded_keys):
+                new_sub_key = f"{key}{KEY_DELIMITER}{sub_key}"
+                for excluded_key in excluded_keys:
+                    new_sub_key = new_sub_key.replace(excluded_key, "")
+                yield new_sub_key, (key, *sub_path), sub_value
+        else:
+            yield key, (key,), value
+
+
+def _set_path(data: dict, path: Path, value: Any):
+    for key in path[:-1]:
+        data = data.setdefault(key, dict())
+    data[path[-1]] = value
+
+
+class FrameView:
+    """Lightweight read access to a single frame of the `FrameStore`"""
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store: "FrameStore", index: int):
+        self._store = store
+        self._index = index
+
+    @property
+    def frame_start(self) -> Optional[float]:
+        value = self._store.frame_start[self._index]
+        return None if math.isnan(value) else value
+
+    @property
+    def frame_end(self) -> Optional[float]:
+        value = self._store.frame_end[self._index]
+        return None if math.isnan(value) else value
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        """Flattened frame data, as it was received"""
+        return self._store.frame_data(self._index)
+
+    @property
+    def raw_data(self) -> Dict[str, Any]:
+        """Nested frame data, as it was received"""
+        return self._store.frame_raw_data(self._index)
+
+
+class FrameStore:
+    """
+    Columnar storage of the received frames.
+    Numeric values are kept in one float array per metric name (NaN marks a missing value),
+    frame bounds in the parallel `frame_start`/`frame_end` arrays.
+    Everything else of the frame (strings, lists, etc.) is a settings blob which is stored only
+    when it differs from the one of the previous frame.
+    """
+
+    def __init__(self, excluded_keys: List[str]):
+        self._excluded_keys = excluded_keys
+        self.frame_start: array = array(FLOAT_TYPECODE)
+        self.frame_end: array = array(FLOAT_TYPECODE)
+        self.columns: Dict[str, array] = dict()
+        self._paths: Dict[str, Path] = dict()
+        # index of the first frame of each settings blob and the blobs: (flattened, raw)
+        self._settings_index: array = array(INDEX_TYPECODE)
+        self._settings: List[Tuple[Dict[str, Any], Dict[str, Any]]] = list()
+        # content hash of each blob, made on demand
+        self._settings_ids: List[Optional[str]] = list()
+
+    def __len__(self) -> int:
+        return len(self.frame_start)
+
+    def __iter__(self) -> Iterator[FrameView]:
+        for i in range(len(self)):
+            yield FrameView(self, i)
+
+    def __getitem__(self, index: int) -> FrameView:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Frame index out of range: {index}")
+        return FrameView(self, index)
+
+    def clear(self):
+        self.frame_start = array(FLOAT_TYPECODE)
+        self.frame_end = array(FLOAT_TYPECODE)
+        self.columns.clear()
+        self._paths.clear()
+        self._settings_index = array(INDEX_TYPECODE)
+        self._settings.clear()
+        self._settings_ids.clear()
+
+    def append(self, raw_frame: Dict[str, Any]):
+        index = len(self)
+        frame_start = raw_frame.get(FRAME_START_KEY)
+        frame_end = raw_frame.get(FRAME_END_KEY)
+        self.frame_start.append(NAN if frame_start is None else frame_start)
+        self.frame_end.append(NAN if frame_end is None else frame_end)
+
+        settings: Dict[str, Any] = dict()
+        settings_raw: Dict[str, Any] = dict()
+        for name, path, value in _walk(raw_frame, self._excluded_keys):
+            if name in (FRAME_START_KEY, FRAME_END_KEY):
+                continue
+            if not _is_number(value):
+                settings[name] = value
+                _set_path(settings_raw, path, value)
+                continue
+
+            column = self.columns.get(name)
+            if column is None:
+                column = array(FLOAT_TYPECODE, [NAN]) * index
+                self.columns[name] = column
+                self._paths[name] = path
+            if len(column) > index:
+                # the same flattened name met twice within a frame, the last one wins
+                column[index] = value
+            else:
+                column.append(value)
+
+        for column in self.columns.values():
+            if len(column) == index:
+                column.append(NAN)
+
+        if not self._settings or self._settings[-1][0] != settings:
+            self._settings_index.append(index)
+            self._settings.append((settings, settings_raw))
+            self._settings_ids.append(None)
+
+    def _frame_settings(self, index: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        return self._settings[bisect_right(self._settings_index, index) - 1]
+
+    def frame_settings_id(self, index: int) -> Optional[str]:
+        """
+        Id of the settings blob of the frame, the same blob gets the same id in any store.
+        None if the frame has no settings.
+        """
+        position = bisect_right(self._settings_index, index) - 1
+        settings_id = self._settings_ids[position]
+        if settings_id is None:
+            _, settings_raw = self._settings[position]
+            if not settings_raw:
+                return None
+            content = json.dumps(settings_raw, sort_keys=True, default=str).encode("utf-8")
+            settings_id = self._settings_ids[position] = hashlib.blake2b(content, digest_size=8).hexdigest()
+        return settings_id
+
+    def settings_by_id(self) -> Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Distinct settings blobs of the frames by id: (flattened, raw)"""
+        result = dict()
+        for position, frame_index in enumerate(self._settings_index):
+            settings_id = self.frame_settings_id(frame_index)
+            if settings_id is not None:
+                result.setdefault(settings_id, self._settings[position])
+        return result
+
+    def frame_data(self, index: int) -> Dict[str, Any]:
+        settings, _ = self._frame_settings(index)
+        result: Dict[str, Any] = dict(settings)
+        for name, column in self.columns.items():
+            value = column[index]
+            if not math.isnan(value):
+                result[name] = value
+        return result
+
+    def frame_metrics(self, index: int) -> Dict[str, float]:
+        """Numeric values of the frame only"""
+        result: Dict[str, float] = dict()
+        for name, column in self.columns.items():
+            value = column[index]
+            if not math.isnan(value):
+                result[name] = value
+        return result
+
+    def frame_raw_data(self, index: int) -> Dict[str, Any]:
+        _, settings_raw = self._frame_settings(index)
+        frame = self[index]
+        result: Dict[str, Any] = {FRAME_START_KEY: frame.frame_start, FRAME_END_KEY: frame.frame_end}
+        result.update(copy.deepcopy(settings_raw))
+        for name, column in self.columns.items():
+            value = column[index]
+            if not math.isnan(value):
+                _set_path(result, self._paths[name], value)
+        return result
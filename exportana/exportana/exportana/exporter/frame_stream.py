@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from typing import AsyncIterator, List, Union
+
+__ALL__ = ["FrameStream", "BOOKMARKS_RECEIVED"]
+
+log = logging.getLogger(__name__)
+
+
+class _Marker:
+    def __init__(self, name: str):
+        self._name = name
+
+    def __repr__(self):
+        return self._name
+
+
+BOOKMARKS_RECEIVED = _Marker("BOOKMARKS_RECEIVED")
+_END_OF_STREAM = _Marker("END_OF_STREAM")
+
+StreamItem = Union[List[dict], _Marker]
+
+
+class FrameStream:
+    """
+    Bounded queue between the metrics receiver and the streaming exporter.
+    Carries batches of raw frames in the order they were posted, plus the `BOOKMARKS_RECEIVED` marker,
+    so the consumer knows which frames came before the bookmarks.
+    A full queue blocks the poster (Unreal Insights) until the exporter catches up.
+    """
+
+    def __init__(self, maxsize: int):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(maxsize, 1))
+        self._aborted: bool = False
+        self.frames_count: int = 0
+
+    @property
+    def aborted(self) -> bool:
+        return self._aborted
+
+    async def put_frames(self, frames: List[dict]):
+        if self._aborted:
+            return
+        self.frames_count += len(frames)
+        await self._queue.put(frames)
+
+    async def put_bookmarks_received(self):
+        if self._aborted:
+            return
+        await self._queue.put(BOOKMARKS_RECEIVED)
+
+    async def close(self):
+        """No more frames will be posted"""
+        if self._aborted:
+            return
+        await self._queue.put(_END_OF_STREAM)
+
+    def abort(self):
+        """Drops everything queued and releases blocked posters and consumer, further posts are ignored"""
+        self._aborted = True
+        if self._queue.empty():
+            # the consumer may be waiting for an item, nobody waits to post into an empty queue
+            self._queue.put_nowait(_END_OF_STREAM)
+            return
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    async def items(self) -> AsyncIterator[StreamItem]:
+        while not self._aborted:
+            item = await self._queue.get()
+            if item is _END_OF_STREAM or self._aborted:
+                return
+            yield item
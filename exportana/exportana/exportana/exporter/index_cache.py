@@ -0,0 +1,47 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set, Tuple
+
+__ALL__ = ["IndexState", "IndexCache", "index_cache"]
+
+
+@dataclass
+class IndexState:
+    """What a worker knows about an elasticsearch index: its mapped top level fields and total fields limit"""
+    fields: Set[str] = field(default_factory=set)
+    fields_limit: Optional[int] = None
+    # the index behind the write alias, None for a plain index
+    write_index: Optional[str] = None
+    # the write alias when it is not the index name, see `plain_index_alias`
+    alias: Optional[str] = None
+
+
+class IndexCache:
+    """
+    Known indices by elasticsearch hosts and index name, each entry lives `ttl_sec`.
+    The worker's traces go to a few indices, so after the first trace the index build needs no round-trips
+    unless new fields appear. An index removed or changed by someone else is noticed once the entry expires.
+    """
+
+    def __init__(self, ttl_sec: float = 300):
+        self.ttl_sec = ttl_sec
+        self._entries: Dict[Tuple[str, str], Tuple[float, IndexState]] = dict()
+
+    def get(self, hosts: str, index_name: str) -> Optional[IndexState]:
+        entry = self._entries.get((hosts, index_name))
+        if entry is None:
+            return None
+        expires, state = entry
+        if expires < time.monotonic():
+            del self._entries[(hosts, index_name)]
+            return None
+        return state
+
+    def set(self, hosts: str, index_name: str, state: IndexState):
+        self._entries[(hosts, index_name)] = (time.monotonic() + self.ttl_sec, state)
+
+    def invalidate(self, hosts: str, index_name: str):
+        self._entries.pop((hosts, index_name), None)
+
+
+index_cache = IndexCache()
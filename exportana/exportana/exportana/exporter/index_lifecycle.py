@@ -0,0 +1,99 @@
+import logging
+import re
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from elasticsearch._async.client import AsyncElasticsearch
+
+from ..configs import IndexRollover
+
+__ALL__ = [
+    "ROLLOVER_MAX_AGE",
+    "first_backing_index",
+    "plain_index_alias",
+    "get_write_index",
+    "rollover_conditions",
+    "delete_expired_indices",
+]
+
+log = logging.getLogger(__name__)
+
+ROLLOVER_MAX_AGE = {
+    IndexRollover.Daily: "1d",
+    IndexRollover.Weekly: "7d",
+    IndexRollover.Monthly: "30d",
+}
+# `<alias>-000001`, the name elasticsearch rollover increments
+BACKING_INDEX_SUFFIX_RE = re.compile(r"^(?P<alias>.+)-(?P<generation>\d{6})$")
+KEY_ALIASES = "aliases"
+KEY_IS_WRITE_INDEX = "is_write_index"
+# an alias can't take the name of an existing index
+PLAIN_INDEX_ALIAS_SUFFIX = "-rollover"
+
+
+def first_backing_index(alias: str) -> str:
+    return f"{alias}-000001"
+
+
+def plain_index_alias(index_name: str) -> str:
+    """The write alias used instead of `index_name` when it is a plain index made before the rollover was enabled"""
+    return f"{index_name}{PLAIN_INDEX_ALIAS_SUFFIX}"
+
+
+def rollover_conditions(rollover: IndexRollover, max_size: Optional[str]) -> Dict[str, str]:
+    conditions = dict()
+    if rollover in ROLLOVER_MAX_AGE:
+        conditions["max_age"] = ROLLOVER_MAX_AGE[rollover]
+    if max_size:
+        conditions["max_size"] = max_size
+    return conditions
+
+
+def get_write_index(indices: Dict[str, dict], alias: str) -> Optional[str]:
+    """The write index of the alias among the `indices.get` response, None if `alias` is a plain index"""
+    for index_name, index_info in indices.items():
+        if index_info.get(KEY_ALIASES, {}).get(alias, {}).get(KEY_IS_WRITE_INDEX):
+            return index_name
+    return None
+
+
+async def delete_expired_indices(es: AsyncElasticsearch, index_prefix: str, retention_days: float) -> List[str]:
+    """
+    Deletes the rolled over indices whose data is older than `retention_days`.
+    A backing index holds data until the next one is created, the write index is never deleted.
+    """
+    KEY_SETTINGS = "settings"
+    KEY_INDEX = "index"
+    KEY_CREATION_DATE = "creation_date"
+
+    response = await es.indices.get(index=f"{index_prefix}-*", ignore=[404])
+    if not response or response.get("status") == 404:
+        return []
+
+    generations: Dict[str, List[Tuple[int, str, float]]] = defaultdict(list)
+    for index_name, index_info in response.items():
+        match = BACKING_INDEX_SUFFIX_RE.match(index_name)
+        if not match:
+            continue
+        alias = match.group("alias")
+        creation_ms = float(index_info[KEY_SETTINGS][KEY_INDEX][KEY_CREATION_DATE])
+        is_write_index = index_info.get(KEY_ALIASES, {}).get(alias, {}).get(KEY_IS_WRITE_INDEX, False)
+        if not is_write_index:
+            generations[alias].append((int(match.group("generation")), index_name, creation_ms))
+        else:
+            # the write index bounds the previous generation only
+            generations[alias].append((int(match.group("generation")), "", creation_ms))
+
+    expire_before_ms = (time.time() - retention_days * 24 * 60 * 60) * 1000
+    expired = list()
+    for alias, indices in generations.items():
+        indices.sort()
+        for (_, index_name, _), (_, _, next_creation_ms) in zip(indices, indices[1:]):
+            if index_name and next_creation_ms < expire_before_ms:
+                expired.append(index_name)
+
+    for index_name in expired:
+        await es.indices.delete(index=index_name, ignore=[404])
+        log.info(f"Index lifecycle: index {index_name} has expired, deleted")
+    return expired
@@ -0,0 +1,91 @@
+import logging
+import os
+import random
+import string
+from glob import glob
+from typing import Dict, Optional
+
+import httpx
+
+__ALL__ = ["Integrations", "integrations", "make_layout_id"]
+
+log = logging.getLogger(__name__)
+
+PERFANA_LAYOUT_GLOB = "perfana.*.layout"
+BITBUCKET_INSIGHTS_API = "rest/insights/1.0"
+LAYOUT_ID_LENGTH = 9
+
+
+def make_layout_id() -> str:
+    return "".join(random.choices(string.ascii_letters + string.digits, k=LAYOUT_ID_LENGTH))
+
+
+class Integrations:
+    """
+    Perfana and Bitbucket Code Insights clients shared by the traces of the worker:
+    one keep-alive connection pool and the layout templates parsed once at startup.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._timeout_sec: float = 30
+        self._templates: Dict[str, string.Template] = dict()
+
+    def start(self, timeout_sec: float, templates_dir: str = ".", max_connections: int = 8):
+        self._timeout_sec = timeout_sec
+        self._client = httpx.AsyncClient(
+            timeout=timeout_sec,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self.load_layout_templates(templates_dir)
+
+    async def close(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # not started by the app
+            self._client = httpx.AsyncClient(timeout=self._timeout_sec)
+        return self._client
+
+    def load_layout_templates(self, templates_dir: str):
+        for path in glob(os.path.join(templates_dir, PERFANA_LAYOUT_GLOB)):
+            self._templates[os.path.basename(path)] = self._read_template(path)
+        log.info(f"Integrations. {len(self._templates)} perfana layout template(s) loaded from {templates_dir}")
+
+    def get_layout_template(self, file_name: str) -> string.Template:
+        template = self._templates.get(file_name)
+        if template is None:
+            template = self._templates[file_name] = self._read_template(file_name)
+        return template
+
+    @staticmethod
+    def _read_template(path: str) -> string.Template:
+        with open(path, "r") as f:
+            return string.Template(f.read().replace('\n', ''))
+
+    async def post_perfana_layout(self, perfana_url: str, layout: str) -> httpx.Response:
+        headers = {"Content-type": "application/json", "Accept": "text/plain"}
+        return await self.client.post(f"{perfana_url}/api/layout", content=layout, headers=headers)
+
+    async def put_code_insights_report(
+        self,
+        bitbucket_url: str,
+        token: str,
+        project: str,
+        repository: str,
+        commit: str,
+        report_key: str,
+        report: dict
+    ) -> httpx.Response:
+        """Creates the report or replaces the existing one with the same key, see Bitbucket Code Insights REST API"""
+        url = f"{bitbucket_url}/{BITBUCKET_INSIGHTS_API}/projects/{project}/repos/{repository}" \
+              f"/commits/{commit}/reports/{report_key}"
+        headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+        return await self.client.put(url, json=report, headers=headers)
+
+
+integrations = Integrations()
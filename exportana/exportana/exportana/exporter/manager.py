@@ -1,69 +1,137 @@
+import asyncio
 import datetime
 import logging
 import os
-from typing import Optional
+from typing import Dict, List, Optional, Set
+
+import pymongo.errors
 
-from .constants import UTRACE_EXT
 from ..configs import Configs
 from ..database.broker import MongoDatabase
 from ..database.utils import retry_on_mongo_exception
 from ..models.trace_with_context import TraceInfoWithContext
-from ..models.traces import TraceInfo
 from ..models.worker_configuration import WorkerConfiguration
+from ..utils.monitoring import set_traces_stats
+from ..utils.utils import timing
+from .constants import UTRACE_EXT
+from .scheduling import PRIORITY_DEFAULT, get_trace_size
 
 log = logging.getLogger(__name__)
 
 
+class QueueNotifier:
+    """
+    Wakes up the long-polling workers when a trace is queued.
+    `version` grows on every notification, so a waiter which takes the version before looking into the queue
+    never misses a trace queued in between.
+    """
+
+    def __init__(self):
+        self._condition: Optional[asyncio.Condition] = None
+        self.version: int = 0
+
+    def _get_condition(self) -> asyncio.Condition:
+        # created lazily to be bound to the running loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def notify(self):
+        self.version += 1
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+    async def wait(self, version: int, timeout: float) -> bool:
+        """Returns False if nothing was queued since the `version` within the `timeout`"""
+        condition = self._get_condition()
+        try:
+            async with condition:
+                await asyncio.wait_for(condition.wait_for(lambda: self.version != version), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+queue_notifier = QueueNotifier()
+
+
 @retry_on_mongo_exception
 async def add_queued_trace(
     database: MongoDatabase,
     trace_name: str,
     worker_configuration: WorkerConfiguration,
-    creation_date: datetime
+    creation_date: datetime,
+    trace_size: Optional[int] = None,
+    priority: int = PRIORITY_DEFAULT
 ):
-    async with await database.start_session() as session, session.start_transaction():
+    if trace_size is None:
+        # a stat of a network share may take a while, it is off the event loop
+        trace_size = await asyncio.get_running_loop().run_in_executor(
+            None, get_trace_size, Configs.trace_sessions_dir, trace_name
+        )
+    queued = False
+    async with database.transaction() as session:
         trace_info: TraceInfoWithContext = await database.find_queued_trace(trace_name, session)
         if trace_info is None:
-            trace_info = TraceInfoWithContext(trace_name=trace_name, creation_date=creation_date)
+            trace_info = TraceInfoWithContext(
+                trace_name=trace_name,
+                creation_date=creation_date,
+                trace_size=trace_size,
+                priority=priority
+            )
             trace_info.worker_configuration = worker_configuration
             await database.set_queued_trace(trace_info, session)
             log.info(f"Registered queued trace: {trace_info.trace_name}")
-        return trace_info
+            queued = True
+    if queued:
+        await queue_notifier.notify()
+    return trace_info
 
 
+@timing("Enqueue unprocessed traces", log_level=logging.INFO)
 async def enqueue_unprocessed_traces(database: MongoDatabase):
     @retry_on_mongo_exception
-    async def find_queued_trace(trace_name: str) -> Optional[TraceInfo]:
-        return await database.find_queued_trace(trace_name)
+    async def get_known_trace_names() -> Set[str]:
+        return await database.get_known_trace_names()
 
     @retry_on_mongo_exception
-    async def find_ready_trace(trace_name: str) -> Optional[TraceInfo]:
-        return await database.find_ready_trace(trace_name)
+    async def insert_queued_traces(traces: List[TraceInfoWithContext]) -> int:
+        return await database.insert_queued_traces(traces)
 
     traces_dir: str = os.path.join(Configs.trace_sessions_dir)
     ignore = Configs.ignore or set()
 
-    traces = set()
-    for name in os.listdir(traces_dir):
-        if os.path.isfile(os.path.join(traces_dir, name)) and name.endswith(UTRACE_EXT):
-            traces.add(os.path.splitext(name)[0])
-
-    missing = set()
-    for trace in traces:
-        if trace in ignore:
-            continue
+    traces: Dict[str, int] = dict()
+    with os.scandir(traces_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(UTRACE_EXT) and entry.is_file():
+                traces[os.path.splitext(entry.name)[0]] = entry.stat().st_size
 
-        trace_info = await find_queued_trace(trace)
-        if trace_info is not None:
-            continue
-
-        trace_info = await find_ready_trace(trace)
-        if trace_info is not None:
-            continue
+    missing = traces.keys() - await get_known_trace_names() - set(ignore)
+    log.debug(f"Going to add to queue: {missing}, ignoring: {Configs.ignore}")
+    if not missing:
+        return
 
-        missing.add(trace)
+    now = datetime.datetime.now()
+    inserted = await insert_queued_traces([
+        TraceInfoWithContext(
+            trace_name=trace_name,
+            creation_date=now,
+            worker_configuration=WorkerConfiguration(),
+            trace_size=traces[trace_name]
+        )
+        for trace_name in sorted(missing)
+    ])
+    log.info(f"Registered {inserted} queued trace(s) of {len(traces)} in {traces_dir}")
+    await queue_notifier.notify()
 
-    log.debug(f"Going to add to queue: {missing}, ignoring: {Configs.ignore}")
 
-    for missed in missing:
-        await add_queued_trace(database, missed, WorkerConfiguration(), datetime.datetime.now())
+async def recount_traces_stats_loop(database: MongoDatabase, interval_minutes: float):
+    """The stats are maintained incrementally by the requests, the recount only fixes a drift"""
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            set_traces_stats(await database.recount_traces_stats())
+        except pymongo.errors.PyMongoError as e:
+            log.warning(f"recount_traces_stats_loop: {type(e).__name__} {e}")
@@ -0,0 +1,89 @@
+import os
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+
+from ..configs import QueuePolicy
+from ..models.trace_with_context import TraceInfoWithContext
+from .constants import UTRACE_EXT
+
+__ALL__ = ["QueueOrder", "QUEUE_INDEXES", "branch_priority", "get_trace_size"]
+
+KEY_CREATION_DATE = "creation_date"
+KEY_PRIORITY = "priority"
+KEY_TRACE_SIZE = "trace_size"
+
+PRIORITY_DEFAULT = 0
+PRIORITY_MAIN_BRANCH = 1
+MAIN_BRANCHES = ("master", "main")
+RELEASE_BRANCH_PREFIX = "release"
+
+QUEUE_INDEXES = [
+    [(KEY_PRIORITY, DESCENDING), (KEY_CREATION_DATE, ASCENDING)],
+    [(KEY_TRACE_SIZE, ASCENDING), (KEY_CREATION_DATE, ASCENDING)],
+]
+
+# traces of unknown size go after the known ones in the shortest-job-first order
+UNKNOWN_SIZE = float("inf")
+
+
+def branch_priority(branch: Optional[str]) -> int:
+    """
+    master and release traces go first. A trace without a branch gets the default priority,
+    as the traces queued by the manager itself, which doesn't know their branches
+    """
+    if branch and (branch in MAIN_BRANCHES or branch.startswith(RELEASE_BRANCH_PREFIX)):
+        return PRIORITY_MAIN_BRANCH
+    return PRIORITY_DEFAULT
+
+
+def get_trace_size(trace_sessions_dir: str, trace_name: str) -> Optional[int]:
+    try:
+        return os.path.getsize(os.path.join(trace_sessions_dir, trace_name + UTRACE_EXT))
+    except OSError:
+        return None
+
+
+class QueueOrder:
+    """
+    Order in which queued traces are handed to the workers:
+    - fifo: by creation date;
+    - branch: by priority (master/release first), then by creation date;
+    - sjf: shortest job first, by trace size, then by creation date.
+    With `branch` and `sjf` a trace waiting longer than `aging` goes before all the others, so none starves.
+    The same order is given as mongo queries and as a python sort key, the latter is used by the simulation.
+    """
+
+    def __init__(self, policy: QueuePolicy, aging: Optional[timedelta] = None):
+        self.policy = policy
+        self.aging = aging if policy != QueuePolicy.Fifo else None
+
+    def mongo_queries(self, now: datetime) -> List[Tuple[dict, List[Tuple[str, int]]]]:
+        """(filter, sort) pairs to try one by one, the first found trace is the next one"""
+        by_creation_date = [(KEY_CREATION_DATE, ASCENDING)]
+        if self.policy == QueuePolicy.Fifo:
+            return [({}, by_creation_date)]
+
+        queries = list()
+        if self.aging is not None:
+            queries.append(({KEY_CREATION_DATE: {"$lt": now - self.aging}}, by_creation_date))
+        if self.policy == QueuePolicy.Branch:
+            queries.append(({}, [(KEY_PRIORITY, DESCENDING), *by_creation_date]))
+        else:
+            # mongo puts missing values first, traces of unknown size are queried last
+            queries.append(({KEY_TRACE_SIZE: {"$type": "number"}}, [(KEY_TRACE_SIZE, ASCENDING), *by_creation_date]))
+            queries.append(({}, by_creation_date))
+        return queries
+
+    def sort_key(self, now: datetime) -> Callable[[TraceInfoWithContext], Any]:
+        def key(trace: TraceInfoWithContext):
+            aged = self.aging is not None and trace.creation_date < now - self.aging
+            if aged or self.policy == QueuePolicy.Fifo:
+                return 0, trace.creation_date
+            if self.policy == QueuePolicy.Branch:
+                return 1, -(trace.priority or PRIORITY_DEFAULT), trace.creation_date
+            size = UNKNOWN_SIZE if trace.trace_size is None else trace.trace_size
+            return 1, size, trace.creation_date
+
+        return key
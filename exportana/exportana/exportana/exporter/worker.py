@@ -1,9 +1,11 @@
+import asyncio
 import logging
+from typing import Callable
 
 import httpx
-from httpx import Response, NetworkError
+from httpx import NetworkError, Response
 
-from ..models.worker import WorkerInfo
+from ..models.worker import WorkerHeartbeat, WorkerInfo
 from ..utils.utils import make_url
 
 log = logging.getLogger(__name__)
@@ -25,3 +27,18 @@ async def go_offline(worker: WorkerInfo):
             log.warning(f"[{go_offline.__name__}]: {response.content}")
         else:
             log.info(f"Worker set offline. {worker.json()}")
+
+
+async def heartbeat_loop(get_heartbeat: Callable[[], WorkerHeartbeat], interval_sec: float):
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                response: Response = await client.put(
+                    make_url("worker", "heartbeat"),
+                    content=get_heartbeat().json(by_alias=True)
+                )
+                if not response.is_success:
+                    log.debug(f"[{heartbeat_loop.__name__}]: {response.status_code} {response.content}")
+            except httpx.HTTPError as e:
+                log.debug(f"[{heartbeat_loop.__name__}]: {type(e).__name__}: {e}")
+            await asyncio.sleep(interval_sec)
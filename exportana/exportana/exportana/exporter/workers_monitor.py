@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional, Set
+
+import httpx
+from starlette import status
+
+from ..database.broker import MongoDatabase
+from ..models.worker import WorkerInfo, WorkerStatus
+from ..utils.utils import make_entrypoint_address
+
+__ALL__ = ["WorkersMonitor", "workers_monitor"]
+
+log = logging.getLogger(__name__)
+
+
+class WorkersMonitor:
+    """
+    Cached statuses of the known workers, refreshed by a background sweep.
+    Workers pushing heartbeats are taken from the registry in mongo. The others (older workers) are polled
+    concurrently, each one within `timeout_sec`, so a hung worker is reported offline instead of stalling the callers.
+    """
+
+    def __init__(self):
+        self.addresses: Set[str] = set()
+        self._workers: Dict[str, WorkerInfo] = dict()
+        self._database: Optional[MongoDatabase] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._timeout_sec: float = 2
+        self._heartbeat_ttl_sec: float = 60
+        self._task: Optional[asyncio.Task] = None
+
+    def start(
+        self,
+        database: MongoDatabase,
+        interval_sec: float,
+        timeout_sec: float,
+        heartbeat_ttl_sec: float,
+        max_connections: int = 32
+    ):
+        self._database = database
+        self._timeout_sec = timeout_sec
+        self._heartbeat_ttl_sec = heartbeat_ttl_sec
+        self._client = httpx.AsyncClient(
+            timeout=timeout_sec,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self._task = asyncio.create_task(self._sweep_loop(interval_sec))
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self._client:
+            await self._client.aclose()
+
+    def add(self, address: str):
+        self.addresses.add(address)
+
+    def remove(self, address: str):
+        self.addresses.discard(address)
+        self._workers.pop(address, None)
+
+    async def get_workers(self) -> List[WorkerInfo]:
+        """Working workers go first, then idle, then offline"""
+        if self.addresses - self._workers.keys():
+            # not polled yet
+            await self.refresh()
+        workers = list(self._workers.values())
+        return [
+            *filter(lambda w: w.status == WorkerStatus.working, workers),
+            *filter(lambda w: w.status == WorkerStatus.idle, workers),
+            *filter(lambda w: w.status == WorkerStatus.offline, workers),
+        ]
+
+    async def refresh(self):
+        workers: Dict[str, WorkerInfo] = {
+            heartbeat.url: WorkerInfo.parse_obj(heartbeat.dict())
+            for heartbeat in await self._database.get_worker_heartbeats(self._heartbeat_ttl_sec)
+        }
+        self.addresses.update(workers.keys())
+
+        addresses = list(self.addresses - workers.keys())
+        results = await asyncio.gather(*[self._get_status(address) for address in addresses])
+        workers.update(zip(addresses, results))
+        self._workers = workers
+
+    async def _sweep_loop(self, interval_sec: float):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                log.warning(f"WorkersMonitor. Sweep failed: {type(e).__name__} {e}")
+            await asyncio.sleep(interval_sec)
+
+    async def _get_status(self, address: str) -> WorkerInfo:
+        entrypoint_url = make_entrypoint_address(f"http://{address}", ["worker", "status"])
+        try:
+            response = await asyncio.wait_for(self._client.get(entrypoint_url), self._timeout_sec)
+        except Exception as e:
+            log.debug(f"WorkersMonitor. {address} is offline: {type(e).__name__} {e}")
+            return WorkerInfo(url=address, status=WorkerStatus.offline)
+
+        if response.status_code == status.HTTP_200_OK:
+            try:
+                return json.loads(response.content, object_hook=lambda d: WorkerInfo(**d))
+            except Exception as e:
+                log.warning(f"WorkersMonitor. Error on deserialize worker_info {response.text}. {e}")
+        return WorkerInfo(url=address, status=WorkerStatus.offline)
+
+
+workers_monitor = WorkersMonitor()
@@ -2,19 +2,21 @@ import logging
 import re
 from collections import defaultdict
 from datetime import datetime
+from enum import Enum
 from typing import Any, Dict, List, Optional, Tuple
 
 from configargparse import Namespace
 from pydantic import BaseModel, Extra
 
 from ..exporter.constants import (
-    METADATA_PREFIX,
+    DEFAULT_ELASTICSEARCH_INDEX_PREFIX,
+    IS_SERVER_KEY,
     METADATA_DELIMITER,
+    METADATA_PREFIX,
     NAME_KEY,
-    DEFAULT_ELASTICSEARCH_INDEX_PREFIX,
-    IS_SERVER_KEY)
+)
 from ..utils.compatibility import removeprefix
-from ..utils.utils import get_hostname_from_ip
+from ..utils.hostname_resolver import hostname_resolver
 
 BUILD_KEY = "build"
 BRANCH_BUILD_KEY = "branch_build"
@@ -137,6 +139,14 @@ def try_parse_trace_name(trace_name):
     return current_time_str, UNKNOWN_VALUE
 
 
+class TraceStage(str, Enum):
+    """Steps of the trace processing pipeline on a worker"""
+    acquire = "acquire"
+    insights = "insights"
+    export = "export"
+    report = "report"
+
+
 class DotDefaultDict(defaultdict):
     __getattr__ = defaultdict.get
     __setattr__ = defaultdict.__setitem__
@@ -167,13 +177,15 @@ class TraceMeta(BaseModel):
 
     started_timestamp: float = 0.0
     processed_timestamp: float = 0.0
+    # seconds spent in each pipeline stage, reported to the manager for the metrics
+    stage_durations: Dict[TraceStage, float] = {}
 
     def __init__(self, **kwargs):
         super(TraceMeta, self).__init__(**kwargs)
 
-    def update(self, bookmarks: List[dict], trace_name: str, metadata_names: List[str] = None,
-               parsed_args: Namespace = None,
-               **kwargs):
+    async def update(self, bookmarks: List[dict], trace_name: str, metadata_names: List[str] = None,
+                     parsed_args: Namespace = None,
+                     **kwargs):
         parsed_args = parsed_args or DotDefaultDict(default_factory=None)
 
         init_data = get_bookmarks_metadata(
@@ -194,6 +206,7 @@ class TraceMeta(BaseModel):
             log.warning(f"No trace version found! Trace seem to be corrupt or incomplete.")
 
         started_timestamp = self.started_timestamp
+        stage_durations = self.stage_durations
 
         super().__init__(**init_data, **kwargs)
 
@@ -215,15 +228,16 @@ class TraceMeta(BaseModel):
         self.workstation = parsed_args.workstation or self.workstation
         if not self.workstation:
             if workstation and workstation[0]:
-                self.workstation = get_hostname_from_ip(workstation[0])
+                self.workstation = await hostname_resolver.resolve(workstation[0])
             self.workstation = self.workstation or UNKNOWN_VALUE
         self.workstation = self.workstation.lower()
 
         self.es_index = self._make_es_index(parsed_args.elasticsearch_index_prefix)
         self.started_timestamp = started_timestamp
+        self.stage_durations = stage_durations
 
     def to_elasticsearch(self) -> Dict[str, Any]:
-        return self.dict(exclude={"perfana_ulr"})
+        return self.dict(exclude={"perfana_ulr", "stage_durations"})
 
     def _make_es_index(self, es_index_prefix: str):
         index_name = f"{es_index_prefix}-" if es_index_prefix else f"{DEFAULT_ELASTICSEARCH_INDEX_PREFIX}-"
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Optional
 
 from exportana.models.traces import TraceInfo
@@ -6,7 +7,12 @@ from exportana.models.worker_configuration import WorkerConfiguration
 
 class TraceInfoWithContext(TraceInfo):
     worker_configuration: Optional[WorkerConfiguration] = None
+    trace_size: Optional[int] = None
+    # higher goes first with the `branch` queue policy
+    priority: int = 0
 
 
 class TraceInProcessing(TraceInfoWithContext):
     worker_url: str = None
+    worker_slot: int = 0
+    lease_expiry: Optional[datetime] = None
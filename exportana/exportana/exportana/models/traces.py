@@ -1,11 +1,12 @@
 from datetime import datetime
-from typing import Optional, List, Union
+from enum import Enum
+from typing import List, Optional, Union
 
-from pydantic import Field, BaseModel
+from pydantic import BaseModel, Field
 
-from .base import DBModel, VerboseResult, OrderedEnum
-from .trace_meta import TraceMeta
 from ..models.worker import Worker
+from .base import DBModel, OrderedEnum, VerboseResult
+from .trace_meta import TraceMeta
 
 
 class TraceStatus(str, OrderedEnum):
@@ -16,6 +17,21 @@ class TraceStatus(str, OrderedEnum):
     POISONED = "poisoned"
 
 
+class BranchClass(str, Enum):
+    master = "master"
+    # traces without a branch are release ones
+    release = "release"
+    branch = "branch"
+
+
+def get_branch_class(branch: Optional[str]) -> BranchClass:
+    if branch == BranchClass.master:
+        return BranchClass.master
+    if not branch:
+        return BranchClass.release
+    return BranchClass.branch
+
+
 class TraceInfo(DBModel, allow_population_by_field_name=True):
     trace_name: str = Field(None, example="19960303_133333_127.0.0.1", alias="_id")
     creation_date: datetime = None
@@ -37,7 +53,34 @@ class ProcessedTraceReport(BaseModel):
 
 class ProcessedTraceInfo(TraceInfo):
     processing_reports: List[ProcessedTraceReport] = []
+    # processed_date and branch class of the last report, denormalized to query in mongo
+    last_processed_date: Optional[datetime] = None
+    branch_class: Optional[BranchClass] = None
+
+    def add_report(self, report: ProcessedTraceReport):
+        self.processing_reports.append(report)
+        self.last_processed_date = report.processed_date
+        trace_meta = report.trace_meta
+        branch = trace_meta.get("branch") if isinstance(trace_meta, dict) else getattr(trace_meta, "branch", None)
+        self.branch_class = get_branch_class(branch)
+
+
+class ProcessedTraceSummary(TraceInfo):
+    last_processed_date: Optional[datetime] = None
+    last_report: Optional[ProcessedTraceReport] = None
+
+
+class ProcessedTracesPage(BaseModel):
+    traces: List[ProcessedTraceSummary] = []
+    # pass as `after` to get the next page, None on the last page
+    after: Optional[str] = None
 
 
 class TraceInfoStatus(TraceInfo):
     status: TraceStatus = TraceStatus.UNKNOWN
+
+
+class TracesStats(BaseModel):
+    queued: int = 0
+    ready: int = 0
+    poisoned: int = 0
@@ -1,10 +1,11 @@
 import logging
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional
 
 from pydantic import Field
 
-from .base import DBModel, OrderedEnum
 from ..exporter.constants import LOCALHOST, URL
+from .base import DBModel, OrderedEnum
 
 log = logging.getLogger(__name__)
 
@@ -17,9 +18,14 @@ class WorkerStatus(str, OrderedEnum):
 
 class Worker(DBModel, allow_population_by_field_name=True):
     url: str = Field(None, example=LOCALHOST, alias="_id")
+    # a worker processes up to `--max-concurrent-traces` traces, one per slot
+    slot: int = 0
 
     def __lt__(self, other):
-        return self.url < other.url
+        return (self.url, self.slot) < (other.url, other.slot)
+
+    def get_slot_name(self) -> str:
+        return self.url if not self.slot else f"{self.url}#{self.slot}"
 
     def get_id(self) -> dict:
         return self.dict(by_alias=True, include={URL})
@@ -31,3 +37,15 @@ class Worker(DBModel, allow_population_by_field_name=True):
 class WorkerInfo(Worker):
     status: WorkerStatus = WorkerStatus.idle
     trace_name: Optional[str] = None
+    trace_names: List[str] = []
+
+
+class WorkerHeartbeat(WorkerInfo):
+    """Status and resource usage the worker pushes to the manager's registry"""
+    slots: int = 1
+    busy_slots: int = 0
+    cpu_percent: Optional[float] = None
+    rss_bytes: Optional[int] = None
+    # free disk in the `trace_sessions_dir`
+    free_disk_bytes: Optional[int] = None
+    last_seen: Optional[datetime] = None
@@ -1,27 +1,46 @@
-import json
+import asyncio
 import logging
-from datetime import datetime
-from typing import List, Optional
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
 
-import httpx
-from elasticsearch import AsyncElasticsearch
-from fastapi import APIRouter, status, Request
-from fastapi.responses import Response
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
 
-from ..configs import Configs
+from ..configs import Configs, int_or_none
 from ..database.broker import MongoDatabase
 from ..database.utils import retry_on_mongo_exception
-from ..exporter.constants import KEY_TRACE_NAME, KEY_TRACE_ID, KEY_TRACE_SIZE, KEY_TIME_STAMP, UTRACE_EXT
-from ..exporter.manager import add_queued_trace
+from ..exporter.constants import (
+    ACQUIRE_SEC_HEADER,
+    DEFAULT_ACQUIRE_WAIT_SEC,
+    KEY_TIME_STAMP,
+    KEY_TRACE_BRANCH,
+    KEY_TRACE_ID,
+    KEY_TRACE_NAME,
+    KEY_TRACE_PRIORITY,
+    KEY_TRACE_SIZE,
+    MAX_ACQUIRE_WAIT_SEC,
+    UTRACE_EXT,
+)
+from ..exporter.elastic_clients import elastic_clients
+from ..exporter.manager import add_queued_trace, queue_notifier
+from ..exporter.scheduling import QueueOrder, branch_priority
+from ..exporter.workers_monitor import workers_monitor
 from ..models.base import VerboseResult
 from ..models.trace_with_context import TraceInfoWithContext, TraceInProcessing
-from ..models.traces import TraceInfo, ProcessedTraceInfo, ProcessedTraceReport, TraceInfoStatus, TraceStatus
-from ..models.worker import Worker, WorkerStatus, WorkerInfo
+from ..models.traces import (
+    ProcessedTraceInfo,
+    ProcessedTraceReport,
+    ProcessedTracesPage,
+    TraceInfo,
+    TraceInfoStatus,
+    TraceStatus,
+)
+from ..models.worker import Worker, WorkerHeartbeat, WorkerInfo, WorkerStatus
 from ..models.worker_configuration import WorkerConfiguration
 from ..utils import monitoring
 from ..utils.cleanup import delete_traces_from_index
 from ..utils.compatibility import removesuffix
-from ..utils.utils import make_entrypoint_address
+from ..utils.utils import human_read_to_byte
 
 __ALL__ = ["router"]
 
@@ -31,39 +50,57 @@ router = APIRouter(prefix="/manager", responses={404: {"description": "Page not
 trace_router = APIRouter(prefix="/trace", tags=["manager / trace"])
 worker_router = APIRouter(prefix="/worker", tags=["manager / worker"])
 
-workers_addresses: set = set()
+queue_order = QueueOrder(Configs.queue_policy, timedelta(minutes=Configs.queue_aging_minutes))
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
 
 
 @worker_router.get("/list", response_model=List[WorkerInfo])
 async def worker_list(request: Request):
-    async with httpx.AsyncClient() as client:
-        workers: List[WorkerInfo] = list()
-
-        for worker_address in workers_addresses:
-            entrypoint_url = make_entrypoint_address(f"http://{worker_address}", ["worker", "status"])
-            response: Response = None
-            try:
-                response: Response = await client.request(method="GET", url=entrypoint_url)
-            except Exception as e:
-                worker_info = WorkerInfo()
-                worker_info.url = worker_address
-                worker_info.status = WorkerStatus.offline
-                workers.append(worker_info)
-                continue
-
-            if response and response.status_code == status.HTTP_200_OK:
-                try:
-                    worker_info: WorkerInfo = json.loads(response.content, object_hook=lambda d: WorkerInfo(**d))
-                    workers.append(worker_info)
-                except Exception as e:
-                    if response and response.text:
-                        log.warning(f"worker_list. Error on deserialize worker_info {response.text}. {e}")
-
-    idle_workers = filter(lambda w: w.status == WorkerStatus.idle, workers)
-    working_workers = filter(lambda w: w.status == WorkerStatus.working, workers)
-    offline_workers = filter(lambda w: w.status == WorkerStatus.offline, workers)
-
-    return [*working_workers, *idle_workers, *offline_workers]
+    return await workers_monitor.get_workers()
+
+
+@worker_router.put("/heartbeat", status_code=status.HTTP_202_ACCEPTED)
+@retry_on_mongo_exception
+async def worker_heartbeat(request: Request, heartbeat: WorkerHeartbeat):
+    workers_monitor.add(heartbeat.url)
+    heartbeat.last_seen = datetime.now()
+
+    db: MongoDatabase = request.state.db
+    await db.set_worker_heartbeat(heartbeat)
+    # a live worker keeps its traces however long they take
+    await db.renew_processing_leases(heartbeat.url, heartbeat.last_seen + timedelta(hours=Configs.trace_lease_hours))
+    monitoring.set_worker_resources(heartbeat)
+    return Response(status_code=status.HTTP_202_ACCEPTED)
+
+
+@worker_router.post("/set/offline", status_code=status.HTTP_202_ACCEPTED)
+@retry_on_mongo_exception
+async def worker_set_offline(request: Request, worker: Worker):
+    db: MongoDatabase = request.state.db
+    await db.remove_worker_heartbeat(worker.url)
+    workers_monitor.remove(worker.url)
+    monitoring.remove_worker_resources(worker.url)
+    log.info(f"worker_set_offline: {worker.url}")
+    return Response(status_code=status.HTTP_202_ACCEPTED)
+
+
+async def _is_overloaded(db: MongoDatabase, worker_url: str) -> bool:
+    heartbeat = await db.find_worker_heartbeat(worker_url)
+    if heartbeat is None:
+        # an older worker without heartbeats
+        return False
+    if Configs.worker_max_cpu_percent is not None and heartbeat.cpu_percent is not None \
+            and heartbeat.cpu_percent > Configs.worker_max_cpu_percent:
+        log.info(f"Worker {worker_url} is overloaded: CPU {heartbeat.cpu_percent}%")
+        return True
+    if Configs.worker_min_free_disk is not None and heartbeat.free_disk_bytes is not None \
+            and heartbeat.free_disk_bytes < human_read_to_byte(Configs.worker_min_free_disk):
+        log.info(f"Worker {worker_url} is overloaded: {heartbeat.free_disk_bytes} bytes of free disk")
+        return True
+    return False
 
 
 @trace_router.get("/queued/list", response_model=List[TraceInfoWithContext])
@@ -74,56 +111,107 @@ async def trace_queued_list(request: Request):
     return queued_traces
 
 
-@trace_router.get("/queued/acquire", response_model=TraceInfoWithContext)
 @retry_on_mongo_exception
+async def _find_or_claim_trace(db: MongoDatabase, worker: Worker) -> Tuple[Optional[TraceInfoWithContext], bool]:
+    """:return: the trace of the worker slot and whether it has been claimed from the queue just now"""
+    lease_expiry = datetime.now() + timedelta(hours=Configs.trace_lease_hours)
+    trace_info: Optional[TraceInProcessing] = await db.find_processing_trace(worker.url, worker.slot)
+    if trace_info:
+        # the worker was restarted while processing the trace, it takes the trace again
+        trace_info.lease_expiry = lease_expiry
+        await db.set_processing_trace(trace_info)
+        claimed = False
+    elif await _is_overloaded(db, worker.url):
+        return None, False
+    else:
+        trace_info = await db.claim_trace(worker.url, worker.slot, lease_expiry, queue_order)
+        claimed = trace_info is not None
+
+    if trace_info is None:
+        return None, False
+    if not trace_info.worker_configuration:
+        trace_info.worker_configuration = WorkerConfiguration()
+    # region set metrics for prometheus
+    monitoring.set_traces_stats(await db.get_traces_stats())
+    monitoring.set_worker_status(worker.get_slot_name(), WorkerStatus.working)
+    # endregion
+    log.debug(f"trace_queued_acquire: worker={worker.json()} acquired={trace_info.json()}")
+
+    return trace_info, claimed
+
+
+async def _acquire_trace(db: MongoDatabase, worker: Worker) -> Optional[TraceInfoWithContext]:
+    trace_info, claimed = await _find_or_claim_trace(db, worker)
+    if claimed:
+        # observed once the claim is committed, a retry of the claim must not count it again
+        monitoring.set_trace_queue_wait(trace_info.creation_date)
+    return trace_info
+
+
+@trace_router.get("/queued/acquire", response_model=TraceInfoWithContext)
 async def trace_queued_acquire(request: Request, worker: Worker):
-    workers_addresses.add(worker.url)
+    workers_monitor.add(worker.url)
 
-    db: MongoDatabase = request.state.db
-    async with await db.start_session() as session, session.start_transaction():
-        trace_info: Optional[TraceInfoWithContext] = None
-        trace_in_processing = await db.find_processing_trace(worker.url)
-        if trace_in_processing:
-            trace_info = trace_in_processing
-        else:
-            trace_info = await db.extract_trace_from_queue(session)
+    trace_info = await _acquire_trace(request.state.db, worker)
+    if trace_info is None:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    return trace_info
 
-        if trace_info is None:
-            return Response(status_code=status.HTTP_404_NOT_FOUND)
-        if not trace_info.worker_configuration:
-            trace_info.worker_configuration = WorkerConfiguration()
-        # region set metrics for prometheus
-        traces_count = await db.get_queued_trace_count(session)
-        monitoring.set_traces_queue_count(traces_count)
-        monitoring.set_worker_status(worker.url, WorkerStatus.working)
-        # endregion
-        log.debug(f"trace_queued_acquire: worker={worker.json()} acquired={trace_info.json()}")
 
-        if not trace_in_processing:
-            trace_in_processing = TraceInProcessing()
-            trace_in_processing.trace_name = trace_info.trace_name
-            trace_in_processing.creation_date = trace_info.creation_date
-            trace_in_processing.worker_configuration = trace_info.worker_configuration
-            trace_in_processing.worker_url = worker.url
-            await db.set_processing_trace(trace_in_processing)
+@trace_router.get(
+    "/queued/acquire_wait",
+    response_model=TraceInfoWithContext,
+    responses={204: {"description": "Nothing was queued within the timeout"}}
+)
+async def trace_queued_acquire_wait(
+    request: Request,
+    response: Response,
+    worker: Worker,
+    timeout_sec: float = DEFAULT_ACQUIRE_WAIT_SEC
+):
+    """
+    Long-poll version of the acquire: holds the request until a trace is queued or the timeout passes.
+    The time the trace took to claim, without the waiting, is in the `ACQUIRE_SEC_HEADER` header.
+    """
+    workers_monitor.add(worker.url)
 
-        return trace_info
+    db: MongoDatabase = request.state.db
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(max(timeout_sec, 0), MAX_ACQUIRE_WAIT_SEC)
+    while True:
+        version = queue_notifier.version
+        start = loop.time()
+        trace_info = await _acquire_trace(db, worker)
+        if trace_info is not None:
+            response.headers[ACQUIRE_SEC_HEADER] = f"{loop.time() - start:.6f}"
+            return trace_info
+
+        timeout = deadline - loop.time()
+        if timeout <= 0 or not await queue_notifier.wait(version, timeout):
+            return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @trace_router.put("/queued/put", response_model=TraceInfo, status_code=status.HTTP_202_ACCEPTED)
 @retry_on_mongo_exception
-async def trace_queued_put(request: Request, trace_name: str):
+async def trace_queued_put(
+    request: Request,
+    trace_name: str,
+    trace_size: Optional[int] = None,
+    priority: Optional[int] = None,
+    branch: Optional[str] = None
+):
+    """`priority` goes first, otherwise it is derived from the `branch` if any"""
     if trace_name.endswith(UTRACE_EXT):
         trace_name = removesuffix(trace_name, UTRACE_EXT)
+    if priority is None:
+        priority = branch_priority(branch)
 
     db: MongoDatabase = request.state.db
-    async with await db.start_session() as session, session.start_transaction():
-        result = await add_queued_trace(db, trace_name, WorkerConfiguration(), datetime.now())
-        # region set metrics for prometheus
-        traces_count = await db.get_queued_trace_count(session)
-        monitoring.set_traces_queue_count(traces_count)
-        # endregion
-        return result
+    result = await add_queued_trace(db, trace_name, WorkerConfiguration(), datetime.now(), trace_size, priority)
+    # region set metrics for prometheus
+    monitoring.set_traces_stats(await db.get_traces_stats())
+    # endregion
+    return result
 
 
 @trace_router.put("/queued/put_trace_meta", response_model=TraceInfo, status_code=status.HTTP_202_ACCEPTED)
@@ -141,7 +229,13 @@ async def trace_queued_put_trace_meta(request: Request, trace_data: dict):
             f"Size: {trace_data[KEY_TRACE_SIZE]}, "
             f"TimeStamp: {trace_data[KEY_TIME_STAMP]}"
         )
-        await trace_queued_put(request, trace_name)
+        await trace_queued_put(
+            request,
+            trace_name,
+            trace_size=int_or_none(trace_data[KEY_TRACE_SIZE]),
+            priority=int_or_none(trace_data[KEY_TRACE_PRIORITY]) if KEY_TRACE_PRIORITY in trace_data else None,
+            branch=trace_data.get(KEY_TRACE_BRANCH)
+        )
 
 
 @trace_router.put("/queued/drop", response_model=TraceInfo, status_code=status.HTTP_202_ACCEPTED)
@@ -151,22 +245,20 @@ async def trace_queued_drop(request: Request, trace_name: str):
         trace_name = removesuffix(trace_name, UTRACE_EXT)
 
     db: MongoDatabase = request.state.db
-    async with await db.start_session() as session, session.start_transaction():
-        trace_info = await db.find_queued_trace(trace_name)
+    async with db.transaction() as session:
+        trace_info = await db.find_queued_trace(trace_name, session)
         if not trace_info:
             return Response(status_code=status.HTTP_404_NOT_FOUND)
-        await db.remove_queued_trace(trace_info)
+        await db.remove_queued_trace(trace_info, session)
         log.warning(f"trace_queued_drop: trace {trace_name} was dropped.")
         return trace_info
 
 
-@trace_router.put("/queued/mark_poisoned", response_model=TraceInfo, status_code=status.HTTP_202_ACCEPTED)
 @retry_on_mongo_exception
-async def trace_queued_mark_poisoned(request: Request, report: ProcessedTraceReport):
-    workers_addresses.add(report.worker.url)
-
-    db: MongoDatabase = request.state.db
-    async with await db.start_session() as session, session.start_transaction():
+async def _set_poisoned_trace(db: MongoDatabase, report: ProcessedTraceReport) -> Optional[TraceInProcessing]:
+    """Moves the trace of the report from processing to poisoned. :return: the trace moved, None if there was none"""
+    processing_trace = None
+    async with db.transaction() as session:
         if report.trace_name:
             processing_trace = await db.find_processing_trace_by_name(report.trace_name, session)
             if processing_trace:
@@ -177,15 +269,26 @@ async def trace_queued_mark_poisoned(request: Request, report: ProcessedTraceRep
                     poisoned_trace_info.creation_date = processing_trace.creation_date
 
                 report.processed_date = datetime.now()
-                poisoned_trace_info.processing_reports.append(report)
+                poisoned_trace_info.add_report(report)
 
                 await db.set_poisoned_trace(poisoned_trace_info, session)
-                await db.remove_processing_trace(report.worker.url)
-                # region set metrics for prometheus
-                traces_count = await db.get_poisoned_trace_count(session)
-                monitoring.set_poisoned_traces_count(traces_count)
-                monitoring.set_worker_status(report.worker.url, WorkerStatus.idle)
-                # endregion
+                await db.remove_processing_trace(report.worker.url, report.worker.slot, session)
+    # the stats are updated once the transaction is committed
+    monitoring.set_traces_stats(await db.get_traces_stats())
+    return processing_trace
+
+
+@trace_router.put("/queued/mark_poisoned", response_model=TraceInfo, status_code=status.HTTP_202_ACCEPTED)
+async def trace_queued_mark_poisoned(request: Request, report: ProcessedTraceReport):
+    workers_monitor.add(report.worker.url)
+
+    # the results are observed once the retried transaction is committed, so they are counted once
+    processing_trace = await _set_poisoned_trace(request.state.db, report)
+    if processing_trace:
+        # region set metrics for prometheus
+        monitoring.set_trace_report_result(report, processing_trace.trace_size)
+        monitoring.set_worker_status(report.worker.get_slot_name(), WorkerStatus.idle)
+        # endregion
 
     error_msg = f"Exportana. Trace {report.trace_name} mark as poisoned: "
     error_msg += f"{report.result.errors}"
@@ -196,10 +299,10 @@ async def trace_queued_mark_poisoned(request: Request, report: ProcessedTraceRep
 @trace_router.put("/queued/release_from_worker", status_code=status.HTTP_202_ACCEPTED)
 @retry_on_mongo_exception
 async def trace_queued_release_from_worker(request: Request, report: ProcessedTraceReport):
-    workers_addresses.add(report.worker.url)
+    workers_monitor.add(report.worker.url)
 
     db: MongoDatabase = request.state.db
-    async with await db.start_session() as session, session.start_transaction():
+    async with db.transaction() as session:
         if report.trace_name:
             processing_trace = await db.find_processing_trace_by_name(report.trace_name, session)
             if processing_trace:
@@ -207,49 +310,86 @@ async def trace_queued_release_from_worker(request: Request, report: ProcessedTr
                     db,
                     processing_trace.trace_name,
                     processing_trace.worker_configuration,
-                    processing_trace.creation_date
+                    processing_trace.creation_date,
+                    processing_trace.trace_size,
+                    processing_trace.priority
                 )
-                await db.remove_processing_trace(report.worker.url, session)
-            # region set metrics for prometheus
-            traces_count = await db.get_queued_trace_count(session)
-            monitoring.set_traces_queue_count(traces_count)
-            monitoring.set_worker_status(report.worker.url, WorkerStatus.idle)
-            # endregion
-            warning_msg = f"Exportana. Trace {report.trace_name} released from the worker {report.worker.url}: "
-            warning_msg += f"{report.result.errors}"
-            log.info(warning_msg)
-            return Response(status_code=status.HTTP_202_ACCEPTED)
+                await db.remove_processing_trace(report.worker.url, report.worker.slot, session)
+    # region set metrics for prometheus
+    monitoring.set_traces_stats(await db.get_traces_stats())
+    monitoring.set_worker_status(report.worker.get_slot_name(), WorkerStatus.idle)
+    # endregion
+    warning_msg = f"Exportana. Trace {report.trace_name} released from the worker {report.worker.url}: "
+    warning_msg += f"{report.result.errors}"
+    log.info(warning_msg)
+    return Response(status_code=status.HTTP_202_ACCEPTED)
 
 
 @trace_router.get("/ready/list", response_model=List[ProcessedTraceInfo])
 @retry_on_mongo_exception
 async def trace_ready_list(request: Request):
     db: MongoDatabase = request.state.db
-    return sorted(
-        await db.get_ready_traces(),
-        key=lambda trace: trace.processing_reports[-1].processed_date,
-        reverse=False
-    )
+    return await db.get_ready_traces()
 
 
 @trace_router.get("/poisoned/list", response_model=List[ProcessedTraceInfo])
 @retry_on_mongo_exception
 async def trace_poisoned_list(request: Request):
     db: MongoDatabase = request.state.db
-    return sorted(
-        await db.get_poisoned_traces(),
-        key=lambda trace: trace.processing_reports[-1].processed_date,
-        reverse=False
-    )
+    return await db.get_poisoned_traces()
 
 
-@trace_router.put("/ready/put", status_code=status.HTTP_202_ACCEPTED)
+@trace_router.get("/ready/page", response_model=ProcessedTracesPage)
 @retry_on_mongo_exception
-async def trace_ready_put(request: Request, report: ProcessedTraceReport):
-    workers_addresses.add(report.worker.url)
+async def trace_ready_page(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None
+):
+    db: MongoDatabase = request.state.db
+    try:
+        return await db.get_ready_traces_page(limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
 
+@trace_router.get("/poisoned/page", response_model=ProcessedTracesPage)
+@retry_on_mongo_exception
+async def trace_poisoned_page(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None
+):
+    db: MongoDatabase = request.state.db
+    try:
+        return await db.get_poisoned_traces_page(limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+async def _ndjson(traces: AsyncIterator[ProcessedTraceInfo]) -> AsyncIterator[str]:
+    async for trace in traces:
+        yield trace.json(by_alias=True) + "\n"
+
+
+@trace_router.get("/ready/dump", response_class=StreamingResponse)
+async def trace_ready_dump(request: Request):
+    """All ready traces with full reports history, one JSON per line"""
     db: MongoDatabase = request.state.db
-    async with await db.start_session() as session, session.start_transaction():
+    return StreamingResponse(_ndjson(db.iterate_ready_traces()), media_type=NDJSON_MEDIA_TYPE)
+
+
+@trace_router.get("/poisoned/dump", response_class=StreamingResponse)
+async def trace_poisoned_dump(request: Request):
+    """All poisoned traces with full reports history, one JSON per line"""
+    db: MongoDatabase = request.state.db
+    return StreamingResponse(_ndjson(db.iterate_poisoned_traces()), media_type=NDJSON_MEDIA_TYPE)
+
+
+@retry_on_mongo_exception
+async def _set_ready_trace(db: MongoDatabase, report: ProcessedTraceReport) -> Optional[TraceInProcessing]:
+    """Moves the trace of the report from processing to ready. :return: the trace moved, None if there was none"""
+    async with db.transaction() as session:
         processing_trace = await db.find_processing_trace_by_name(report.trace_name, session)
         if processing_trace:
             processed_trace_info: ProcessedTraceInfo = await db.find_ready_trace(report.trace_name, session)
@@ -259,25 +399,35 @@ async def trace_ready_put(request: Request, report: ProcessedTraceReport):
                 processed_trace_info.creation_date = processing_trace.creation_date
 
             report.processed_date = datetime.now()
-            processed_trace_info.processing_reports.append(report)
+            processed_trace_info.add_report(report)
 
             await db.set_ready_trace(processed_trace_info, session)
-            await db.remove_processing_trace(report.worker.url, session)
+            await db.remove_processing_trace(report.worker.url, report.worker.slot, session)
 
             log.debug(f"trace_ready_put: {processed_trace_info}")
-            # region set metrics for prometheus
-            traces_count = await db.get_ready_trace_count(session)
-            monitoring.set_ready_traces_count(traces_count)
-            monitoring.set_trace_report_result(report)
-            monitoring.set_worker_status(report.worker.url, WorkerStatus.idle)
-            # endregion
+    # the stats are updated once the transaction is committed
+    monitoring.set_traces_stats(await db.get_traces_stats())
+    return processing_trace
+
+
+@trace_router.put("/ready/put", status_code=status.HTTP_202_ACCEPTED)
+async def trace_ready_put(request: Request, report: ProcessedTraceReport):
+    workers_monitor.add(report.worker.url)
+
+    # observed once committed as well
+    processing_trace = await _set_ready_trace(request.state.db, report)
+    if processing_trace:
+        # region set metrics for prometheus
+        monitoring.set_trace_report_result(report, processing_trace.trace_size)
+        monitoring.set_worker_status(report.worker.get_slot_name(), WorkerStatus.idle)
+        # endregion
 
 
 @trace_router.get("/get_status", status_code=status.HTTP_200_OK)
 @retry_on_mongo_exception
 async def get_trace_status(request: Request, trace_name: str):
     db: MongoDatabase = request.state.db
-    async with await db.start_session() as session, session.start_transaction():
+    async with db.transaction() as session:
         trace_info: TraceInfo = await db.find_queued_trace(trace_name, session)
         if trace_info is None:
             trace_info: TraceInProcessing = await db.find_processing_trace_by_name(trace_name, session)
@@ -314,10 +464,8 @@ async def trace_remove(
     workstation: str,
     test_start: str
 ):
-    elastic_url = Configs.elastic
-    es = AsyncElasticsearch(hosts=[elastic_url], retry_on_timeout=True)
+    es = elastic_clients.get(Configs.elastic)
     verbose_result: VerboseResult = await delete_traces_from_index(es, es_index, test_id, workstation, test_start)
-    await es.close()
     return verbose_result.json()
 
 
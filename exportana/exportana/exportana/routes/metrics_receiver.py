@@ -1,21 +1,21 @@
 import logging
 import uuid
 from collections import defaultdict
-from typing import List, Dict, Any, Optional
+from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
 from starlette import status
 
 from exportana.exporter.constants import (
+    METADATA_DELIMITER,
+    METADATA_PREFIX,
     NAME_KEY,
     TIMESTAMP_KEY,
-    METADATA_PREFIX,
-    METADATA_DELIMITER,
-    FRAME_START_KEY,
-    FRAME_END_KEY,
-    RAW_DATA_KEY
 )
+from exportana.exporter.events import EventMatcher
+from exportana.exporter.frame_store import FrameStore
+from exportana.exporter.frame_stream import FrameStream
 from exportana.utils.utils import flatten_dict
 
 __ALL__ = ["router"]
@@ -33,33 +33,93 @@ class MetricsHeader(BaseModel):
     metrics_count: Optional[int] = Field(0, alias="MetricFramesCount")
 
 
-class Frame(BaseModel):
-    frame_start: Optional[float] = Field(None, alias=FRAME_START_KEY)
-    frame_end: Optional[float] = Field(None, alias=FRAME_END_KEY)
-    data: Optional[Dict[str, Any]] = Field(None, alias="Data")
-    raw_data: Optional[Dict[str, Any]] = Field(None, alias=RAW_DATA_KEY)
+Bookmark = Dict[str, float]
 
-    def to_dict(self) -> dict:
-        result = dict()
-        result[FRAME_START_KEY] = self.frame_start
-        result[FRAME_END_KEY] = self.frame_end
-        result.update(self.data)
-        return result
+DEFAULT_SESSION_ID = ""
+SESSION_PREFIX = "/session/{session_id}"
 
 
-Bookmark = Dict[str, float]
+class MetricsSession:
+    """Everything received from Unreal Insights for a single trace"""
+
+    def __init__(self, session_id: str = DEFAULT_SESSION_ID):
+        self.session_id: str = session_id
+
+        self.metrics_names: List[str] = list()
+        self.metadata_names: List[str] = list()
+        self.metrics_bookmarks: List[dict] = list()
+        self.metrics_header: MetricsHeader = MetricsHeader()
+
+        # region perf settings
+        self.metrics_settings: Dict[str, Any] = dict()
+        self.metrics_budgets: Dict[str, Any] = dict()
+        # endregion
+
+        self.metrics: FrameStore = FrameStore(EXCLUDED_KEYS)
+        # frames go to the stream instead of `metrics` when the streaming export is on
+        self.metrics_stream: Optional[FrameStream] = None
+
+    def get_frames_count(self) -> int:
+        return self.metrics_stream.frames_count if self.metrics_stream else len(self.metrics)
+
+    def is_metrics_available(self) -> bool:
+        return all([
+            self.metrics_names,
+            self.metrics_header,
+            self.metrics_header.metrics_count > 0,
+            self.get_frames_count() == self.metrics_header.metrics_count
+        ])
+
+    def attach_stream(self, stream: FrameStream):
+        self.metrics_stream = stream
+
+    def flush_metrics(self):
+        self.metrics_names.clear()
+        self.metadata_names.clear()
+        self.metrics_bookmarks.clear()
+        self.metrics_header.metrics_count = 0
+        self.metrics.clear()
+        self.metrics_settings.clear()
+        self.metrics_budgets.clear()
+        self.metrics_stream = None
+
 
-metrics_names: List[str] = list()
-metadata_names: List[str] = list()
-metrics_bookmarks: List[dict] = list()
-metrics_header: MetricsHeader = MetricsHeader()
+sessions: Dict[str, MetricsSession] = {DEFAULT_SESSION_ID: MetricsSession()}
+# drops the timers of the frames which are not in `--events` at ingest, None keeps everything
+event_filter: Optional[EventMatcher] = None
 
-# region perf settings
-metrics_settings: Dict[str, Any] = dict()
-metrics_budgets: Dict[str, Any] = dict()
-# endregion
 
-metrics: List[Frame] = list()
+def set_event_filter(matcher: Optional[EventMatcher]):
+    global event_filter
+    event_filter = matcher
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def open_session(session_id: str = DEFAULT_SESSION_ID) -> MetricsSession:
+    session = sessions.get(session_id)
+    if session is None:
+        session = MetricsSession(session_id)
+        sessions[session_id] = session
+    return session
+
+
+def close_session(session: MetricsSession):
+    session.flush_metrics()
+    # the default session serves the requests without a session id, so it is always there
+    if session.session_id != DEFAULT_SESSION_ID:
+        sessions.pop(session.session_id, None)
+
+
+def get_session(session_id: str = DEFAULT_SESSION_ID) -> MetricsSession:
+    if session_id == DEFAULT_SESSION_ID:
+        return open_session()
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown session: {session_id}")
+    return session
 
 
 def reformat_bookmarks(bookmarks: List[Bookmark]):
@@ -88,79 +148,48 @@ def get_meta_from_bookmarks(bookmarks: List[Bookmark]) -> list:
     return result
 
 
-def is_metrics_available() -> bool:
-    return all([
-        metrics_names,
-        metrics_header,
-        metrics_header.metrics_count > 0,
-        len(metrics) == metrics_header.metrics_count
-    ])
-
-
-def flush_metrics():
-    global metrics_names
-    global metadata_names
-    global metrics_bookmarks
-    global metrics_header
-    global metrics
-    global metrics_settings
-    global metrics_budgets
-
-    metrics_names.clear()
-    metadata_names.clear()
-    metrics_bookmarks.clear()
-    metrics_header.metrics_count = 0
-    metrics.clear()
-    metrics_settings.clear()
-    metrics_budgets.clear()
-
-
 @router.post("/set/perf_config", status_code=status.HTTP_202_ACCEPTED)
-async def set_perf_config(request: Request, settings: Dict[str, Any]):
-    global metrics_settings
-    global metrics_budgets
-
+@router.post(SESSION_PREFIX + "/set/perf_config", status_code=status.HTTP_202_ACCEPTED)
+async def set_perf_config(request: Request, settings: Dict[str, Any], session: MetricsSession = Depends(get_session)):
     metrics_settings_flat = flatten_dict(settings, EXCLUDED_KEYS)
-    metrics_settings = settings
+    session.metrics_settings = settings
 
     for k, v in metrics_settings_flat.items():  # crutch
         if isinstance(v, int) or isinstance(v, float):
-            metrics_names.append(k)
-            metrics_budgets[k] = v
+            session.metrics_names.append(k)
+            session.metrics_budgets[k] = v
 
 
 @router.post("/set/metadata_names", status_code=status.HTTP_202_ACCEPTED)
-async def set_metadata_names(request: Request, names: List[str]):
-    global metadata_names
-    metadata_names = names
+@router.post(SESSION_PREFIX + "/set/metadata_names", status_code=status.HTTP_202_ACCEPTED)
+async def set_metadata_names(request: Request, names: List[str], session: MetricsSession = Depends(get_session)):
+    session.metadata_names = names
 
 
 @router.post("/set/bookmarks", status_code=status.HTTP_202_ACCEPTED)
-async def set_bookmarks(request: Request, bookmarks: List[Bookmark]):
-    global metrics_bookmarks
+@router.post(SESSION_PREFIX + "/set/bookmarks", status_code=status.HTTP_202_ACCEPTED)
+async def set_bookmarks(request: Request, bookmarks: List[Bookmark], session: MetricsSession = Depends(get_session)):
     # region todo: remove after new version of UI has been complete and integrated
-    global metadata_names
-    metadata_names = get_meta_from_bookmarks(bookmarks)
+    session.metadata_names = get_meta_from_bookmarks(bookmarks)
     # endregion
-    metrics_bookmarks = reformat_bookmarks(bookmarks)
+    session.metrics_bookmarks = reformat_bookmarks(bookmarks)
+    if session.metrics_stream:
+        await session.metrics_stream.put_bookmarks_received()
 
 
 @router.post("/set/header", status_code=status.HTTP_202_ACCEPTED)
-async def set_metrics_header(request: Request, header: MetricsHeader):
-    global metrics_header
-    metrics_header.metrics_count = header.metrics_count
+@router.post(SESSION_PREFIX + "/set/header", status_code=status.HTTP_202_ACCEPTED)
+async def set_metrics_header(request: Request, header: MetricsHeader, session: MetricsSession = Depends(get_session)):
+    session.metrics_header.metrics_count = header.metrics_count
 
 
 @router.post("/add", status_code=status.HTTP_202_ACCEPTED)
-async def add_metrics(request: Request, metrics_data: List[dict]):
-    global metrics
+@router.post(SESSION_PREFIX + "/add", status_code=status.HTTP_202_ACCEPTED)
+async def add_metrics(request: Request, metrics_data: List[dict], session: MetricsSession = Depends(get_session)):
+    if event_filter is not None:
+        metrics_data = [event_filter.filter_frame(metric_data) for metric_data in metrics_data]
+    if session.metrics_stream:
+        await session.metrics_stream.put_frames(metrics_data)
+        return
     for metric_data in metrics_data:
-        frame_data_flatten = flatten_dict(metric_data, EXCLUDED_KEYS)
-        frame = Frame()
-        frame.frame_start = frame_data_flatten[FRAME_START_KEY]
-        frame.frame_end = frame_data_flatten[FRAME_END_KEY]
-        del frame_data_flatten[FRAME_START_KEY]
-        del frame_data_flatten[FRAME_END_KEY]
-        frame.data = frame_data_flatten
-        frame.raw_data = metric_data
-        metrics.append(frame)
+        session.metrics.append(metric_data)
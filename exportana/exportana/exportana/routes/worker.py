@@ -1,6 +1,5 @@
 import asyncio
 import logging
-from asyncio import Task
 
 from fastapi import APIRouter, Request
 from httpx import Response
@@ -27,10 +26,9 @@ async def get_status(request: Request):
 @router.get("/reset")
 async def reset(request: Request):
     data = request.state.data
-    task: Task = data.task
-    if task:
+    for i, task in enumerate(data.tasks):
         task.cancel()
         await task
-        request.state.data.task = asyncio.create_task(transactions_work_loop(data.worker))
+        data.tasks[i] = asyncio.create_task(transactions_work_loop(data.workers[i]))
 
     return Response(status_code=status.HTTP_202_ACCEPTED)
@@ -1,17 +1,23 @@
 import logging
-from abc import ABC, abstractmethod, ABCMeta
+from abc import ABC, ABCMeta, abstractmethod
+from time import perf_counter
+from typing import Dict, Optional
 
 from configargparse import Namespace
 
 from ..models.base import VerboseResult
-from ..models.trace_meta import TraceMeta
+from ..models.trace_meta import TraceMeta, TraceStage
 from ..models.trace_with_context import TraceInfoWithContext
 from ..models.worker import WorkerInfo
+from ..utils import tracing
 
 log = logging.getLogger(__name__)
 
 
 class BaseTransaction(metaclass=ABCMeta):
+    # pipeline stage timed by `execute_stage`, if any
+    stage: Optional[TraceStage] = None
+
     @abstractmethod
     async def execute(self):
         pass
@@ -40,3 +46,17 @@ class BaseExportanaTransaction(BaseTransaction, ABC):
         self._trace_meta = trace_meta
         self.verbose_result = verbose_result
         self._worker = worker
+
+
+async def execute_stage(transaction: BaseTransaction, stage_durations: Dict[TraceStage, float]):
+    """
+    Executes the transaction in its own span,
+    the time it took goes to `stage_durations` if it is a pipeline stage
+    """
+    start = perf_counter()
+    try:
+        with tracing.span(type(transaction).__name__, **({"stage": transaction.stage.value} if transaction.stage else {})):
+            await transaction.execute()
+    finally:
+        if transaction.stage is not None:
+            stage_durations[transaction.stage] = perf_counter() - start
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from ..models.trace_meta import TraceStage
+from ..transactions.base_transaction import BaseTransaction, execute_stage
+
+log = logging.getLogger(__name__)
+
+
+class ConcurrentTransaction(BaseTransaction):
+    """
+    Executes the transactions concurrently. The first failure cancels the rest and is re-raised.
+    Each of the transactions is timed on its own into `stage_durations`.
+    """
+
+    def __init__(self, transactions: List[BaseTransaction], stage_durations: Optional[Dict[TraceStage, float]] = None):
+        super().__init__()
+        self._transactions = transactions
+        self._stage_durations = stage_durations if stage_durations is not None else dict()
+
+    async def execute(self):
+        tasks = [asyncio.ensure_future(execute_stage(t, self._stage_durations)) for t in self._transactions]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def commit(self):
+        for t in self._transactions:
+            await t.commit()
+
+    async def rollback(self):
+        for t in reversed(self._transactions):
+            try:
+                await t.rollback()
+            except Exception as e:
+                log.warning(f"ConcurrentTransaction. Rollback: {type(e).__name__} {e}")
@@ -1,16 +1,23 @@
 import asyncio
-import json
 import logging
 from json import JSONDecodeError
 
 from configargparse import Namespace
-from httpx import Response, NetworkError, ReadTimeout, RemoteProtocolError, RequestError
+from httpx import (
+    NetworkError,
+    ReadTimeout,
+    RemoteProtocolError,
+    RequestError,
+    Response,
+    Timeout,
+)
 from starlette import status
 
+from ..exporter.constants import ACQUIRE_SEC_HEADER
 from ..models.base import VerboseResult
-from ..models.trace_meta import TraceMeta
+from ..models.trace_meta import TraceMeta, TraceStage
 from ..models.trace_with_context import TraceInfoWithContext
-from ..models.worker import WorkerInfo, WorkerStatus
+from ..models.worker import Worker, WorkerInfo, WorkerStatus
 from ..transactions.exceptions.environment_exception import EnvironmentException
 from ..transactions.request_to_manager_transaction import RequestToManagerTransaction
 from ..utils.utils import make_url
@@ -19,6 +26,9 @@ log = logging.getLogger(__name__)
 
 
 class GetWorkTransaction(RequestToManagerTransaction):
+    # cleared for the rest of the run once the manager turns out to have no long-poll acquire
+    _acquire_wait_supported: bool = True
+
     def __init__(
         self, args: Namespace,
         trace_info: TraceInfoWithContext,
@@ -40,13 +50,24 @@ class GetWorkTransaction(RequestToManagerTransaction):
 
     async def _request_work(self):
         DELAY_SEC = 30
+        TIMEOUT_SEC = 5
+        # the manager answers the long-poll within `acquire_wait_sec`, a bit of slack for the transport on top
+        READ_TIMEOUT_SLACK_SEC = 10
+        wait_sec = self.args.acquire_wait_sec
+        timeout = Timeout(TIMEOUT_SEC, read=wait_sec + READ_TIMEOUT_SLACK_SEC)
         while not self._client.is_closed:
             try:
+                long_poll = GetWorkTransaction._acquire_wait_supported
                 response: Response = await self._client.request(
                     method="GET",
-                    url=make_url("trace", "queued", "acquire"),
-                    content=json.dumps(self._worker.get_id()))
+                    url=make_url("trace", "queued", "acquire_wait" if long_poll else "acquire"),
+                    params={"timeout_sec": wait_sec} if long_poll else None,
+                    content=Worker(url=self._worker.url, slot=self._worker.slot).json(by_alias=True),
+                    timeout=timeout if long_poll else TIMEOUT_SEC)
 
+                if response.status_code == status.HTTP_204_NO_CONTENT:
+                    log.debug(f"GetWorkTransaction. Waiting for a task...")
+                    continue
                 if response.is_success:
                     try:
                         trace_info_tmp = TraceInfoWithContext.parse_raw(response.content)
@@ -57,6 +78,10 @@ class GetWorkTransaction(RequestToManagerTransaction):
 
                         self._worker.status = WorkerStatus.working
                         self._worker.trace_name = trace_info_tmp.trace_name
+                        # the time the manager took to claim the trace, without the long-poll waiting
+                        acquire_sec = response.headers.get(ACQUIRE_SEC_HEADER)
+                        self._trace_meta.stage_durations[TraceStage.acquire] = float(acquire_sec) \
+                            if acquire_sec is not None else response.elapsed.total_seconds()
                         return
                     except JSONDecodeError as e:
                         error_msg = f"[{self._request_work.__name__}]: error on parse response content: {e}"
@@ -65,6 +90,13 @@ class GetWorkTransaction(RequestToManagerTransaction):
                         raise EnvironmentException(error_msg)
                 else:
                     if response.status_code == status.HTTP_404_NOT_FOUND:
+                        if long_poll:
+                            # a manager without the long-poll acquire: this worker polls the plain acquire
+                            # for the rest of the run
+                            log.info(f"GetWorkTransaction. The manager has no long-poll acquire, polling every {DELAY_SEC}s")
+                            GetWorkTransaction._acquire_wait_supported = False
+                            continue
+                        # the plain acquire answers 404 while nothing is queued
                         log.debug(f"GetWorkTransaction. Waiting for a task...")
                         await asyncio.sleep(DELAY_SEC)
                         continue
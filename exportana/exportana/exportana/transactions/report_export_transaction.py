@@ -2,15 +2,17 @@ import asyncio
 import logging
 
 from configargparse import Namespace
-from httpx import Response, NetworkError, ReadTimeout, RemoteProtocolError, RequestError
+from httpx import NetworkError, ReadTimeout, RemoteProtocolError, RequestError, Response
 from starlette import status
 
 from ..models.base import VerboseResult
 from ..models.trace_meta import TraceMeta
 from ..models.trace_with_context import TraceInfoWithContext
 from ..models.traces import ProcessedTraceReport
-from ..models.worker import WorkerInfo, Worker
-from ..transactions.exceptions.external_service_exception import ExternalServiceException
+from ..models.worker import Worker, WorkerInfo
+from ..transactions.exceptions.external_service_exception import (
+    ExternalServiceException,
+)
 from ..transactions.request_to_manager_transaction import RequestToManagerTransaction
 from ..utils.utils import make_url
 
@@ -37,7 +39,7 @@ class ReportExportTransaction(RequestToManagerTransaction):
         DELAY_SEC = 30
         report = ProcessedTraceReport(
             trace_name=self._trace_info.trace_name,
-            worker=Worker(url=self._worker.url),
+            worker=Worker(url=self._worker.url, slot=self._worker.slot),
             result=self.verbose_result,
             trace_meta=self._trace_meta)
 
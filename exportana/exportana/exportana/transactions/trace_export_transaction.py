@@ -1,115 +1,153 @@
+import asyncio
+import copy
+import hashlib
 import json
 import logging
 import multiprocessing
-import random
-import string
-from collections import defaultdict
+import uuid
 from datetime import datetime
 from pathlib import PurePosixPath
-from typing import Dict, List, Optional, Tuple, Any
+from time import perf_counter
+from typing import Any, AsyncIterable, Iterable, Iterator, List, Optional, Tuple, Union
 from urllib.parse import unquote, urlparse
 
-import requests
-from atlassian import Bitbucket
 from configargparse import Namespace
 from elasticsearch import exceptions
 from elasticsearch._async.client import AsyncElasticsearch
-from elasticsearch._async.client.indices import IndicesClient
-from elasticsearch._async.helpers import async_streaming_bulk
 from elasticsearch.helpers.errors import BulkIndexError
+from httpx import codes
 
-from .base_transaction import BaseExportanaTransaction
-from .exceptions.external_service_exception import ExternalServiceException
-from .exceptions.trace_exception import TraceException
+from ..configs import ExportLayout, IndexRollover
+from ..exporter.bulk import KEY_ID, BulkIndexer, BulkSettings, get_serialize_executor
 from ..exporter.constants import (
+    DEF_INDEX_FIELDS_LIMIT,
     DEFAULT_ELASTICSEARCH_INDEX_PREFIX,
-    NAME_KEY,
-    TIMESTAMP_KEY,
-    PATH_DELIMITER,
-    DOC_TYPE_KEY,
     DOC_TYPE_BUDGET,
-    SETTINGS_KEY,
-    KEY_SETTINGS,
+    DOC_TYPE_FRAME_SETTINGS,
+    DOC_TYPE_KEY,
+    DOC_TYPE_METRIC,
+    DOC_TYPE_SETTINGS,
+    DOC_TYPE_TRACE_META,
+    EXPORT_ID_KEY,
+    FRAME_SETTINGS_ID_KEY,
+    KEY_INDEX,
+    KEY_LIMIT,
     KEY_MAPPING,
+    KEY_MAPPINGS,
+    KEY_SETTINGS,
     KEY_TOTAL_FIELDS,
-    KEY_LIMIT,
-    KEY_INDEX,
-    DEF_INDEX_FIELDS_LIMIT,
-    DOC_TYPE_METRIC
+    NAME_KEY,
+    PATH_DELIMITER,
+    SETTINGS_KEY,
+    TIMESTAMP_KEY,
+    TRACE_SETTINGS_KEY,
+)
+from ..exporter.elastic_clients import elastic_clients
+from ..exporter.frame_store import FrameStore
+from ..exporter.frame_stream import BOOKMARKS_RECEIVED, FrameStream
+from ..exporter.index_cache import IndexState, index_cache
+from ..exporter.index_lifecycle import (
+    KEY_ALIASES,
+    KEY_IS_WRITE_INDEX,
+    first_backing_index,
+    get_write_index,
+    plain_index_alias,
+    rollover_conditions,
 )
+from ..exporter.integrations import integrations, make_layout_id
 from ..models.base import VerboseResult
-from ..models.trace_meta import TraceMeta, get_meta_from_bookmark
+from ..models.trace_meta import TraceMeta, TraceStage, get_meta_from_bookmark
 from ..models.trace_with_context import TraceInfoWithContext
-from ..routes import metrics_receiver
-from ..routes.metrics_receiver import Frame
+from ..routes.metrics_receiver import EXCLUDED_KEYS, MetricsSession
+from ..utils import tracing
 from ..utils.cleanup import delete_traces_from_index
 from ..utils.compatibility import removesuffix
 from ..utils.utils import timing
+from .base_transaction import BaseExportanaTransaction
+from .exceptions.external_service_exception import ExternalServiceException
+from .exceptions.trace_exception import TraceException
 
 TIME_FIELD_NAME = "Time"
+RESOURCE_ALREADY_EXISTS = "resource_already_exists_exception"
+# trace metadata kept in every frame document of the normalized layout
+FRAME_META_FIELDS = ("test_id", "test_name", "test_start", "workstation")
 
 log = logging.getLogger(__name__)
 
 MetricsProcessingReturnType = Optional[Tuple[Optional[float], Optional[dict]]]
 
 
-def get_index_total_fields_limit_settings(index_name: str, settings: dict, limit: int = DEF_INDEX_FIELDS_LIMIT) -> dict:
-    try:
-        current_limit = int(settings[index_name][KEY_SETTINGS][KEY_INDEX][KEY_MAPPING][KEY_TOTAL_FIELDS][KEY_LIMIT])
-    except KeyError as e:
-        log.warning(e)
-        current_limit = DEF_INDEX_FIELDS_LIMIT
-
-    if current_limit >= limit:
-        limit = current_limit
-    settings = {
-        KEY_SETTINGS: {
-            KEY_INDEX: {
-                KEY_MAPPING: {
-                    KEY_TOTAL_FIELDS: {
-                        KEY_LIMIT: limit,
-                    }
-                }
-            }
-        }
-    }
-    return settings
-
-
-def metrics_processing(frame: Frame, norm_time: Tuple[Optional[float], Optional[float]]) -> MetricsProcessingReturnType:
-    if not frame.frame_start or not frame.frame_end:
-        return None
-    if frame.frame_end <= frame.frame_start:
+def is_frame_exported(metrics: FrameStore, index: int, norm_time: Tuple[Optional[float], Optional[float]]) -> bool:
+    """Whether the frame has valid bounds and starts within the normalization range."""
+    frame_start = metrics.frame_start[index]
+    frame_end = metrics.frame_end[index]
+    # NaN marks a missing frame bound, it fails any comparison
+    if not frame_start or not frame_end or not frame_end > frame_start:
+        return False
+    if norm_time[0] is not None and frame_start < norm_time[0]:
+        return False
+    if norm_time[1] is not None and frame_start > norm_time[1]:
+        return False
+    return True
+
+
+def metrics_processing(
+    metrics: FrameStore,
+    index: int,
+    norm_time: Tuple[Optional[float], Optional[float]],
+    layout: ExportLayout = ExportLayout.Flat
+) -> MetricsProcessingReturnType:
+    if not is_frame_exported(metrics, index, norm_time):
         return None
-    real_start_time = frame.frame_start
+    real_start_time = metrics.frame_start[index]
     start_time = real_start_time
-
     if norm_time[0] is not None:
-        if start_time < norm_time[0]:
-            return None
         start_time -= norm_time[0]
-    if norm_time[1] is not None and real_start_time > norm_time[1]:
-        return None
     start_time_sec = start_time / 1000
     hours, remainder = divmod(int(start_time_sec), 3600)
     minutes, seconds = divmod(remainder, 60)
 
-    frame.data[TIME_FIELD_NAME] = "{:02d}:{:02d}:{:02d}.{:03d}".format(
+    if layout == ExportLayout.Normalized:
+        # the frame settings go to a frame settings document, the frame refers to it
+        metrics_data = metrics.frame_metrics(index)
+        settings_id = metrics.frame_settings_id(index)
+        if settings_id is not None:
+            metrics_data[FRAME_SETTINGS_ID_KEY] = settings_id
+    else:
+        metrics_data = metrics.frame_data(index)
+    metrics_data[TIME_FIELD_NAME] = "{:02d}:{:02d}:{:02d}.{:03d}".format(
         hours,
         minutes,
         seconds,
         int(start_time % 1 * 1000)
     )
-
-    metrics_data = frame.data
     metrics_data[DOC_TYPE_KEY] = DOC_TYPE_METRIC
-    metrics_data[SETTINGS_KEY] = frame.raw_data
+    if layout != ExportLayout.Normalized:
+        metrics_data[SETTINGS_KEY] = metrics.frame_raw_data(index)
 
     return real_start_time, metrics_data
 
 
+def frame_settings_docs(metrics: FrameStore, settings_ids: Iterable[str]) -> Iterator[Tuple[Any, dict]]:
+    """
+    Frame settings documents of the normalized layout, one per distinct settings blob of `settings_ids`:
+    the flattened settings plus the raw blob, as a frame of the flat layout carries them.
+    """
+    settings_by_id = metrics.settings_by_id()
+    for settings_id in settings_ids:
+        settings, settings_raw = settings_by_id[settings_id]
+        doc = dict(settings)
+        doc[TRACE_SETTINGS_KEY] = copy.deepcopy(settings_raw)
+        doc[DOC_TYPE_KEY] = DOC_TYPE_FRAME_SETTINGS
+        doc[FRAME_SETTINGS_ID_KEY] = settings_id
+        yield (DOC_TYPE_FRAME_SETTINGS, settings_id), doc
+
+
 class TraceExportTransaction(BaseExportanaTransaction):
+    stage = TraceStage.export
+
     __KEY_TYPE = "type"
+    __KEY_PROPERTIES = "properties"
     __KEYWORD_VALUE = "keyword"
     __KEY_NULL_VALUE = "null_value"
     __NULL_VALUE = "null"
@@ -162,6 +200,12 @@ class TraceExportTransaction(BaseExportanaTransaction):
                 __KEY_TYPE: __KEYWORD_VALUE,
                 __KEY_NULL_VALUE: __NULL_VALUE
             },
+            EXPORT_ID_KEY: {
+                __KEY_TYPE: __KEYWORD_VALUE
+            },
+            FRAME_SETTINGS_ID_KEY: {
+                __KEY_TYPE: __KEYWORD_VALUE
+            },
             DOC_TYPE_KEY: {
                 __KEY_TYPE: __KEYWORD_VALUE,
                 __KEY_NULL_VALUE: DOC_TYPE_METRIC
@@ -169,6 +213,10 @@ class TraceExportTransaction(BaseExportanaTransaction):
             TIME_FIELD_NAME: {
                 __KEY_TYPE: "date",
                 "format": "HH:mm:ss.SSS"
+            },
+            TRACE_SETTINGS_KEY: {
+                __KEY_TYPE: "object",
+                "enabled": False
             }
         }
     }
@@ -176,53 +224,165 @@ class TraceExportTransaction(BaseExportanaTransaction):
     def __init__(self, args: Namespace,
                  trace_info: TraceInfoWithContext,
                  trace_meta: TraceMeta,
-                 verbose_result: VerboseResult):
+                 verbose_result: VerboseResult,
+                 metrics_session: MetricsSession,
+                 frames_stream: Optional[FrameStream] = None):
         super().__init__(args, trace_info, trace_meta, verbose_result)
         self._es: AsyncElasticsearch = None
+        self._metrics_session = metrics_session
+        self._frames_stream = frames_stream
+        # marks the documents of this export, the ones of the previous exports are removed after the push
+        self._export_id = uuid.uuid4().hex
         self.thread_pool_size = args.thread_pool_size if args.thread_pool_size > 0 else multiprocessing.cpu_count()
 
     def append_budgets(self, prepared: dict):
         SETTINGS_IDX = 0
-        if metrics_receiver.metrics_budgets:
-            prepared[SETTINGS_IDX] = metrics_receiver.metrics_budgets
+        if self._metrics_session.metrics_budgets:
+            prepared[SETTINGS_IDX] = self._metrics_session.metrics_budgets
             prepared[SETTINGS_IDX][DOC_TYPE_KEY] = DOC_TYPE_BUDGET
-            prepared[SETTINGS_IDX][SETTINGS_KEY] = metrics_receiver.metrics_settings
+            if self._args.export_layout != ExportLayout.Normalized:
+                prepared[SETTINGS_IDX][SETTINGS_KEY] = self._metrics_session.metrics_settings
         return prepared
 
     async def execute(self):
-        if not metrics_receiver.is_metrics_available():
+        if self._frames_stream is not None:
+            try:
+                await self._execute_streaming()
+            except BaseException:
+                self._frames_stream.abort()
+                raise
+            return
+
+        self._check_metrics_available()
+
+        self._es = elastic_clients.get(self._trace_info.worker_configuration.elastic)
+        await self._update_trace_meta()
+
+        metrics = self._metrics_session.metrics
+        normal_time = self._get_normal_time(self._args.normalize, self._metrics_session.metrics_bookmarks)
+        if not any(is_frame_exported(metrics, i, normal_time) for i in range(len(metrics))):
+            self._raise_no_data()
+
+        index_name, created = await self._prepare_index()
+        # region --------------------- push to elastic ---------------------
+        # the documents are built from the store while being pushed, only the bulk chunks in flight are held at once
+        with tracing.span("es.bulk_push", index=index_name):
+            docs = self._process_threads(metrics, normal_time, self._args.export_layout)
+            await self._push_to_elastic(index_name, docs, self._trace_meta)
+        # endregion
+        if not created:
+            await self._delete_stale_docs(index_name)
+        await self._publish_reports(index_name)
+
+    async def _execute_streaming(self):
+        """
+        Pushes frames to elastic while they are being received.
+        Frames are buffered only until the bookmarks arrive: the index name and the time normalisation depend on them.
+        """
+        self._es = elastic_clients.get(self._trace_info.worker_configuration.elastic)
+        items = self._frames_stream.items()
+        buffered: List[List[dict]] = list()
+        async for item in items:
+            if item is BOOKMARKS_RECEIVED:
+                break
+            buffered.append(item)
+        else:
+            log.warning("Streaming export: no bookmarks have been received before the end of the trace")
+
+        await self._update_trace_meta()
+        normal_time = self._get_normal_time(self._args.normalize, self._metrics_session.metrics_bookmarks)
+        index_name, created = await self._prepare_index()
+        pushed_frames = 0
+
+        async def get_docs():
+            frames_start = set()
+            # frame settings documents pushed already, the same blob comes in many batches
+            settings_ids_pushed = set()
+
+            def process(frames: List[dict]):
+                nonlocal pushed_frames
+                store = FrameStore(EXCLUDED_KEYS)
+                for frame in frames:
+                    store.append(frame)
+                settings_ids = set()
+                for i in range(len(store)):
+                    record = metrics_processing(store, i, normal_time, self._args.export_layout)
+                    # the first frame wins on duplicated start time
+                    if record and record[0] not in frames_start:
+                        frames_start.add(record[0])
+                        pushed_frames += 1
+                        settings_id = record[1].get(FRAME_SETTINGS_ID_KEY)
+                        if settings_id is not None and settings_id not in settings_ids_pushed:
+                            settings_ids.add(settings_id)
+                        yield record
+                settings_ids_pushed.update(settings_ids)
+                yield from frame_settings_docs(store, settings_ids)
+
+            for frames in buffered:
+                for doc in process(frames):
+                    yield doc
+            buffered.clear()
+            async for stream_item in items:
+                if stream_item is BOOKMARKS_RECEIVED:
+                    continue
+                for doc in process(stream_item):
+                    yield doc
+
+            budgets = self.append_budgets(dict())
+            for item in budgets.items():
+                yield item
+
+        # region --------------------- push to elastic ---------------------
+        with tracing.span("es.bulk_push", index=index_name, streaming=True) as push_span:
+            await self._push_to_elastic(index_name, get_docs(), self._trace_meta)
+            if push_span:
+                push_span.set_attribute("frames", pushed_frames)
+        # endregion
+        if self._frames_stream.aborted:
+            error_msg = f"Trace '{self._trace_info.trace_name}': receiving of the metrics has been aborted."
+            self.verbose_result.result = False
+            self.verbose_result.errors.append(error_msg)
+            raise TraceException(error_msg)
+        self._check_metrics_available()
+        if pushed_frames == 0:
+            self._raise_no_data()
+        if not created:
+            await self._delete_stale_docs(index_name)
+
+        await self._publish_reports(index_name)
+
+    def _check_metrics_available(self):
+        if not self._metrics_session.is_metrics_available():
             error_msg = f"No data has been received from Unreal Insights. " \
-                        f"MetricsNamesCount: {len(metrics_receiver.metrics_names)} " \
-                        f"MetricsHeader: {metrics_receiver.metrics_header} " \
-                        f"MetricsCount: {len(metrics_receiver.metrics)}"
+                        f"MetricsNamesCount: {len(self._metrics_session.metrics_names)} " \
+                        f"MetricsHeader: {self._metrics_session.metrics_header} " \
+                        f"MetricsCount: {self._metrics_session.get_frames_count()}"
             self.verbose_result.result = False
             self.verbose_result.errors.append(error_msg)
             raise TraceException(error_msg)
 
-        header = [TIME_FIELD_NAME]
-        metrics_names = metrics_receiver.metrics_names
-        header.extend(metrics_names)
+    def _raise_no_data(self):
+        error_msg = f"Trace '{self._trace_info.trace_name}' can't be processed: there are no data in profiling."
+        self.verbose_result.result = False
+        self.verbose_result.errors.append(error_msg)
+        raise TraceException(error_msg)
 
-        self._es = AsyncElasticsearch(hosts=self._trace_info.worker_configuration.elastic, retry_on_timeout=True)
-        self._trace_meta.update(
-            metrics_receiver.metrics_bookmarks,
+    async def _update_trace_meta(self):
+        await self._trace_meta.update(
+            self._metrics_session.metrics_bookmarks,
             self._trace_info.trace_name,
-            metrics_receiver.metadata_names,
+            self._metrics_session.metadata_names,
             self._args
         )
 
-        normal_time = self._get_normal_time(self._args.normalize, metrics_receiver.metrics_bookmarks)
-        # region --------------------- process thread ---------------------
-        prepared = self._process_threads(metrics_receiver.metrics, normal_time)
-        # endregion
-
-        if len(prepared) == 0:
-            error_msg = f"Trace '{self._trace_info.trace_name}' can't be processed: there are no data in profiling."
-            self.verbose_result.result = False
-            self.verbose_result.errors.append(error_msg)
-            raise TraceException(error_msg)
-
-        self.append_budgets(prepared)
+    async def _prepare_index(self) -> Tuple[str, bool]:
+        """
+        Makes and builds the index for the trace.
+        :return: the index or alias name to write to and whether the index has been created,
+            so there is no previous export in it
+        """
+        header = [TIME_FIELD_NAME]
+        header.extend(self._metrics_session.metrics_names)
 
         # region --------------------- make index ---------------------
         index_name = f"{self._args.elasticsearch_index_prefix}-" if self._args.elasticsearch_index_prefix else f"{DEFAULT_ELASTICSEARCH_INDEX_PREFIX}- "
@@ -232,55 +392,85 @@ class TraceExportTransaction(BaseExportanaTransaction):
         index_name = index_name[:255]
         # endregion
         # region --------------------- build index ---------------------
-        await self._build_index(index_name, header)
+        with tracing.span("es.build_index", index=index_name, fields=len(header)):
+            index_name, created = await self._build_index(index_name, header)
         # endregion
+        return index_name, created
+
+    def _make_doc_id(self, key: Any) -> str:
+        """
+        Id of a document of the trace: the same trace exported again overwrites its documents in place.
+        `key` tells the documents of the trace apart: the frame start time, or the kind of a per trace document.
+        """
+        identity = "|".join((
+            str(self._trace_meta.test_id),
+            str(self._trace_meta.workstation),
+            str(self._trace_meta.test_start),
+            str(key)
+        ))
+        return hashlib.blake2b(identity.encode("utf-8"), digest_size=16).hexdigest()
+
+    async def _delete_stale_docs(self, index_name: str):
+        """Removes what is left of the previous exports of the trace: documents not overwritten by this one"""
         # region --------------------- delete duplicate in the index ---------------------
-        del_dupl_res: VerboseResult = await delete_traces_from_index(self._es,
-                                                                     index_name,
-                                                                     self._trace_meta.test_id,
-                                                                     self._trace_meta.workstation,
-                                                                     self._trace_meta.test_start)
+        with tracing.span("es.delete_duplicates", index=index_name):
+            del_dupl_res: VerboseResult = await delete_traces_from_index(self._es,
+                                                                         index_name,
+                                                                         self._trace_meta.test_id,
+                                                                         self._trace_meta.workstation,
+                                                                         self._trace_meta.test_start,
+                                                                         keep_export_id=self._export_id)
         # -------------------------------------------------------------------------
         if not del_dupl_res:
             log.error(" ".join(del_dupl_res.errors))
         # endregion
-        # region --------------------- push to elastic ---------------------
-        await self._push_to_elastic(index_name, prepared, self._trace_meta)
-        # endregion
-        # region --------------------- try to create perfana layout ---------------------
-        layout_id = self._create_perfana_layout(index_name, self._trace_meta, metrics_names)
-        # endregion
-        # region --------------------- try to push to the bitbucket ---------------------
+
+    async def _publish_reports(self, index_name: str):
+        # timed here on the worker's clock, the report stage is a step of the export stage
+        start = perf_counter()
+        # the layout id is made up front, so the bitbucket report does not wait for perfana
+        layout_id = make_layout_id()
         self._trace_meta.perfana_ulr = f"{removesuffix(self._trace_info.worker_configuration.perfana, PATH_DELIMITER)}/api/layout?uid={layout_id}"
-        self._update_bitbucket_report(layout_id, self._trace_meta.title, self._trace_meta)
-        # endregion
+        # both report their failures to the verbose result and never fail the export
+        await asyncio.gather(
+            self._create_perfana_layout(index_name, layout_id, self._trace_meta, self._metrics_session.metrics_names),
+            self._update_bitbucket_report(layout_id, self._trace_meta.title, self._trace_meta)
+        )
 
+        self._trace_meta.stage_durations[TraceStage.report] = perf_counter() - start
         self._trace_meta.processed_timestamp = datetime.now().timestamp()
         self.verbose_result.result = True
 
     async def rollback(self):
-        if self._es:
-            await self._es.close()
+        # the elasticsearch client is shared by the process
+        return
 
     async def commit(self):
-        if self._es:
-            await self._es.close()
+        return
 
     def _process_threads(
-        self, metrics: List[Frame],
-        normal_time: Tuple[Optional[float], Optional[float]]
-    ) -> Dict[str, Any]:
+        self, metrics: FrameStore,
+        normal_time: Tuple[Optional[float], Optional[float]],
+        layout: ExportLayout = ExportLayout.Flat
+    ) -> Iterator[Tuple[Any, dict]]:
+        """Lazily yields the frame documents, then the frame settings documents and the budgets."""
         log.info("Process threads")
 
-        prepared = defaultdict(dict)
-
-        for metric in metrics:
-            record = metrics_processing(metric, normal_time)
-            if record:
-                real_start_time, frame_data = record
-                prepared[real_start_time] = frame_data
-
-        return prepared
+        frames_start = set()
+        settings_ids = set()
+        for i in range(len(metrics)):
+            record = metrics_processing(metrics, i, normal_time, layout)
+            # the first frame wins on duplicated start time, as in the streaming export which can't wait for the last
+            if record and record[0] not in frames_start:
+                frames_start.add(record[0])
+                settings_id = record[1].get(FRAME_SETTINGS_ID_KEY)
+                if settings_id is not None:
+                    settings_ids.add(settings_id)
+                yield record
+
+        if layout == ExportLayout.Normalized:
+            yield from frame_settings_docs(metrics, settings_ids)
+        yield from self.append_budgets(dict()).items()
 
     @staticmethod
     def _get_normal_time(bookmark_name: List[str], bookmarks: List[dict]) -> Tuple[Optional[float], Optional[float]]:
@@ -314,63 +504,192 @@ class TraceExportTransaction(BaseExportanaTransaction):
         """Remove confusing symbols from the event name."""
         return name.translate(str.maketrans("", "", "!@#$."))
 
-    async def _update_index_field_limit_if_needed(self, index_name: str, limit: int):
-        index_settings = await self._es.indices.get_settings(index=index_name)
-        settings = get_index_total_fields_limit_settings(index_name, index_settings, limit)
-        await self._es.indices.put_settings(
-            index=index_name,
-            body=settings
-        )
+    def _make_mapping(self, header: List[str]) -> dict:
+        """The base mapping plus the metrics and metadata fields of the trace"""
+        mapping = copy.deepcopy(self.__MAPPING)
+        properties = mapping[self.__KEY_PROPERTIES]
+        for h in header:
+            properties.setdefault(h, {self.__KEY_TYPE: "float"})
+        for metadata_name in self._metrics_session.metadata_names:
+            properties.setdefault(metadata_name, {
+                self.__KEY_TYPE: self.__KEYWORD_VALUE,
+                self.__KEY_NULL_VALUE: self.__NULL_VALUE
+            })
+        return mapping
+
+    def _get_fields_limit(self) -> int:
+        return max(self._args.elastic_mapping_limit, DEF_INDEX_FIELDS_LIMIT)
+
+    def _make_index_settings(self) -> dict:
+        settings = copy.deepcopy(self.__INDEX_SETTINGS)
+        index_settings = settings[KEY_SETTINGS][KEY_INDEX]
+        index_settings["number_of_shards"] = self._args.index_shards
+        index_settings[KEY_MAPPING][KEY_TOTAL_FIELDS][KEY_LIMIT] = self._get_fields_limit()
+        return settings
+
+    @property
+    def _rollover_enabled(self) -> bool:
+        return self._args.index_rollover != IndexRollover.Disabled
+
+    async def _get_index_state(self, index_name: str) -> Optional[IndexState]:
+        """
+        Mapping and settings of the index in one request, None if there is no such index.
+        With the rollover `index_name` is the write alias, the state is the one of its write index.
+        """
+        response = await self._es.indices.get(index=index_name, ignore=[404])
+        if not response or response.get("status") == 404:
+            return None
+        write_index = get_write_index(response, index_name) if self._rollover_enabled else None
+        # the index name may be an alias
+        index_info = response[write_index] if write_index else next(iter(response.values()))
+        try:
+            fields_limit = int(index_info[KEY_SETTINGS][KEY_INDEX][KEY_MAPPING][KEY_TOTAL_FIELDS][KEY_LIMIT])
+        except KeyError:
+            fields_limit = DEF_INDEX_FIELDS_LIMIT
+        fields = set(index_info.get(KEY_MAPPINGS, {}).get(self.__KEY_PROPERTIES, {}).keys())
+        return IndexState(fields=fields, fields_limit=fields_limit, write_index=write_index)
+
+    async def _get_write_index(self, alias: str) -> Optional[str]:
+        response = await self._es.indices.get_alias(name=alias, ignore=[404])
+        if not response or response.get("status") == 404:
+            return None
+        return get_write_index(response, alias)
 
-    async def _create_index(self, index_name: str, mapping: dict):
-        await self._es.indices.create(index=index_name, body=self.__INDEX_SETTINGS)
-        if self._args.elastic_mapping_limit > 0:
-            await self._update_index_field_limit_if_needed(index_name, self._args.elastic_mapping_limit)
-        await self._es.indices.put_mapping(body=mapping, index=index_name)
+    async def _create_index(self, index_name: str, mapping: dict) -> Optional[IndexState]:
+        """
+        Creates the index with its settings and mapping at once, None if it has been created by someone else.
+        With the rollover it is the first index behind the `index_name` write alias.
+        """
+        body = self._make_index_settings()
+        body[KEY_MAPPINGS] = mapping
+        write_index = None
+        if self._rollover_enabled:
+            write_index = first_backing_index(index_name)
+            body[KEY_ALIASES] = {index_name: {KEY_IS_WRITE_INDEX: True}}
+        response = await self._es.indices.create(index=write_index or index_name, body=body, ignore=[400])
+        if response.get("error", {}).get("type") == RESOURCE_ALREADY_EXISTS:
+            return None
+        if response.get("status") == 400:
+            raise exceptions.RequestError(400, str(response.get("error")), response)
+        return IndexState(
+            fields=set(mapping[self.__KEY_PROPERTIES].keys()),
+            fields_limit=self._get_fields_limit(),
+            write_index=write_index
+        )
 
-    async def _build_index(self, index_name: str, header: List[str]):
+    async def _rollover_if_needed(self, alias: str, mapping: dict) -> Optional[IndexState]:
         """
-        Builds index and mapping.
-        :return:
-            - `bool`: determines is build succeeded;
-            - `Optional[str]`: an error/warning string.
+        Rolls the alias over to a new index once the current one is old or big enough.
+        The new index gets the settings and mapping right away, there is no index template to maintain.
+        :return: the state of the new index if rolled over
         """
-        KEY_PROPERTY = "properties"
+        conditions = rollover_conditions(self._args.index_rollover, self._args.index_rollover_max_size)
+        if not conditions:
+            return None
+        body = self._make_index_settings()
+        body[KEY_MAPPINGS] = mapping
+        body["conditions"] = conditions
+        response = await self._es.indices.rollover(alias=alias, body=body)
+        if not response.get("rolled_over"):
+            return None
+        log.info(f"Index lifecycle: {alias} rolled over to {response.get('new_index')}")
+        return IndexState(
+            fields=set(mapping[self.__KEY_PROPERTIES].keys()),
+            fields_limit=self._get_fields_limit(),
+            write_index=response.get("new_index")
+        )
 
+    async def _update_index(self, index_name: str, state: IndexState, mapping: dict):
+        """Raises the total fields limit if needed and maps the fields the index doesn't have yet"""
+        if self._args.elastic_mapping_limit > 0 and state.fields_limit < self._args.elastic_mapping_limit:
+            await self._es.indices.put_settings(
+                index=index_name,
+                body={KEY_SETTINGS: {KEY_INDEX: {KEY_MAPPING: {KEY_TOTAL_FIELDS: {
+                    KEY_LIMIT: self._args.elastic_mapping_limit
+                }}}}}
+            )
+            state.fields_limit = self._args.elastic_mapping_limit
+
+        properties = mapping[self.__KEY_PROPERTIES]
+        new_fields = properties.keys() - state.fields
+        if new_fields:
+            log.info(f"Mapping {len(new_fields)} new field(s) of the index {index_name}")
+            await self._es.indices.put_mapping(
+                body={self.__KEY_PROPERTIES: {f: properties[f] for f in new_fields}},
+                index=index_name
+            )
+            state.fields |= new_fields
+
+    async def _build_index(self, index_name: str, header: List[str]) -> Tuple[str, bool]:
+        """
+        Builds index and mapping. What is known about the index is cached, so a trace going to a known index
+        makes no requests unless it brings new fields, but one to check the write index with the rollover.
+        With the rollover a plain index of the name, made before the rollover was enabled, is kept as is
+        when the index is not replaced, and the traces go to the `plain_index_alias` of the name instead.
+        :return: the index or alias name to write to,
+            and True if the index has been created, there is nothing of the trace in it for sure
+        """
         log.info(f"Building elasticsearch index {index_name}")
-        index = IndicesClient(self._es)
+        hosts = str(self._trace_info.worker_configuration.elastic)
+        target = index_name
         try:
-            mapping = self.__MAPPING
-            for h in header:
-                mapping[KEY_PROPERTY][h] = mapping[KEY_PROPERTY].get(h, {self.__KEY_TYPE: "float"})
-            for metadata_name in metrics_receiver.metadata_names:
-                mapping[KEY_PROPERTY][metadata_name] = mapping[KEY_PROPERTY].get(metadata_name, {
-                    self.__KEY_TYPE: self.__KEYWORD_VALUE,
-                    self.__KEY_NULL_VALUE: self.__NULL_VALUE
-                })
+            mapping = self._make_mapping(header)
             if self._args.dump_mapping:
                 log.info(mapping)
 
-            if await index.exists(index=index_name):
-                if self._args.same_index:
-                    log.info("Index already exists, updating: {}".format(index_name))
-                    if self._args.elastic_mapping_limit > 0:
-                        await self._update_index_field_limit_if_needed(index_name, self._args.elastic_mapping_limit)
-                else:
+            # a plain index not kept with --same-index is replaced by every trace, it is looked up every time
+            state = index_cache.get(hosts, index_name) if self._args.same_index else None
+            if state is not None and state.write_index is not None:
+                # rolled over by another worker, the new index has the mapping of that worker's trace only
+                if await self._get_write_index(state.alias or index_name) != state.write_index:
+                    state = None
+            if state is not None:
+                target = state.alias or index_name
+            else:
+                state = await self._get_index_state(index_name)
+                if state is not None and state.write_index is None and not self._args.same_index:
                     log.info("Index already exists, replacing: {}".format(index_name))
                     await self._es.indices.delete(index=index_name, ignore=[400, 404])
-                    await self._create_index(index_name, mapping)
-            else:
-                await self._create_index(index_name, mapping)
+                    state = None
+                elif state is not None and state.write_index is None and self._rollover_enabled:
+                    target = plain_index_alias(index_name)
+                    log.warning(
+                        f"Index lifecycle: {index_name} is a plain index made before the rollover was enabled, "
+                        f"it is not rolled over nor expired, the traces go to the {target} alias instead. "
+                        f"Reindex {index_name} into {target} and delete it to migrate"
+                    )
+                    state = await self._get_index_state(target)
+                if state is not None and state.write_index is not None:
+                    # checked once per cache entry, a rollover lags behind its conditions by the cache ttl at most
+                    state = await self._rollover_if_needed(target, mapping) or state
+
+            created = False
+            if state is None:
+                state = await self._create_index(target, mapping)
+                created = state is not None
+                if not created:
+                    # created by another worker in the meantime
+                    state = await self._get_index_state(target)
+            if not created:
+                log.info("Index already exists, updating: {}".format(target))
+                await self._update_index(target, state, mapping)
+            state.alias = target if target != index_name else None
+            index_cache.set(hosts, index_name, state)
+            return target, created
         except (exceptions.ConnectionError, exceptions.ConnectionTimeout, exceptions.RequestError) as e:
+            index_cache.invalidate(hosts, index_name)
             error_msg = f"Builds index: Can't connect to any of elasticsearch hosts: {self._es.transport.hosts}. {e}"
             self.verbose_result.result = False
             self.verbose_result.errors.append(error_msg)
             raise ExternalServiceException(error_msg)
 
     @timing("Pushing to Elastic")
-    async def _push_to_elastic(self, index_name: str, prepared: Dict, trace_meta: TraceMeta):
-        """Pushes data into Elastic.
+    async def _push_to_elastic(
+        self, index_name: str,
+        docs: Union[Iterable[Tuple[Any, dict]], AsyncIterable[Tuple[Any, dict]]],
+        trace_meta: TraceMeta
+    ):
+        """Pushes data into Elastic. `docs` are (key, document) pairs, the key makes the document id.
         :return:
             - `bool`: determines is push succeeded;
             - `Optional[str]`: an error/warning string.
@@ -378,27 +697,61 @@ class TraceExportTransaction(BaseExportanaTransaction):
         log.info(f"Push to Elastic: {index_name}")
 
         trace_meta_dict = trace_meta.to_elasticsearch()
-
-        def get_data():
-            for data in prepared.values():
-                data.update(trace_meta_dict)
+        normalized = self._args.export_layout == ExportLayout.Normalized
+        if normalized:
+            # the rest of the trace metadata is in the trace metadata document
+            frame_meta_dict = {k: trace_meta_dict[k] for k in FRAME_META_FIELDS}
+        else:
+            frame_meta_dict = dict(trace_meta_dict)
+        frame_meta_dict[EXPORT_ID_KEY] = self._export_id
+
+        async def get_data():
+            if isinstance(docs, AsyncIterable):
+                async for key, data in docs:
+                    data.update(frame_meta_dict)
+                    data[KEY_ID] = self._make_doc_id(key)
+                    yield data
+            else:
+                for key, data in docs:
+                    data.update(frame_meta_dict)
+                    data[KEY_ID] = self._make_doc_id(key)
+                    yield data
+            if normalized:
+                yield {
+                    **trace_meta_dict,
+                    EXPORT_ID_KEY: self._export_id,
+                    DOC_TYPE_KEY: DOC_TYPE_TRACE_META,
+                    KEY_ID: self._make_doc_id(DOC_TYPE_TRACE_META)
+                }
                 yield {
-                    "_index": index_name,
-                    "_source": json.dumps(data)
+                    **frame_meta_dict,
+                    DOC_TYPE_KEY: DOC_TYPE_SETTINGS,
+                    TRACE_SETTINGS_KEY: self._metrics_session.metrics_settings,
+                    KEY_ID: self._make_doc_id(DOC_TYPE_SETTINGS)
                 }
 
+        bulk_settings = BulkSettings(
+            chunk_size=self._args.bulk_chunk_size,
+            max_chunk_bytes=self._args.bulk_max_chunk_bytes,
+            concurrency=self._args.bulk_concurrency,
+            max_retries=self._args.bulk_max_retries,
+        )
         try:
-            async for ok, response in async_streaming_bulk(self._es, actions=get_data()):
-                if not ok:
-                    error_msg = f"Push to Elastic: Can't insert: {index_name}"
-                    self.verbose_result.result = False
-                    self.verbose_result.errors.append(error_msg)
-                    raise ExternalServiceException(error_msg)
+            indexer = BulkIndexer(self._es, get_serialize_executor(self.thread_pool_size), bulk_settings)
+            try:
+                await indexer.index(index_name, get_data())
+            finally:
+                log.debug(f"Pushing to Elastic. {indexer.stats}")
         except (exceptions.ConnectionError, exceptions.ConnectionTimeout, exceptions.RequestError) as e:
             error_msg = f"Push to Elastic: Can't connect to any of elasticsearch hosts: {self._es.transport.hosts}. {e}"
             self.verbose_result.result = False
             self.verbose_result.errors.append(error_msg)
             raise ExternalServiceException(error_msg)
+        except exceptions.TransportError as e:
+            error_msg = f"Push to Elastic: {type(e).__name__}: {e}"
+            self.verbose_result.result = False
+            self.verbose_result.errors.append(error_msg)
+            raise ExternalServiceException(error_msg)
         except BulkIndexError as e:
             error_msg = f"Push to Elastic: {self._extract_exception_reason(e)}"
             self.verbose_result.result = False
@@ -426,21 +779,16 @@ class TraceExportTransaction(BaseExportanaTransaction):
         return BULK_ERROR_MESSAGE
 
 
-    def _create_perfana_layout(self, index_name: str, trace_meta: TraceMeta, metrics: List[str]):
-        """
-        Create perfana layout for current `trace_name` with this `trace_meta` and presselected `metrics`
-        :return:
-            - `bool`: determines is layout creation succeeded;
-            - `Optional[str]`: if `bool` option are `True` - this is an `layout_id`,
-            otherwise - it's a string with error/warning which occurred during `layout_id` generation.
-        """
+    async def _create_perfana_layout(self, index_name: str, layout_id: str, trace_meta: TraceMeta, metrics: List[str]):
+        """Create perfana layout `layout_id` for current `trace_name` with this `trace_meta` and presselected `metrics`"""
         try:
-            layout_id = "".join(random.choices(string.ascii_letters + string.digits, k=9))
-            with open(f'perfana.{trace_meta.type if trace_meta.type else "client"}.layout', "r") as f:
+            with tracing.span("perfana.layout"):
+                layout_suffix = ".normalized" if self._args.export_layout == ExportLayout.Normalized else ""
+                template = integrations.get_layout_template(
+                    f'perfana.{trace_meta.type if trace_meta.type else "client"}{layout_suffix}.layout'
+                )
                 selected_metrics_aggs = {m: ["avg"] for m in metrics}
-
-                template = f.read().replace('\n', '')
-                layout = string.Template(template).substitute(
+                layout = template.substitute(
                     trace_name=index_name,
                     layout_id=layout_id,
                     selected_metrics=json.dumps(metrics),
@@ -456,26 +804,20 @@ class TraceExportTransaction(BaseExportanaTransaction):
                     parameter=trace_meta.parameter,
                     type=str(trace_meta.type))
 
-            log.debug(f"Pushing layout to Perfana: {layout}")
-            headers = {"Content-type": "application/json", "Accept": "text/plain"}
-            req = requests.post(f"{self._trace_info.worker_configuration.perfana}/api/layout", data=layout,
-                                headers=headers)
-            if req.status_code == requests.codes.ok:
-                return layout_id
-            log.warning(f"Can't push layout to Perfana: {req.text}")
-            self.verbose_result.errors.append(req.text)
-        except BaseException as e:
+                log.debug(f"Pushing layout to Perfana: {layout}")
+                response = await integrations.post_perfana_layout(self._trace_info.worker_configuration.perfana, layout)
+            if response.status_code == codes.OK:
+                return
+            log.warning(f"Can't push layout to Perfana: {response.text}")
+            self.verbose_result.errors.append(response.text)
+        except Exception as e:
             error_msg = f"Can't push layout to Perfana. {type(e).__name__}: {e}"
             log.warning(error_msg)
             self.verbose_result.errors.append(error_msg)
 
     @timing("Pushing report to bitbucket")
-    def _update_bitbucket_report(self, layout_id: str, title: str, trace_meta: TraceMeta):
-        """Post to Bitbucket Code Insights with reference to Perfana report
-        :return:
-            - `bool`: determines is report succeeded;
-            - `Optional[str]`: an error/warning string.
-        """
+    async def _update_bitbucket_report(self, layout_id: str, title: str, trace_meta: TraceMeta):
+        """Post to Bitbucket Code Insights with reference to Perfana report"""
         # *** prepare bitbucket requisites
         bitbucket_url_parsed = None
         try:
@@ -488,7 +830,6 @@ class TraceExportTransaction(BaseExportanaTransaction):
 
         if bitbucket_url_parsed:
             bitbucket_url = f"{bitbucket_url_parsed.scheme}://{bitbucket_url_parsed.hostname}"
-            bitbucket_user = bitbucket_url_parsed.username
             bitbucket_token = bitbucket_url_parsed.password
 
             # ('/', 'scm', 'VSP', 'game.git')
@@ -504,22 +845,18 @@ class TraceExportTransaction(BaseExportanaTransaction):
 
             try:
                 log.info(f"Pushing Perfana report link '{trace_meta.perfana_ulr}' to BitBucket")
-                bitbucket = Bitbucket(
-                    url=bitbucket_url,
-                    oauth2={
-                        "client_id": bitbucket_user,
-                        "token": {"access_token": bitbucket_token},
-                    })
-
-                bitbucket.create_code_insights_report(
-                    project_key=bitbucket_project,
-                    repository_slug=bitbucket_repo,
-                    commit_id=trace_meta.commit,
-                    report_key=layout_id,
-                    report_title=f'{title}-{layout_id}',
-                    link=trace_meta.perfana_ulr
-                )
-            except BaseException as e:
+                with tracing.span("bitbucket.report"):
+                    response = await integrations.put_code_insights_report(
+                        bitbucket_url,
+                        bitbucket_token,
+                        project=bitbucket_project,
+                        repository=bitbucket_repo,
+                        commit=trace_meta.commit,
+                        report_key=layout_id,
+                        report={"title": f"{title}-{layout_id}", "link": trace_meta.perfana_ulr}
+                    )
+                response.raise_for_status()
+            except Exception as e:
                 error_msg = f"Can't push report to bitbucket. {type(e).__name__}: {e}"
                 log.warning(error_msg)
                 self.verbose_result.errors.append(error_msg)
@@ -4,29 +4,36 @@ import os
 import subprocess
 from asyncio import CancelledError
 from datetime import datetime
+from typing import Optional
 from urllib.parse import urlparse
 from urllib.request import url2pathname
 
 import paramiko
 from configargparse import Namespace
 
-from .base_transaction import BaseExportanaTransaction
-from .exceptions.environment_exception import EnvironmentException
-from .exceptions.trace_exception import TraceException
 from ..exporter.constants import INSIGHTS_BINARY, UTRACE_EXT
+from ..exporter.frame_stream import FrameStream
 from ..models.base import VerboseResult
-from ..models.trace_meta import TraceMeta
+from ..models.trace_meta import TraceMeta, TraceStage
 from ..models.trace_with_context import TraceInfoWithContext
-from ..models.worker import WorkerStatus, WorkerInfo
-from ..routes import metrics_receiver
+from ..models.worker import WorkerInfo, WorkerStatus
+from ..routes.metrics_receiver import DEFAULT_SESSION_ID, MetricsSession
+from .base_transaction import BaseExportanaTransaction
+from .exceptions.environment_exception import EnvironmentException
+from .exceptions.trace_exception import TraceException
 
 log = logging.getLogger(__name__)
 
 
 class TraceProcessingTransaction(BaseExportanaTransaction):
+    stage = TraceStage.insights
+
     def __init__(self, args: Namespace, trace_info: TraceInfoWithContext, trace_meta: TraceMeta,
-                 verbose_result: VerboseResult, worker: WorkerInfo):
+                 verbose_result: VerboseResult, worker: WorkerInfo, metrics_session: MetricsSession,
+                 frames_stream: Optional[FrameStream] = None):
         super().__init__(args, trace_info, trace_meta, verbose_result, worker)
+        self._metrics_session = metrics_session
+        self._frames_stream = frames_stream
 
     async def execute(self):
         self._worker.status = WorkerStatus.working
@@ -42,9 +49,18 @@ class TraceProcessingTransaction(BaseExportanaTransaction):
             self.verbose_result.errors.append(error_msg)
             raise EnvironmentException(error_msg)
 
-        metrics_receiver.flush_metrics()
+        self._metrics_session.flush_metrics()
+        if self._frames_stream is None:
+            await self._start_trace_processing(insights_url_parsed)
+            return
 
-        await self._start_trace_processing(insights_url_parsed)
+        self._metrics_session.attach_stream(self._frames_stream)
+        try:
+            await self._start_trace_processing(insights_url_parsed)
+        except BaseException:
+            self._frames_stream.abort()
+            raise
+        await self._frames_stream.close()
 
     async def commit(self):
         return
@@ -69,6 +85,10 @@ class TraceProcessingTransaction(BaseExportanaTransaction):
                    f"-AutoQuit," \
                    f"-TraceSessionsDir={self._args.trace_sessions_dir}".split(",")
 
+        if self._metrics_session.session_id != DEFAULT_SESSION_ID:
+            # Insights posts the metrics to `/performance_metrics/session/<id>/...`
+            run_args.append(f"-VSPRemoteReportPostingSession={self._metrics_session.session_id}")
+
         if not self._args.gui:
             log.info(f"GUI disabled")
             run_args.append("-nullrhi")
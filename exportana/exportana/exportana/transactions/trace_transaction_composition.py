@@ -4,15 +4,20 @@ from typing import List
 
 from configargparse import Namespace
 
+from ..configs import concurrent_traces
+from ..exporter.frame_stream import FrameStream
 from ..models.base import VerboseResult
 from ..models.trace_meta import TraceMeta
 from ..models.trace_with_context import TraceInfoWithContext
 from ..models.worker import WorkerInfo, WorkerStatus
-from ..transactions.base_transaction import BaseTransaction
+from ..routes import metrics_receiver
+from ..transactions.base_transaction import BaseTransaction, execute_stage
+from ..transactions.concurrent_transaction import ConcurrentTransaction
 from ..transactions.get_work_transaction import GetWorkTransaction
 from ..transactions.report_export_transaction import ReportExportTransaction
 from ..transactions.trace_export_transaction import TraceExportTransaction
 from ..transactions.trace_processing_transaction import TraceProcessingTransaction
+from ..utils import tracing
 from ..utils.utils import timing
 
 log = logging.getLogger(__name__)
@@ -28,6 +33,11 @@ class TraceTransactionComposition(BaseTransaction):
         self.trace_meta = TraceMeta()
         self.verbose_result = VerboseResult()
         self.worker = worker
+        self._args = args
+        # a single trace at a time is received without a session id, as it always was
+        self.metrics_session = metrics_receiver.open_session(
+            metrics_receiver.new_session_id() if concurrent_traces(args) > 1 else metrics_receiver.DEFAULT_SESSION_ID
+        )
 
         self._make_transactions(args, worker, process)
 
@@ -40,14 +50,29 @@ class TraceTransactionComposition(BaseTransaction):
         self.worker.status = WorkerStatus.idle
         self.worker.trace_name = None
 
-        for i in range(len(self._transaction_list)):
-            self._current_transaction_index = i
-            log.info(f"execute transaction: the {i} of {len(self._transaction_list) - 1}")
-            await self._transaction_list[i].execute()
+        # the trace is known once it is acquired, the spans and the profile cover the rest of the pipeline
+        await self._execute_transaction(0)
+        with tracing.root_span(
+            "trace_processing",
+            trace_name=self.trace_info.trace_name,
+            worker=self.worker.get_slot_name()
+        ), tracing.profile_if_slow(
+            self.trace_info.trace_name,
+            self._args.profile_dir,
+            self._args.profile_slower_than_sec
+        ):
+            for i in range(1, len(self._transaction_list)):
+                await self._execute_transaction(i)
+
+    async def _execute_transaction(self, i: int):
+        self._current_transaction_index = i
+        log.info(f"execute transaction: the {i} of {len(self._transaction_list) - 1}")
+        await execute_stage(self._transaction_list[i], self.trace_meta.stage_durations)
 
     async def commit(self):
         for t in self._transaction_list:
             await t.commit()
+        metrics_receiver.close_session(self.metrics_session)
 
         if self.trace_info is not None:
             log.info(f"Processing transaction for trace {self.trace_info.trace_name} finished!")
@@ -65,6 +90,7 @@ class TraceTransactionComposition(BaseTransaction):
                 except Exception as e:
                     error_msg = f"TraceTransactionComposition. Rollback: {type(e).__name__} {e} transaction index: {i}"
                     log.warning(error_msg)
+        metrics_receiver.close_session(self.metrics_session)
         self.trace_meta.processed_timestamp = datetime.now().timestamp()
 
         self.worker.status = WorkerStatus.idle
@@ -72,10 +98,22 @@ class TraceTransactionComposition(BaseTransaction):
     def _make_transactions(self, args: Namespace, worker: WorkerInfo, process: bool = True):
         self._transaction_list.append(
             GetWorkTransaction(args, self.trace_info, self.trace_meta, self.verbose_result, worker))
-        if process:
+        if process and args.streaming_export:
+            # the export consumes frames while Unreal Insights is still posting them
+            frames_stream = FrameStream(args.streaming_queue_size)
+            self._transaction_list.append(ConcurrentTransaction([
+                TraceProcessingTransaction(
+                    args, self.trace_info, self.trace_meta, self.verbose_result, worker, self.metrics_session,
+                    frames_stream),
+                TraceExportTransaction(
+                    args, self.trace_info, self.trace_meta, self.verbose_result, self.metrics_session, frames_stream),
+            ], self.trace_meta.stage_durations))
+        else:
+            if process:
+                self._transaction_list.append(
+                    TraceProcessingTransaction(
+                        args, self.trace_info, self.trace_meta, self.verbose_result, worker, self.metrics_session))
             self._transaction_list.append(
-                TraceProcessingTransaction(args, self.trace_info, self.trace_meta, self.verbose_result, worker))
-        self._transaction_list.append(
-            TraceExportTransaction(args, self.trace_info, self.trace_meta, self.verbose_result))
+                TraceExportTransaction(args, self.trace_info, self.trace_meta, self.verbose_result, self.metrics_session))
         self._transaction_list.append(
             ReportExportTransaction(args, self.trace_info, self.trace_meta, self.verbose_result, worker))
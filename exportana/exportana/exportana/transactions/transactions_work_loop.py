@@ -9,10 +9,12 @@ from ..configs import Configs
 from ..exporter import worker
 from ..models.base import VerboseResult
 from ..models.trace_meta import TraceMeta
-from ..models.traces import TraceInfo, ProcessedTraceReport
-from ..models.worker import WorkerInfo, WorkerStatus, Worker
+from ..models.traces import ProcessedTraceReport, TraceInfo
+from ..models.worker import Worker, WorkerInfo, WorkerStatus
 from ..transactions.exceptions.environment_exception import EnvironmentException
-from ..transactions.exceptions.external_service_exception import ExternalServiceException
+from ..transactions.exceptions.external_service_exception import (
+    ExternalServiceException,
+)
 from ..transactions.exceptions.trace_exception import TraceException
 from ..transactions.trace_transaction_composition import TraceTransactionComposition
 from ..utils.utils import make_url
@@ -27,7 +29,7 @@ async def send_transaction_report(url: str,
                                   verbose_result: VerboseResult):
     DELAY_SEC = 30
     report = ProcessedTraceReport(trace_name=trace_info.trace_name,
-                                  worker=Worker(url=worker_info.url),
+                                  worker=Worker(url=worker_info.url, slot=worker_info.slot),
                                   result=verbose_result,
                                   trace_meta=trace_meta)
     async with httpx.AsyncClient() as client:
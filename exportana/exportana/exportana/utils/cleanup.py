@@ -2,23 +2,26 @@ import asyncio
 import logging
 import os
 import re
+import shutil
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
-from typing import List
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
 
 import aioschedule
-from elasticsearch import Elasticsearch
-from elasticsearch import exceptions
+from elasticsearch import Elasticsearch, exceptions
 from elasticsearch._async.client import AsyncElasticsearch
 
 from ..database.broker import MongoDatabase
-from ..exporter.constants import UTRACE_EXT, INF
+from ..exporter.constants import EXPORT_ID_KEY, INF, UTRACE_EXT
+from ..exporter.index_lifecycle import delete_expired_indices
 from ..models.base import VerboseResult
-from ..models.traces import ProcessedTraceInfo
+from ..models.traces import BranchClass
 from ..utils.compatibility import removesuffix
-from ..utils.utils import timing
+from ..utils.trace_size_index import TraceSizeIndex
+from ..utils.utils import human_read_to_byte, timing
 
 log = logging.getLogger(__name__)
 
@@ -36,28 +39,33 @@ async def delete_traces_from_index(es: AsyncElasticsearch,
                                    es_index: str,
                                    test_id: str,
                                    workstation: str,
-                                   test_start: str) -> VerboseResult:
+                                   test_start: str,
+                                   keep_export_id: Optional[str] = None) -> VerboseResult:
+    """Removes the documents of the trace, except the ones written by the `keep_export_id` export if any"""
     KEY_TEST_ID = "test_id"
     KEY_WORKSTATION = "workstation"
     KEY_TEST_START = "test_start"
-    KEY_MATCH = "match"
+    KEY_TERM = "term"
     KEY_FAILURES = "failures"
 
+    query = {
+        "bool": {
+            # keyword fields, exact terms in the filter context are cheaper than scored matches
+            "filter": [
+                {KEY_TERM: {KEY_TEST_ID: test_id}},
+                {KEY_TERM: {KEY_WORKSTATION: workstation}},
+                {KEY_TERM: {KEY_TEST_START: test_start}},
+            ]
+        }
+    }
+    if keep_export_id:
+        query["bool"]["must_not"] = [{KEY_TERM: {EXPORT_ID_KEY: keep_export_id}}]
+
     try:
         error_msg_list = list()
         response = await es.delete_by_query(
             index=es_index,
-            body={
-                "query": {
-                    "bool": {
-                        "must": [
-                            {KEY_MATCH: {KEY_TEST_ID: test_id}},
-                            {KEY_MATCH: {KEY_WORKSTATION: workstation}},
-                            {KEY_MATCH: {KEY_TEST_START: test_start}},
-                        ]
-                    }
-                }
-            },
+            body={"query": query},
             conflicts="proceed"
         )
         failures = response[KEY_FAILURES]
@@ -88,6 +96,19 @@ class CleanupTracesInfo:
     cleanup_release_days: float = None
     cleanup_branches_days: float = None
     cleanup_interval_hours: float = None
+    cleanup_concurrency: int = 4
+
+    # remove processed traces when free disk space drops below alert_disk_space
+    disk_eviction: bool = False
+    alert_disk_space: str = None
+
+    # rolled over elasticsearch indices with data older than index_retention_days are deleted
+    elastic: List[str] = None
+    index_prefix: str = None
+    index_retention_days: float = float(INF)
+
+    # log the traces to remove instead of removing them
+    dry_run: bool = False
 
 
 def get_time_from_test_start(test_start: str) -> datetime:
@@ -102,95 +123,271 @@ def get_time_from_test_start(test_start: str) -> datetime:
     return datetime.strptime(time_str, TIME_MASK)
 
 
-@timing("Cleanup traces", log_level=logging.INFO)
-async def _cleanup_traces(info: CleanupTracesInfo):
-    SECONDS_IN_DAY = 24 * 60 * 60
-    log.info("Cleanup traces: started")
+@dataclass
+class CleanupReport:
+    deleted: int = 0
+    failed: int = 0
+    freed_bytes: int = 0
+    duration_sec: float = 0
+
+    def __str__(self):
+        return (
+            f"removed {self.deleted} trace(s), "
+            f"freed {self.freed_bytes / (1024 * 1024):.1f} MB, "
+            f"failed {self.failed}, "
+            f"deletion took {self.duration_sec:.2f}s"
+        )
 
-    db: MongoDatabase = MongoDatabase()
-    db.init()
 
-    current_time = datetime.now()
-    max_delta_master = info.cleanup_master_days * SECONDS_IN_DAY
-    max_delta_release = info.cleanup_release_days * SECONDS_IN_DAY
-    max_delta_branches = info.cleanup_branches_days * SECONDS_IN_DAY
-
-    def remove_trace_artifacts_if_old(processed_trace_info: ProcessedTraceInfo):
-        last_processing_report = processed_trace_info.processing_reports[-1]
-        branch = last_processing_report.trace_meta.branch
-        scenario = branch
-        if branch == "master":
-            max_delta = max_delta_master
-        elif not branch:
-            max_delta = max_delta_release
-            scenario = "release"
-        else:
-            max_delta = max_delta_branches
-            scenario = "branch"
-
-        log.debug(
-            f"Cleanup traces: "
-            f"Try to remove trace: {last_processing_report.trace_name}, "
-            f"Scenario: {scenario}, "
-            f"Branch: {branch}, "
-            f"Trace storage time (sec): {max_delta}, "
-            f"Processed date: {last_processing_report.processed_date}"
-        )
+def _remove_trace_file(trace_path: str) -> int:
+    """Returns the size of the removed file"""
+    size = os.path.getsize(trace_path)
+    os.remove(trace_path)
+    return size
 
-        delta_time = current_time - last_processing_report.processed_date
-        need_to_remove = max_delta < delta_time.total_seconds()
-        trace_path = os.path.join(info.trace_sessions_dir, last_processing_report.trace_name)
-        trace_path += UTRACE_EXT
-        if not need_to_remove:
-            log.debug(f"Cleanup traces: No need to delete trace file: {trace_path}")
-            return
-        try:
-            os.remove(trace_path)
-        except Exception as e:
-            log.error(f"Cleanup traces: Error on delete trace file: {trace_path}: {type(e).__name__}: {e}")
+
+async def _remove_traces(trace_sessions_dir: str, trace_names: List[str], concurrency: int) -> CleanupReport:
+    """Removes the trace files in a thread pool, at most `concurrency` at once"""
+    start = time.perf_counter()
+    report = CleanupReport()
+    loop = asyncio.get_running_loop()
+    trace_paths = [os.path.join(trace_sessions_dir, trace_name + UTRACE_EXT) for trace_name in trace_names]
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="cleanup") as executor:
+        results = await asyncio.gather(
+            *[loop.run_in_executor(executor, _remove_trace_file, trace_path) for trace_path in trace_paths],
+            return_exceptions=True
+        )
+    for trace_path, result in zip(trace_paths, results):
+        if isinstance(result, BaseException):
+            report.failed += 1
+            log.error(f"Cleanup traces: Error on delete trace file: {trace_path}: {type(result).__name__}: {result}")
         else:
-            log.info(f"Cleanup traces: Remove trace: {last_processing_report.trace_name}")
+            report.deleted += 1
+            report.freed_bytes += result
+            log.debug(f"Cleanup traces: Remove trace: {trace_path}")
+    report.duration_sec = time.perf_counter() - start
+    return report
 
-        log.info(f"Cleanup traces: Remove trace: {last_processing_report.trace_name}")
 
-    async with await db.start_session() as session, session.start_transaction():
-        trace_file_names = os.listdir(info.trace_sessions_dir)
-        for trace_file_name in trace_file_names:
-            if trace_file_name.endswith(UTRACE_EXT):
-                trace_name = removesuffix(trace_file_name, UTRACE_EXT)
+async def _plan_cleanup(db: MongoDatabase, info: CleanupTracesInfo) -> List[str]:
+    """Names of the expired traces that have a file in the trace sessions dir and are safe to remove"""
+    SECONDS_IN_DAY = 24 * 60 * 60
 
-                if info.cleanup_ignore and trace_name in info.cleanup_ignore:
-                    log.debug(f"Cleanup traces. Ignore trace: {trace_name}")
-                    continue
+    current_time = datetime.now()
+    expire_dates: Dict[BranchClass, datetime] = dict()
+    for branch_class, days in (
+            (BranchClass.master, info.cleanup_master_days),
+            (BranchClass.release, info.cleanup_release_days),
+            (BranchClass.branch, info.cleanup_branches_days),
+    ):
+        if days != float(INF):
+            expire_dates[branch_class] = current_time - timedelta(seconds=days * SECONDS_IN_DAY)
+
+    expired = await db.get_expired_trace_names(expire_dates)
+    if not expired:
+        return []
+    with os.scandir(info.trace_sessions_dir) as entries:
+        trace_names = {
+            removesuffix(entry.name, UTRACE_EXT)
+            for entry in entries if entry.name.endswith(UTRACE_EXT) and entry.is_file()
+        }
+    plan = expired & trace_names
+    if info.cleanup_ignore:
+        plan -= set(info.cleanup_ignore)
+    plan -= await db.get_busy_trace_names()
+    return sorted(plan)
 
-                trace_in_queue = await db.find_queued_trace(trace_name)
-                if trace_in_queue:
-                    log.debug(f"Cleanup traces. Trace {trace_name} in queue. Ignore")
-                    continue
 
-                trace = await db.find_ready_trace(trace_name)
-                if not trace:
-                    trace = await db.find_poisoned_trace(trace_name)
-                if trace:
-                    remove_trace_artifacts_if_old(trace)
-                else:
-                    log.debug(
-                        f"Cleanup traces. Can't find trace info: {trace_name} "
-                        f"in ready_traces table, poisoned_traces table"
-                    )
+@timing("Cleanup traces", log_level=logging.INFO)
+async def _cleanup_traces(info: CleanupTracesInfo, db: MongoDatabase):
+    log.info("Cleanup traces: started")
 
-    db.close()
+    plan = await _plan_cleanup(db, info)
+    if info.dry_run:
+        for trace_name in plan:
+            log.info(f"Cleanup traces (dry run): Would remove trace: {trace_name}")
+        log.info(f"Cleanup traces (dry run): {len(plan)} trace(s) to remove")
+        return
+
+    report = await _remove_traces(info.trace_sessions_dir, plan, info.cleanup_concurrency)
+    log.info(f"Cleanup traces: {report}")
+
+
+# region Disk eviction
+class DiskEvictor:
+    """
+    Keeps the free disk space of the trace sessions dir above `watermark_bytes`. Once it drops below,
+    already processed traces are removed until `EVICTION_HEADROOM` of the watermark is free on top of it.
+    The eviction is triggered by the watchdog events of the size index, so it starts as soon as a trace upload
+    crosses the watermark, and is re-checked every `check_interval_sec` for the space taken by other files.
+    An upload makes a watchdog event per write, the free space is checked once per `check_interval_sec` at most.
+    """
+    # free space to reach on top of the watermark, so an eviction isn't triggered by every next write
+    EVICTION_HEADROOM = 0.1
+    # the older the trace relative to others the sooner it goes, feature branches go first and release ones last
+    BRANCH_CLASS_WEIGHTS = {
+        BranchClass.branch: 4,
+        BranchClass.master: 2,
+        BranchClass.release: 1,
+    }
+
+    def __init__(self, info: CleanupTracesInfo, watermark_bytes: int, check_interval_sec: float = 60):
+        self.info = info
+        self.watermark_bytes = watermark_bytes
+        self.check_interval_sec = check_interval_sec
+        self.index = TraceSizeIndex(info.trace_sessions_dir, on_change=self._on_index_change)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        # time.monotonic() the watchdog events may check the free space again at
+        self._next_check: float = 0
+        # the manager's database, opened by `run` in its event loop
+        self._db: Optional[MongoDatabase] = None
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.info.trace_sessions_dir).free
+
+    def _on_index_change(self):
+        # called from the watchdog thread
+        now = time.monotonic()
+        if not self._loop or now < self._next_check:
+            return
+        self._next_check = now + self.check_interval_sec
+        if self.free_bytes() < self.watermark_bytes:
+            self._loop.call_soon_threadsafe(self._changed.set)
+
+    @classmethod
+    def eviction_score(cls, branch_class: BranchClass, last_processed_date: datetime, size: int, now: datetime) -> float:
+        """Bigger goes first: weighted age in hours times size"""
+        age_hours = max((now - last_processed_date).total_seconds() / 3600, 0)
+        return cls.BRANCH_CLASS_WEIGHTS[branch_class] * age_hours * size
+
+    async def _plan(self, db: MongoDatabase, bytes_to_free: int) -> List[str]:
+        sizes = self.index.sizes()
+        if self.info.cleanup_ignore:
+            for trace_name in self.info.cleanup_ignore:
+                sizes.pop(trace_name, None)
+        for trace_name in await db.get_busy_trace_names():
+            sizes.pop(trace_name, None)
+        classes = await db.get_processed_trace_classes(set(sizes.keys()))
+
+        now = datetime.now()
+        candidates = sorted(
+            classes.items(),
+            key=lambda item: self.eviction_score(*item[1], sizes[item[0]], now),
+            reverse=True
+        )
+        plan, planned_bytes = list(), 0
+        for trace_name, _ in candidates:
+            if planned_bytes >= bytes_to_free:
+                break
+            plan.append(trace_name)
+            planned_bytes += sizes[trace_name]
+        return plan
+
+    async def evict(self) -> bool:
+        """Returns False if there wasn't enough processed traces to get above the watermark"""
+        free_bytes = self.free_bytes()
+        if free_bytes >= self.watermark_bytes:
+            return True
+        bytes_to_free = int(self.watermark_bytes * (1 + self.EVICTION_HEADROOM)) - free_bytes
+        log.info(f"Disk eviction: {free_bytes} bytes free, below the watermark {self.watermark_bytes}, "
+                 f"{bytes_to_free} bytes to free")
+
+        plan = await self._plan(self._db, bytes_to_free)
+        if self.info.dry_run:
+            for trace_name in plan:
+                log.info(f"Disk eviction (dry run): Would remove trace: {trace_name}")
+            log.info(f"Disk eviction (dry run): {len(plan)} trace(s) to remove")
+            return True
+
+        report = await _remove_traces(self.info.trace_sessions_dir, plan, self.info.cleanup_concurrency)
+        log.info(f"Disk eviction: {report}")
+        free_bytes = self.free_bytes()
+        if free_bytes < self.watermark_bytes:
+            log.warning(f"Disk eviction: Not enough processed traces to evict, "
+                        f"{free_bytes} bytes free, watermark {self.watermark_bytes}")
+            return False
+        return True
+
+    async def run(self):
+        self._db = MongoDatabase()
+        await self._db.init()
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self.index.start()
+        try:
+            while True:
+                try:
+                    # writes trigger no other attempt within the interval, as after a dry run below the watermark
+                    self._next_check = time.monotonic() + self.check_interval_sec
+                    if not await self.evict():
+                        # nothing more to evict, writes don't trigger another attempt until the next check
+                        await asyncio.sleep(self.check_interval_sec)
+                        self._changed.clear()
+                except Exception as e:
+                    log.error(f"Disk eviction: {type(e).__name__}: {e}")
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.check_interval_sec)
+                except asyncio.TimeoutError:
+                    pass
+                self._changed.clear()
+        finally:
+            self.index.stop()
+            self._db.close()
+
+
+# endregion
+
+
+@timing("Cleanup indices", log_level=logging.INFO)
+async def _cleanup_expired_indices(info: CleanupTracesInfo):
+    es = AsyncElasticsearch(hosts=info.elastic, retry_on_timeout=True)
+    try:
+        expired = await delete_expired_indices(es, info.index_prefix, info.index_retention_days)
+        log.info(f"Cleanup indices: {len(expired)} expired index(es) deleted")
+    except Exception as e:
+        log.error(f"Cleanup indices: {type(e).__name__}: {e}")
+    finally:
+        await es.close()
 
 
 async def scheduler_loop(info: CleanupTracesInfo):
     TIMEOUT_SEC: int = 60
-    aioschedule.every(info.cleanup_interval_hours).hours.do(_cleanup_traces, info)
+    INDICES_CLEANUP_INTERVAL_HOURS: int = 1
+    if info.disk_eviction:
+        evictor = DiskEvictor(info, human_read_to_byte(info.alert_disk_space), TIMEOUT_SEC)
+        # the references to the tasks, the event loop keeps only weak ones
+        eviction_tasks: Set[asyncio.Task] = set()
+
+        def start_eviction():
+            task = asyncio.create_task(evictor.run())
+            eviction_tasks.add(task)
+            task.add_done_callback(restart_eviction)
+
+        def restart_eviction(task: asyncio.Task):
+            # the evictor stopped on a failure outside of an eviction attempt, e.g. the database is unreachable
+            eviction_tasks.discard(task)
+            if task.cancelled():
+                return
+            e = task.exception()
+            reason = f"{type(e).__name__}: {e}" if e else "no error"
+            log.error(f"Disk eviction stopped ({reason}). Restarting in {TIMEOUT_SEC} sec")
+            asyncio.get_running_loop().call_later(TIMEOUT_SEC, start_eviction)
+
+        start_eviction()
+
+    # the database of the scheduler thread, bound to its event loop
+    db: MongoDatabase = MongoDatabase()
+    await db.init()
+    aioschedule.every(info.cleanup_interval_hours).hours.do(_cleanup_traces, info, db)
+    if info.index_retention_days != float(INF):
+        aioschedule.every(INDICES_CLEANUP_INTERVAL_HOURS).hours.do(_cleanup_expired_indices, info)
 
     if info.cleanup_interval_hours == float(INF):
         info.cleanup_interval_hours = None
 
     if info.force_cleanup:
-        await _cleanup_traces(info)
+        await _cleanup_traces(info, db)
 
     while True:
         await aioschedule.run_pending()
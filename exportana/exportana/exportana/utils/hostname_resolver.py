@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+import dns.asyncresolver
+import dns.reversename
+from dns.exception import DNSException
+
+__ALL__ = ["HostnameResolver", "hostname_resolver"]
+
+log = logging.getLogger(__name__)
+
+
+class HostnameResolver:
+    """
+    Reverse DNS of the workstations, each lookup bounded by `timeout_sec`.
+    Names are cached for `ttl_sec`, failed lookups for `negative_ttl_sec`, so the traces of a farm machine
+    resolve it once and a dead DNS server costs one timeout per machine, not per trace.
+    The hosts file (`<ip> <hostname>` lines, as /etc/hosts) takes precedence over DNS.
+    """
+
+    def __init__(self, ttl_sec: float = 3600, negative_ttl_sec: float = 300, timeout_sec: float = 1):
+        self.ttl_sec = ttl_sec
+        self.negative_ttl_sec = negative_ttl_sec
+        self.timeout_sec = timeout_sec
+        self._static: Dict[str, str] = dict()
+        # ip -> (expires, hostname or None for a failed lookup)
+        self._cache: Dict[str, Tuple[float, Optional[str]]] = dict()
+        self._pending: Dict[str, asyncio.Future] = dict()
+        self._resolver: Optional[dns.asyncresolver.Resolver] = None
+
+    def configure(
+        self,
+        ttl_sec: float,
+        negative_ttl_sec: float,
+        timeout_sec: float,
+        hosts_file: Optional[str] = None
+    ):
+        self.ttl_sec = ttl_sec
+        self.negative_ttl_sec = negative_ttl_sec
+        self.timeout_sec = timeout_sec
+        self._cache.clear()
+        self._resolver = None
+        if hosts_file:
+            self.load_hosts_file(hosts_file)
+
+    def load_hosts_file(self, path: str):
+        static = dict()
+        with open(path, "r") as f:
+            for line in f:
+                fields = line.split("#", 1)[0].split()
+                if len(fields) >= 2:
+                    static[fields[0]] = fields[1]
+        self._static = static
+        log.info(f"HostnameResolver. {len(static)} host(s) loaded from {path}")
+
+    async def resolve(self, ip: str, full_dns: bool = False) -> str:
+        """The hostname of `ip`, or `ip` itself if it can't be back resolved in time"""
+        hostname = self._static.get(ip)
+        if hostname is None:
+            hostname = await self._lookup(ip)
+        if hostname is None:
+            return ip
+        if full_dns is False:
+            hostname = hostname.split(".")[0]
+        return hostname.lower()
+
+    async def _lookup(self, ip: str) -> Optional[str]:
+        entry = self._cache.get(ip)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        # the traces of one machine often come together, they share the lookup
+        pending = self._pending.get(ip)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = self._pending[ip] = asyncio.get_running_loop().create_future()
+        try:
+            try:
+                hostname = await asyncio.wait_for(self._query(ip), self.timeout_sec)
+            except (DNSException, asyncio.TimeoutError, ValueError) as e:
+                log.warning(f"Can't back resolve {ip}. {type(e).__name__}: {e}")
+                hostname = None
+            ttl = self.ttl_sec if hostname else self.negative_ttl_sec
+            self._cache[ip] = (time.monotonic() + ttl, hostname)
+            future.set_result(hostname)
+            return hostname
+        finally:
+            del self._pending[ip]
+            # the owner was cancelled or failed, the other waiters fall back to the ip instead of failing with it
+            if not future.done():
+                future.set_result(None)
+
+    async def _query(self, ip: str) -> str:
+        if self._resolver is None:
+            self._resolver = dns.asyncresolver.Resolver()
+            self._resolver.lifetime = self.timeout_sec
+        answer = await self._resolver.resolve(dns.reversename.from_address(ip), "PTR")
+        return str(answer[0]).rstrip(".")
+
+
+hostname_resolver = HostnameResolver()
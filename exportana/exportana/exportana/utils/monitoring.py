@@ -1,14 +1,12 @@
 import logging
 from datetime import datetime, timedelta
+from typing import Optional
 
-from prometheus_client import (
-    Gauge,
-    Enum,
-    Histogram
-)
+from prometheus_client import Enum, Gauge, Histogram
 
-from exportana.models.traces import ProcessedTraceReport
-from exportana.models.worker import WorkerStatus
+from exportana.models.trace_meta import TraceMeta, TraceStage
+from exportana.models.traces import ProcessedTraceReport, TracesStats, get_branch_class
+from exportana.models.worker import WorkerHeartbeat, WorkerStatus
 
 # region metrics constants
 TRACES_QUEUE_SIZE_KEY = "traces_queue_size"
@@ -20,14 +18,43 @@ READY_TRACES_COUNT_DESC = "Ready traces count"
 POISONED_TRACES_COUNT_KEY = "poisoned_traces_count"
 POISONED_TRACES_COUNT_DESC = "Poisoned traces count"
 
-TRACE_KEY = "trace"
 TRACE_EXECUTE_RESULT_KEY = "result"
+TRACE_BRANCH_CLASS_KEY = "branch_class"
+TRACE_SIZE_KEY = "size"
 TRACE_REPORT_KEY = "trace_execution_report"
 TRACE_REPORT_DESC = "Report of trace execution"
 
+TRACE_STAGE_KEY = "stage"
+TRACE_STAGE_DURATION_KEY = "trace_stage_duration_seconds"
+TRACE_STAGE_DURATION_DESC = "Time a trace spent in a stage of the worker pipeline"
+
+TRACE_QUEUE_WAIT_KEY = "trace_queue_wait_seconds"
+TRACE_QUEUE_WAIT_DESC = "Time from the trace creation to its acquire by a worker"
+
+# upper bounds of the trace size buckets, labels stay bounded whatever the traces are
+MB = 1024 * 1024
+TRACE_SIZE_BUCKETS = (
+    (100 * MB, "<100MB"),
+    (1024 * MB, "100MB-1GB"),
+    (5 * 1024 * MB, "1GB-5GB"),
+)
+TRACE_SIZE_LARGE = ">5GB"
+TRACE_SIZE_UNKNOWN = "unknown"
+
+# traces take minutes to hours, the prometheus default buckets end at 10 seconds
+DURATION_BUCKETS_SEC = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400, float("inf"))
+QUEUE_WAIT_BUCKETS_SEC = (10, 60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400, float("inf"))
+
 WORKER_KEY = "worker"
 WORKER_STATUS_KEY = "workers_status"
 WORKER_STATUS_DESC = "Worker status"
+
+WORKER_CPU_KEY = "worker_cpu_percent"
+WORKER_CPU_DESC = "CPU usage of the worker process, 100 is one core"
+WORKER_RSS_KEY = "worker_rss_bytes"
+WORKER_RSS_DESC = "Resident memory of the worker process"
+WORKER_FREE_DISK_KEY = "worker_free_disk_bytes"
+WORKER_FREE_DISK_DESC = "Free disk space in the worker's trace sessions dir"
 # endregion
 
 # region metrics instruments
@@ -41,12 +68,27 @@ worker_status_enum: Enum = Enum(
 trace_execution_histogram = Histogram(
     TRACE_REPORT_KEY,
     TRACE_REPORT_DESC,
-    labelnames=[TRACE_KEY, TRACE_EXECUTE_RESULT_KEY]
+    labelnames=[TRACE_EXECUTE_RESULT_KEY, TRACE_BRANCH_CLASS_KEY, TRACE_SIZE_KEY, WORKER_KEY],
+    buckets=DURATION_BUCKETS_SEC
+)
+trace_stage_histogram = Histogram(
+    TRACE_STAGE_DURATION_KEY,
+    TRACE_STAGE_DURATION_DESC,
+    labelnames=[TRACE_STAGE_KEY, TRACE_EXECUTE_RESULT_KEY],
+    buckets=DURATION_BUCKETS_SEC
+)
+trace_queue_wait_histogram = Histogram(
+    TRACE_QUEUE_WAIT_KEY,
+    TRACE_QUEUE_WAIT_DESC,
+    buckets=QUEUE_WAIT_BUCKETS_SEC
 )
 
 traces_queue_size_gauge: Gauge = Gauge(TRACES_QUEUE_SIZE_KEY, TRACES_QUEUE_SIZE_DESC)
 ready_traces_gauge: Gauge = Gauge(READY_TRACES_COUNT_KEY, READY_TRACES_COUNT_DESC)
 poisoned_traces_gauge: Gauge = Gauge(POISONED_TRACES_COUNT_KEY, POISONED_TRACES_COUNT_DESC)
+worker_cpu_gauge: Gauge = Gauge(WORKER_CPU_KEY, WORKER_CPU_DESC, labelnames=[WORKER_KEY])
+worker_rss_gauge: Gauge = Gauge(WORKER_RSS_KEY, WORKER_RSS_DESC, labelnames=[WORKER_KEY])
+worker_free_disk_gauge: Gauge = Gauge(WORKER_FREE_DISK_KEY, WORKER_FREE_DISK_DESC, labelnames=[WORKER_KEY])
 # endregion
 
 log = logging.getLogger(__name__)
@@ -74,6 +116,31 @@ def set_worker_status(worker_url: str, status: WorkerStatus):
 # endregion
 
 
+# region worker resources metrics
+def set_worker_resources(heartbeat: WorkerHeartbeat):
+    try:
+        for gauge, value in (
+            (worker_cpu_gauge, heartbeat.cpu_percent),
+            (worker_rss_gauge, heartbeat.rss_bytes),
+            (worker_free_disk_gauge, heartbeat.free_disk_bytes),
+        ):
+            if value is not None:
+                gauge.labels(heartbeat.url).set(value)
+    except Exception as e:
+        log.warning(f"Prometheus monitoring. set_worker_resources. Something wrong {e}")
+
+
+def remove_worker_resources(worker_url: str):
+    for gauge in (worker_cpu_gauge, worker_rss_gauge, worker_free_disk_gauge):
+        try:
+            gauge.remove(worker_url)
+        except KeyError:
+            pass
+
+
+# endregion
+
+
 # region ready traces metrics
 def set_ready_traces_count(value: int):
     try:
@@ -96,18 +163,61 @@ def set_poisoned_traces_count(value: int):
 # endregion
 
 
+# region all traces counts metrics
+def set_traces_stats(stats: TracesStats):
+    set_traces_queue_count(stats.queued)
+    set_ready_traces_count(stats.ready)
+    set_poisoned_traces_count(stats.poisoned)
+
+
+# endregion
+
+
 # region trace report result metric
-def set_trace_report_result(trace_report: ProcessedTraceReport):
+def get_trace_size_label(trace_size: Optional[int]) -> str:
+    if trace_size is None:
+        return TRACE_SIZE_UNKNOWN
+    for upper_bound, label in TRACE_SIZE_BUCKETS:
+        if trace_size < upper_bound:
+            return label
+    return TRACE_SIZE_LARGE
+
+
+def set_trace_report_result(trace_report: ProcessedTraceReport, trace_size: Optional[int] = None):
+    """
+    Labels are bounded: the result, branch class, size bucket and worker, but not the trace name.
+    The stages are timed by the worker, durations from the clocks of different hosts are never mixed.
+    """
     try:
-        if trace_report.trace_meta:
-            tm = trace_report.trace_meta
-            processed_timestamp = tm.processed_timestamp
-            started_timestamp = tm.started_timestamp
-            dt_delta: timedelta = datetime.fromtimestamp(processed_timestamp) - datetime.fromtimestamp(started_timestamp)
-            processing_time_sec = dt_delta.total_seconds()
-            trace_name = trace_report.trace_name
-            processing_result = trace_report.result.result
-            trace_execution_histogram.labels(trace_name, str(processing_result)).observe(processing_time_sec)
+        tm = trace_report.trace_meta
+        if isinstance(tm, dict):
+            tm = TraceMeta.parse_obj(tm)
+        if not tm:
+            return
+        processing_result = str(trace_report.result.result)
+        if tm.started_timestamp and tm.processed_timestamp:
+            dt_delta: timedelta = datetime.fromtimestamp(tm.processed_timestamp) - datetime.fromtimestamp(tm.started_timestamp)
+            trace_execution_histogram.labels(
+                processing_result,
+                get_branch_class(tm.branch).value,
+                get_trace_size_label(trace_size),
+                trace_report.worker.url if trace_report.worker else ""
+            ).observe(dt_delta.total_seconds())
+
+        for stage, duration_sec in tm.stage_durations.items():
+            trace_stage_histogram.labels(TraceStage(stage).value, processing_result).observe(duration_sec)
     except Exception as e:
         log.warning(f"Prometheus monitoring. set_trace_report_result. Something wrong {e}")
+
+
+# endregion
+
+
+# region trace queue wait metric
+def set_trace_queue_wait(creation_date: Optional[datetime]):
+    try:
+        if creation_date:
+            trace_queue_wait_histogram.observe(max((datetime.now() - creation_date).total_seconds(), 0))
+    except Exception as e:
+        log.warning(f"Prometheus monitoring. set_trace_queue_wait. Something wrong {e}")
 # endregion
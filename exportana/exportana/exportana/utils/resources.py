@@ -0,0 +1,56 @@
+import logging
+import shutil
+from typing import Dict, Optional
+
+import psutil
+
+__ALL__ = ["ResourceSampler"]
+
+log = logging.getLogger(__name__)
+
+
+class ResourceSampler:
+    """Resource usage of the current process with its children (UnrealInsights) and free disk space of the `path`"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._process = psutil.Process()
+        # the first call of cpu_percent always reports 0, it starts the measurement interval
+        self._process.cpu_percent()
+        # the children seen by the previous call by pid, their measurement intervals are running
+        self._children: Dict[int, psutil.Process] = dict()
+
+    def cpu_percent(self) -> float:
+        """
+        CPU usage of the process and its children since the previous call, 100 is one fully loaded core.
+        A child started in between is counted from the call it is first seen at.
+        """
+        total = self._process.cpu_percent()
+        try:
+            children = self._process.children(recursive=True)
+        except psutil.Error as e:
+            log.warning(f"ResourceSampler. Can't list the child processes: {e}")
+            children = []
+        known = dict()
+        for child in children:
+            seen = self._children.get(child.pid)
+            if seen is not None and seen == child:
+                child = seen
+            try:
+                total += child.cpu_percent()
+            except psutil.Error:
+                # exited in between
+                continue
+            known[child.pid] = child
+        self._children = known
+        return total
+
+    def rss_bytes(self) -> int:
+        return self._process.memory_info().rss
+
+    def free_disk_bytes(self) -> Optional[int]:
+        try:
+            return shutil.disk_usage(self._path).free
+        except OSError as e:
+            log.warning(f"ResourceSampler. Can't get disk usage of {self._path}: {e}")
+            return None
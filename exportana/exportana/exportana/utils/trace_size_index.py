@@ -0,0 +1,119 @@
+import logging
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from watchdog.events import (
+    FileSystemEvent,
+    FileSystemEventHandler,
+    FileSystemMovedEvent,
+)
+from watchdog.observers import Observer
+from watchdog.observers.api import BaseObserver
+
+from ..exporter.constants import UTRACE_EXT
+from ..utils.compatibility import removesuffix
+
+__ALL__ = ["TraceSizeIndex"]
+
+log = logging.getLogger(__name__)
+
+
+class TraceSizeIndex(FileSystemEventHandler):
+    """
+    Sizes of the trace files of a directory by trace name. The directory is scanned once,
+    then the index is kept current by watchdog events, `on_change` is called from the watchdog thread after each update.
+    """
+
+    def __init__(self, path: str, on_change: Optional[Callable[[], None]] = None):
+        self.path = path
+        self._on_change = on_change
+        self._sizes: Dict[str, int] = dict()
+        self._lock = threading.Lock()
+        self._observer: Optional[BaseObserver] = None
+
+    def start(self):
+        self._scan()
+        self._observer = Observer()
+        self._observer.schedule(self, self.path, recursive=False)
+        self._observer.daemon = True
+        self._observer.start()
+
+    def stop(self):
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+
+    def sizes(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._sizes)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _scan(self):
+        sizes: Dict[str, int] = dict()
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.endswith(UTRACE_EXT) and entry.is_file():
+                    try:
+                        sizes[removesuffix(entry.name, UTRACE_EXT)] = entry.stat().st_size
+                    except OSError:
+                        pass
+        with self._lock:
+            self._sizes = sizes
+        log.info(f"TraceSizeIndex. {len(sizes)} trace(s), {sum(sizes.values())} bytes in {self.path}")
+
+    @staticmethod
+    def _get_trace_name(path: str) -> Optional[str]:
+        file_name = os.path.basename(path)
+        return removesuffix(file_name, UTRACE_EXT) if file_name.endswith(UTRACE_EXT) else None
+
+    def _update(self, path: str):
+        trace_name = self._get_trace_name(path)
+        if not trace_name:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            self._discard(path)
+            return
+        with self._lock:
+            self._sizes[trace_name] = size
+        self._changed()
+
+    def _discard(self, path: str):
+        trace_name = self._get_trace_name(path)
+        if not trace_name:
+            return
+        with self._lock:
+            self._sizes.pop(trace_name, None)
+        self._changed()
+
+    def _changed(self):
+        if self._on_change:
+            try:
+                self._on_change()
+            except Exception as e:
+                log.warning(f"TraceSizeIndex. on_change failed: {type(e).__name__} {e}")
+
+    # region watchdog events
+    def on_created(self, event: FileSystemEvent):
+        if not event.is_directory:
+            self._update(event.src_path)
+
+    def on_modified(self, event: FileSystemEvent):
+        if not event.is_directory:
+            self._update(event.src_path)
+
+    def on_deleted(self, event: FileSystemEvent):
+        if not event.is_directory:
+            self._discard(event.src_path)
+
+    def on_moved(self, event: FileSystemMovedEvent):
+        if not event.is_directory:
+            self._discard(event.src_path)
+            self._update(event.dest_path)
+
+    # endregion
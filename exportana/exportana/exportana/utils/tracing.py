@@ -0,0 +1,203 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+__ALL__ = ["Span", "configure", "root_span", "span", "profile_if_slow"]
+
+log = logging.getLogger(__name__)
+
+SERVICE_NAME = "exportana"
+# OTLP span kind and status codes
+SPAN_KIND_INTERNAL = 1
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+PROFILE_STATS_LINES = 40
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str] = None
+    start_time_ns: int = 0
+    end_time_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    # spans of the whole trace, shared by the root and its descendants
+    recorded: List["Span"] = field(default_factory=list, repr=False)
+
+    @property
+    def duration_sec(self) -> float:
+        return (self.end_time_ns - self.start_time_ns) / 1e9
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        result = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns),
+            "attributes": [{"key": k, "value": _to_otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": STATUS_CODE_ERROR, "message": self.error} if self.error else {"code": STATUS_CODE_OK},
+        }
+        if self.parent_span_id:
+            result["parentSpanId"] = self.parent_span_id
+        return result
+
+
+def _to_otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("exportana_current_span", default=None)
+_spans_dir: Optional[str] = None
+
+
+def configure(spans_dir: Optional[str]):
+    """Spans are recorded only if there is a dir to write them to"""
+    global _spans_dir
+    if spans_dir:
+        os.makedirs(spans_dir, exist_ok=True)
+    _spans_dir = spans_dir
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def _run_span(new_span: Span) -> Iterator[Span]:
+    token = _current_span.set(new_span)
+    new_span.start_time_ns = time.time_ns()
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        new_span.end_time_ns = time.time_ns()
+        new_span.recorded.append(new_span)
+        _current_span.reset(token)
+
+
+@contextmanager
+def root_span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Starts recording the spans of a trace, they are written to the spans dir as OTLP JSON once the root ends.
+    Without the spans dir nothing is recorded and the nested `span`s cost nothing.
+    """
+    if not _spans_dir:
+        yield None
+        return
+    root = Span(name=name, trace_id=secrets.token_hex(16), span_id=secrets.token_hex(8), attributes=attributes)
+    try:
+        with _run_span(root):
+            yield root
+    finally:
+        _export(root)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """A child of the current span, tasks created inside inherit it as their parent"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(
+        name=name,
+        trace_id=parent.trace_id,
+        span_id=secrets.token_hex(8),
+        parent_span_id=parent.span_id,
+        attributes=attributes,
+        recorded=parent.recorded
+    )
+    with _run_span(child):
+        yield child
+
+
+def _export(root: Span):
+    file_name = f"{root.attributes.get('trace_name') or root.name}.{root.trace_id[:8]}.otlp.json"
+    path = os.path.join(_spans_dir, file_name)
+    document = {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": __name__},
+            "spans": [s.to_otlp() for s in sorted(root.recorded, key=lambda s: s.start_time_ns)]
+        }]
+    }]}
+    try:
+        with open(path, "w") as f:
+            json.dump(document, f)
+    except OSError as e:
+        log.warning(f"Tracing. Can't write spans to {path}: {e}")
+        return
+    log.info(f"Tracing. {root.name} took {root.duration_sec:.2f}s, {len(root.recorded)} span(s) written to {path}")
+
+
+# region profiling
+_profiling_lock = threading.Lock()
+
+
+@contextmanager
+def profile_if_slow(name: str, profile_dir: Optional[str], slower_than_sec: float) -> Iterator[None]:
+    """
+    Profiles the block with cProfile and dumps the stats if it took longer than `slower_than_sec`:
+    `<name>.prof` for pstats/snakeviz and `<name>.prof.txt` with the top functions by cumulative time.
+    The profiler is per process, so one block at a time is profiled, the concurrent ones run as they are.
+    It is a profile of the whole event loop over the block, not of the block alone: the other traces,
+    the receiver requests and the heartbeats running meanwhile are in it too.
+    """
+    if not profile_dir or not _profiling_lock.acquire(blocking=False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - start
+        if duration > slower_than_sec:
+            _dump_profile(profiler, name, profile_dir, duration)
+        _profiling_lock.release()
+
+
+def _dump_profile(profiler: cProfile.Profile, name: str, profile_dir: str, duration: float):
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f"{name}.prof")
+        profiler.dump_stats(path)
+        text = io.StringIO()
+        text.write(f"{name}: {duration:.2f}s, everything the event loop ran meanwhile included\n")
+        pstats.Stats(profiler, stream=text).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_STATS_LINES)
+        with open(path + ".txt", "w") as f:
+            f.write(text.getvalue())
+    except OSError as e:
+        log.warning(f"Profiling. Can't write the profile of {name} to {profile_dir}: {e}")
+        return
+    log.info(f"Profiling. {name} took {duration:.2f}s, profile written to {path}")
+
+# endregion
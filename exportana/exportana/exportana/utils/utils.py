@@ -8,12 +8,8 @@ import traceback
 from contextlib import contextmanager
 from functools import wraps
 from time import perf_counter
-from typing import Dict, Any, List
+from typing import Any, Dict, List
 
-import dns.name
-import dns.resolver
-import dns.reversename
-from dns.exception import DNSException
 from exportana.configs import Configs
 from exportana.exporter.constants import PATH_DELIMITER
 from exportana.utils.compatibility import removesuffix
@@ -48,18 +44,6 @@ def timing(msg: str, log_level=logging.DEBUG):
     return duration
 
 
-def get_hostname_from_ip(ip, full_dns=False) -> str:
-    try:  # try to back resolve the name
-        answer = dns.resolver.Resolver().resolve(dns.reversename.from_address(ip), "PTR")
-        ip = str(answer[0])
-        if full_dns is False:
-            ip = ip.split(".")[0]
-        ip = ip.lower()
-    except DNSException as e:
-        log.warning(f"Can't back resolve {ip}. {type(e).__name__}: {e}")
-    return ip
-
-
 def human_read_to_byte(size: str):
     size_name = ("b", "kb", "mb", "gb", "tb", "pb", "eb", "zb", "yb")
     size = re.findall(r"[A-Za-z]+|\d+", size.lower())